@@ -0,0 +1,83 @@
+"""Benchmarks the time-quantization engine of `Disaggregator.preparation` against the previous, per-row
+implementation, over synthetic full days.
+
+Usage:
+    python benchmarks/bench_preparation.py [--days N] [--repeat N]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from CleanEmonCore.models import EnergyData
+
+from CleanEmonBackend.Disaggregator.preparation import energy_data_to_dataframe
+from CleanEmonBackend.Disaggregator.preparation import INTERVAL
+from CleanEmonBackend.Disaggregator.preparation import PERIODS
+from CleanEmonBackend.lib.synthetic import synthetic_day
+
+
+def legacy_quantize_by_time(df: pd.DataFrame) -> pd.DataFrame:
+    today = df.index[0]
+    tz = df.index[0].tz
+    continuous_index = pd.date_range(today, periods=PERIODS, freq=pd.Timedelta(seconds=INTERVAL), tz=tz)
+    new_df = pd.DataFrame(index=continuous_index, columns=df.columns)
+    intersection = new_df.index.intersection(df.index)
+    new_df.loc[intersection] = df.loc[intersection].values
+    return new_df
+
+
+def legacy_energy_data_to_dataframe(data: EnergyData, timestamp_label: str = "timestamp") -> pd.DataFrame:
+    df = pd.DataFrame(data.energy_data)
+    df[f"original_{timestamp_label}"] = df[timestamp_label].copy()
+    df[timestamp_label] = pd.to_datetime(df[timestamp_label], unit='s')
+    df[timestamp_label] = pd.DatetimeIndex(df[timestamp_label])
+    df = df.set_index(timestamp_label)
+    df.index = df.index.map(lambda date: date.round(pd.Timedelta(seconds=INTERVAL)))
+    df = df[~df.index.duplicated(keep="first")]
+    df = legacy_quantize_by_time(df)
+    df = df.reset_index()
+    df = df.rename(columns={"index": timestamp_label})
+    df[timestamp_label] = df[timestamp_label].apply(lambda x: x.timestamp())
+    df[timestamp_label] = df[timestamp_label].astype(str)
+    return df
+
+
+def assert_same_output(data: EnergyData):
+    legacy = legacy_energy_data_to_dataframe(data)
+    vectorized = energy_data_to_dataframe(data)
+
+    assert list(legacy.columns) == list(vectorized.columns)
+    assert (legacy["timestamp"] == vectorized["timestamp"]).all()
+    for col in legacy.columns[1:]:
+        assert np.array_equal(legacy[col].astype(float), vectorized[col].astype(float), equal_nan=True), col
+
+
+def timeit(fn, data, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=3, help="number of synthetic days")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per day (best one is kept)")
+    args = parser.parse_args()
+
+    print(f"{'day':>4} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+    for day in range(args.days):
+        data = synthetic_day(seed=day)
+        assert_same_output(data)
+        legacy = timeit(legacy_energy_data_to_dataframe, data, args.repeat)
+        vectorized = timeit(energy_data_to_dataframe, data, args.repeat)
+        print(f"{day:>4} {legacy:>12.4f} {vectorized:>15.4f} {legacy / vectorized:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
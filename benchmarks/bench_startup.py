@@ -0,0 +1,94 @@
+"""Benchmarks the startup time of the API and the CLI, each in a fresh interpreter, reporting which heavy modules they
+load.
+
+Every case imports what its command needs before doing any actual work: `service api` imports the app that uvicorn
+serves, `script disaggregate` imports the script that parses the dates and drives the disaggregation.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N] [--output results.json]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from typing import Dict
+from typing import List
+
+HEAVY_MODULES = ("pandas", "matplotlib", "torch", "scipy")
+
+CASES = {
+    "import package": "CleanEmonBackend",
+    "service api": "CleanEmonBackend.API",
+    "script disaggregate": "CleanEmonBackend.scripts.disaggregate",
+}
+
+# Runs in the fresh interpreter: times the import and reports it along with the heavy modules that it loaded
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_s": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int) -> Dict:
+    imports = []
+    processes = []
+    loaded = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                   capture_output=True, text=True, check=True)
+        processes.append(time.perf_counter() - start)
+
+        probe = json.loads(completed.stdout.strip().splitlines()[-1])
+        imports.append(probe["import_s"])
+        loaded = probe["loaded"]
+
+    return {
+        "module": module,
+        "import_best_s": min(imports),
+        "import_median_s": statistics.median(imports),
+        "process_median_s": statistics.median(processes),
+        "heavy_modules": loaded,
+    }
+
+
+def run(repeat: int) -> List[Dict]:
+    results = []
+    print(f"{'case':<22} {'import best (s)':>16} {'median (s)':>11} {'process (s)':>12}  heavy modules")
+    for name, module in CASES.items():
+        result = dict(name=name, **measure(module, repeat))
+        results.append(result)
+        print(f"{name:<22} {result['import_best_s']:>16.3f} {result['import_median_s']:>11.3f} "
+              f"{result['process_median_s']:>12.3f}  {', '.join(result['heavy_modules']) or '-'}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per case")
+    parser.add_argument("--output", help="where the JSON results are written")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+
+    if args.output:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "results": results,
+        }
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
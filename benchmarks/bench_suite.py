@@ -0,0 +1,217 @@
+"""Benchmarks the data and disaggregation hot paths over synthetic full days, reporting time and peak memory.
+
+Results are written as JSON, so that they can be kept along with each version and compared against later runs.
+
+Usage:
+    python benchmarks/bench_suite.py [--repeat N] [--output results.json] [--compare baseline.json] [--tolerance X]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import datetime
+
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import pandas as pd
+
+from CleanEmonCore.models import EnergyData
+
+from CleanEmonBackend.API.API import get_date_consumption
+from CleanEmonBackend.Disaggregator.preparation import dataframe_to_energy_data
+from CleanEmonBackend.Disaggregator.preparation import energy_data_to_dataframe
+from CleanEmonBackend.Disaggregator.preparation import quantize_by_time
+from CleanEmonBackend.lib import DBConnector
+from CleanEmonBackend.lib import plots
+from CleanEmonBackend.lib.plots import plot_data
+from CleanEmonBackend.lib.serialization import dumps
+from CleanEmonBackend.lib.synthetic import synthetic_day
+
+SCHEMA_VERSION = 1
+
+
+class Case:
+    """A benchmarked function. `setup` is called before every run, outside of the measurements, and returns the
+    arguments of the function.
+    """
+
+    def __init__(self, name: str, fn: Callable, setup: Callable[[], Tuple]):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+
+
+def measure(case: Case, repeat: int) -> Dict:
+    """Runs the case `repeat` times for timing and once more for its peak memory, which is traced separately since
+    tracing slows everything down.
+    """
+
+    times = []
+    for _ in range(repeat):
+        args = case.setup()
+        start = time.perf_counter()
+        case.fn(*args)
+        times.append(time.perf_counter() - start)
+
+    args = case.setup()
+    tracemalloc.start()
+    try:
+        case.fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "name": case.name,
+        "repeat": repeat,
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "peak_bytes": peak,
+    }
+
+
+def indexed_dataframe(day: EnergyData) -> pd.DataFrame:
+    """The time-indexed dataframe that `quantize_by_time` receives from `energy_data_to_dataframe`"""
+
+    df = pd.DataFrame(day.energy_data)
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop("timestamp"), unit="s"))
+    return df
+
+
+def offline_database(day: EnergyData, workdir: str):
+    """Serves `day` instead of the central database and caches into `workdir`"""
+
+    def fetch_energy_data_by_date(date, sensors=None):
+        records = day.energy_data
+        if sensors is not None:
+            records = [{sensor: record.get(sensor) for sensor in sensors} for record in records]
+        return EnergyData(date, records)
+
+    DBConnector.adapter.fetch_energy_data_by_date = fetch_energy_data_by_date
+    DBConnector.adapter.fetch_revision_by_date = lambda date: "1-a"
+    DBConnector.adapter.fetch_energy_data_with_revision = lambda date, sensors=None: (
+        fetch_energy_data_by_date(date, sensors), "1-a")
+    DBConnector.CACHE_DIR = os.path.join(workdir, "cache")
+    plots.PLOT_DIR = os.path.join(workdir, "plots")
+    os.makedirs(plots.PLOT_DIR, exist_ok=True)
+
+
+def cold_caches():
+    """Drops every cached day and summary, so that the next request starts from the database"""
+
+    DBConnector.memory_cache.clear()
+    DBConnector.summary_index.clear()
+    shutil.rmtree(DBConnector.CACHE_DIR, ignore_errors=True)
+    return ()
+
+
+def build_cases(day: EnergyData) -> List[Case]:
+    prepared = energy_data_to_dataframe(day)
+    indexed = indexed_dataframe(day)
+    date = day.date
+
+    return [
+        Case("energy_data_to_dataframe", energy_data_to_dataframe, lambda: (day,)),
+        Case("quantize_by_time", quantize_by_time, lambda: (indexed.copy(),)),
+        Case("dataframe_to_energy_data", dataframe_to_energy_data, lambda: (prepared.copy(),)),
+        Case("get_date_consumption[cold]", lambda: get_date_consumption(date, False, True), cold_caches),
+        Case("get_date_consumption[warm]", lambda: get_date_consumption(date, False, True), lambda: ()),
+        Case("plot_data", lambda: plot_data(day, name="benchmark"), lambda: ()),
+        Case("json[serialization.dumps]", dumps, lambda: (day,)),
+        Case("json[json.dumps]", lambda data: json.dumps(asdict(data)).encode(), lambda: (day,)),
+    ]
+
+
+def environment() -> Dict:
+    try:
+        from importlib.metadata import version
+        package_version = version("CleanEmon-Backend")
+    except Exception:
+        package_version = None
+
+    return {
+        "version": package_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": __import__("numpy").__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Returns the names of the cases that got slower than `tolerance` times their baseline (best) time"""
+
+    baseline_times = {result["name"]: result["best_s"] for result in baseline["results"]}
+
+    regressions = []
+    print(f"\n{'case':<30} {'baseline (s)':>13} {'current (s)':>12} {'ratio':>7}")
+    for result in results:
+        if result["name"] not in baseline_times:
+            continue
+        ratio = result["best_s"] / baseline_times[result["name"]]
+        flag = "  REGRESSION" if ratio > tolerance else ""
+        print(f"{result['name']:<30} {baseline_times[result['name']]:>13.4f} {result['best_s']:>12.4f} "
+              f"{ratio:>6.2f}x{flag}")
+        if ratio > tolerance:
+            regressions.append(result["name"])
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic day")
+    parser.add_argument("--output", help="where the JSON results are written (default: stdout only)")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="slowdown ratio above which a case counts as a regression (default: 1.25)")
+    args = parser.parse_args()
+
+    day = synthetic_day(seed=args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        offline_database(day, workdir)
+
+        results = []
+        print(f"{'case':<30} {'best (s)':>10} {'median (s)':>11} {'peak (MiB)':>11}")
+        for case in build_cases(day):
+            result = measure(case, args.repeat)
+            results.append(result)
+            print(f"{result['name']:<30} {result['best_s']:>10.4f} {result['median_s']:>11.4f} "
+                  f"{result['peak_bytes'] / 2 ** 20:>11.1f}")
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "input": {"date": day.date, "records": len(day.energy_data), "seed": args.seed},
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=2)
+    else:
+        print(json.dumps(report))
+
+    if args.compare:
+        with open(args.compare, "r") as f_in:
+            regressions = compare(results, json.load(f_in), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
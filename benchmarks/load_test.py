@@ -0,0 +1,187 @@
+"""Drives the API with mixed traffic against an in-memory stand-in of the central database, reporting the throughput and
+the latency percentiles of each endpoint.
+
+The database is simulated by `InMemoryAdapter`, whose latency can be configured to match production. Caches live in a
+temporary directory, so every run starts cold.
+
+Usage:
+    python benchmarks/load_test.py [--requests N] [--concurrency N] [--latency S] [--jitter S] [--days N]
+                                   [--mix json_date=4,json_range=2,consumption=3,plot=1] [--output results.json]
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from CleanEmonBackend.API import create_app
+from CleanEmonBackend.lib import DBConnector
+from CleanEmonBackend.lib.fake_adapter import InMemoryAdapter
+
+DEFAULT_MIX = "json_date=4,json_range=2,consumption=3,plot=1"
+TODAY_RATIO = 0.1  # Ratio of requests about today, whose data keep changing
+
+
+def past_dates(days: int) -> List[str]:
+    today = date.today()
+    return [(today - timedelta(days=n)).isoformat() for n in range(1, days + 1)]
+
+
+def traffic(dates: List[str]) -> Dict[str, Callable[[random.Random], str]]:
+    """Returns endpoint -> function that builds a (random) request URL for that endpoint"""
+
+    def pick_date(rng: random.Random) -> str:
+        return "today" if rng.random() < TODAY_RATIO else rng.choice(dates)
+
+    def pick_range(rng: random.Random, max_days: int = 7) -> Tuple[str, str]:
+        start = rng.randrange(len(dates))
+        end = min(len(dates) - 1, start + rng.randrange(max_days))
+        return dates[end], dates[start]  # `dates` go backwards in time
+
+    def json_date(rng: random.Random) -> str:
+        return rng.choice([
+            f"/json/date/{pick_date(rng)}",
+            f"/json/date/{pick_date(rng)}?sensors=power,kwh&max_points=1000",
+        ])
+
+    def json_range(rng: random.Random) -> str:
+        from_date, to_date = pick_range(rng)
+        return f"/json/range/{from_date}/{to_date}?sensors=power&max_points=2000"
+
+    def consumption(rng: random.Random) -> str:
+        from_date, to_date = pick_range(rng, max_days=31)
+        return rng.choice([
+            f"/json/date/{pick_date(rng)}/consumption",
+            f"/json/range/{from_date}/{to_date}/consumption",
+        ])
+
+    def plot(rng: random.Random) -> str:
+        return f"/plot/date/{pick_date(rng)}?sensors=power&width=6&height=3&dpi=50"
+
+    return {
+        "json_date": json_date,
+        "json_range": json_range,
+        "consumption": consumption,
+        "plot": plot,
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        endpoint, _, weight = part.partition("=")
+        weights[endpoint.strip()] = float(weight or 1)
+    return weights
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (np.nan,) * 3
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else None,
+        "mean_ms": float(latencies_ms.mean()) if len(latencies_ms) else None,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def run(requests: int, concurrency: int, mix: Dict[str, float], dates: List[str], seed: int) -> Dict:
+    app = create_app()
+    builders = traffic(dates)
+
+    unknown = set(mix) - set(builders)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(seed)
+    endpoints = rng.choices(list(mix), weights=list(mix.values()), k=requests)
+    plan = [(endpoint, builders[endpoint](rng)) for endpoint in endpoints]
+
+    local = threading.local()
+    latencies = {endpoint: [] for endpoint in mix}
+    errors = {endpoint: 0 for endpoint in mix}
+
+    def send(request: Tuple[str, str]):
+        endpoint, url = request
+        if not hasattr(local, "client"):
+            local.client = TestClient(app)
+
+        start = time.perf_counter()
+        response = local.client.get(url)
+        latency = time.perf_counter() - start
+
+        latencies[endpoint].append(latency)  # list.append is atomic
+        if response.status_code >= 400:
+            errors[endpoint] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, plan))
+    elapsed = time.perf_counter() - start
+
+    report = {endpoint: summarize(latencies[endpoint], errors[endpoint], elapsed) for endpoint in mix}
+    report["total"] = summarize([latency for endpoint in mix for latency in latencies[endpoint]],
+                                sum(errors.values()), elapsed)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="total number of requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated database round-trip time (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="maximum extra database round-trip time (seconds)")
+    parser.add_argument("--days", type=int, default=30, help="number of past days the traffic is spread over")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the traffic")
+    parser.add_argument("--output", help="where the JSON results are written")
+    args = parser.parse_args()
+
+    adapter = InMemoryAdapter(latency=args.latency, jitter=args.jitter)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        DBConnector.CACHE_DIR = f"{workdir}/cache"
+        DBConnector.plot_cache.directory = f"{workdir}/plots"
+        previous = DBConnector.use_adapter(adapter)
+        try:
+            results = run(args.requests, args.concurrency, parse_mix(args.mix), past_dates(args.days), args.seed)
+        finally:
+            DBConnector.use_adapter(previous)
+
+    print(f"{'endpoint':<12} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} "
+          f"{'p99 (ms)':>9}")
+    for endpoint, result in results.items():
+        print(f"{endpoint:<12} {result['requests']:>9} {result['errors']:>7} {result['throughput_rps']:>8.1f} "
+              f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+    print(f"Database operations: {adapter.operations}")
+
+    if args.output:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": vars(args),
+            "database_operations": adapter.operations,
+            "results": results,
+        }
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,95 @@
 """This module defines the core functionality of the API"""
 
 import os
-from datetime import datetime
-from datetime import timedelta
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 
 from typing import List
 from typing import Dict
 from typing import Union
 from typing import Any
+from typing import Iterator
+from typing import Sequence
+from typing import Optional
+
+import numpy as np
+import requests
 
 from CleanEmonCore.models import EnergyData
 
 from .. import RES_DIR
-from ..lib.DBConnector import fetch_data
-from ..lib.DBConnector import adapter
-from ..lib.plots import plot_data
-
-
-def get_data(date: str, from_cache: bool, sensors: List[str] = None) -> EnergyData:
+from ..lib.DBConnector import fetch_day
+from ..lib.DBConnector import fetch_many
+from ..lib.DBConnector import fetch_summary
+from ..lib.DBConnector import fetch_columns
+from ..lib.DBConnector import FETCH_CONCURRENCY
+from ..lib.DBConnector import fetch_meta
+from ..lib.DBConnector import fetch_revision
+from ..lib.DBConnector import response_cache
+from ..lib.DBConnector import current_house
+from ..lib.DBConnector import list_houses
+from ..lib.DBConnector import using_house
+from ..lib.DBConnector import sensor_projection
+from ..lib.DBConnector import plot_cache
+from ..lib.plots import render_plot
+from ..lib.plots import render_envelope_plot
+from ..lib.plots import DEFAULT_WIDTH
+from ..lib.plots import DEFAULT_HEIGHT
+from ..lib.plots import DEFAULT_DPI
+from ..lib.plot_cache import plot_key
+from ..lib.columnar import ColumnarEnergyData
+from ..lib.dates import date_range
+from ..lib.dates import is_past
+from ..lib.downsampling import DownsamplingMethod
+from ..lib.downsampling import bucket_aggregate
+from ..lib.downsampling import minmax_envelope
+from ..lib.downsampling import downsample_day
+from ..lib.stats import describe
+from ..lib.stats import DEFAULT_PERCENTILES
+from ..lib.serialization import dumps
+from ..lib.metrics import count_cache
+from ..lib.metrics import timed
+from ..lib.exceptions import BadDateError
+from ..lib.exceptions import UnknownHouseError
+
+logger = logging.getLogger(__name__)
+
+
+def get_data(date: str, from_cache: bool, sensors: List[str] = None, max_points: int = None,
+             method: DownsamplingMethod = DownsamplingMethod.lttb, revision: str = None) -> EnergyData:
     """Fetches and prepares the daily data that will be returned, filtering in the provided `sensors`.
     Note that there is no need to explicitly specify the "timestamp sensor", as it will always be included.
 
     date -- a valid date string in `YYYY-MM-DD` format
     from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
     sensors -- an inclusive list containing the values of interest
+    max_points -- if given, data are downsampled to (about) that many records
+    method -- the DownsamplingMethod to be used along with `max_points`
+    revision -- the current revision of the data, if it is already known
     """
 
-    raw_data = fetch_data(date, from_cache=from_cache).energy_data
-
-    if sensors:
-        if "timestamp" not in sensors:
-            sensors.append("timestamp")
+    day = fetch_day(date, from_cache=from_cache, sensors=sensors, revision=revision)
+    with timed("prepare"):
+        day = downsample_day(replace(day, date=date), max_points, method)
 
-        filtered_data = []
-        for record in raw_data:
-            filtered_record = {sensor: value for sensor, value in record.items() if sensor in sensors}
-            filtered_data.append(filtered_record)
-        data = filtered_data
-    else:
-        data = raw_data
-
-    return EnergyData(date, data)
+        # Records are only built for the (possibly downsampled) data that are actually returned
+        return day.to_energy_data()
 
 
-def get_range_data(from_date: str, to_date: str, use_cache: bool, sensors: List[str] = None) -> Dict:
+def get_range_data(from_date: str, to_date: str, use_cache: bool, sensors: List[str] = None, max_points: int = None,
+                   method: DownsamplingMethod = DownsamplingMethod.lttb,
+                   concurrency: int = FETCH_CONCURRENCY) -> Dict:
     """Fetches and prepares the range data that will be returned.
 
     from_date -- a valid date string in `YYYY-MM-DD` format
     to_date -- a valid date string in `YYYY-MM-DD` format. It MUST be chronologically greater or equal to `from_date`
     from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
     sensors -- an inclusive list containing the values of interest
+    max_points -- if given, data are downsampled to (about) that many records in total, evenly shared among the days
+    method -- the DownsamplingMethod to be used along with `max_points`
+    concurrency -- the maximum number of days that are fetched concurrently
     """
 
     # Define the range data schema
@@ -60,31 +100,277 @@ def get_range_data(from_date: str, to_date: str, use_cache: bool, sensors: List[
         "range_data": []
     }
 
-    from_dt = datetime.strptime(from_date, "%Y-%m-%d")
-    to_dt = datetime.strptime(to_date, "%Y-%m-%d")
-    one_day = timedelta(days=1)
-
-    # Concatenate energy data from multiple dates into a single list
-    now = from_dt
-    while now <= to_dt:
-        now_str = now.strftime("%Y-%m-%d")
-        daily_data = get_data(now_str, use_cache, sensors)
-        data["range_data"].append(daily_data)
-        now += one_day
+    # Concatenate energy data from multiple dates into a single list. Days are fetched concurrently, but they are
+    # always given back in chronological order
+    data["range_data"].extend(iter_range_data(from_date, to_date, use_cache, sensors, max_points=max_points,
+                                              method=method, concurrency=concurrency))
 
     return data
 
 
-def get_plot(date: str, from_cache: bool, sensors: List[str] = None) -> str:
+def iter_range_data(from_date: str, to_date: str, use_cache: bool, sensors: List[str] = None, max_points: int = None,
+                    method: DownsamplingMethod = DownsamplingMethod.lttb, chunk_size: int = None,
+                    concurrency: int = FETCH_CONCURRENCY, revisions: Dict[str, str] = None) -> Iterator[EnergyData]:
+    """Lazy counterpart of `get_range_data`. Yields the data of each date as soon as it gets fetched, in chronological
+    order, so that only a bounded number of days is held in memory at any time.
+
+    from_date -- a valid date string in `YYYY-MM-DD` format
+    to_date -- a valid date string in `YYYY-MM-DD` format. It MUST be chronologically greater or equal to `from_date`
+    use_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
+    sensors -- an inclusive list containing the values of interest
+    max_points -- if given, data are downsampled to (about) that many records in total, evenly shared among the days
+    method -- the DownsamplingMethod to be used along with `max_points`
+    chunk_size -- if given, each day is further split into chunks of at most `chunk_size` records
+    concurrency -- the maximum number of days that are fetched concurrently
+    revisions -- date -> current revision of its data, for the dates whose revision is already known
+    """
+
+    dates = date_range(from_date, to_date)
+    daily_points = -(-max_points // len(dates)) if max_points and dates else None
+    revisions = revisions or {}
+
+    def fetch(date: str, **kwargs) -> ColumnarEnergyData:
+        return fetch_day(date, revision=revisions.get(date), **kwargs)
+
+    for date, day in zip(dates, fetch_many(dates, from_cache=use_cache, sensors=sensors, concurrency=concurrency,
+                                           fetch=fetch)):
+        day = downsample_day(replace(day, date=date), daily_points, method)
+        if not chunk_size:
+            yield day.to_energy_data()
+        else:
+            # Records are built one chunk at a time
+            for start in range(0, len(day), chunk_size):
+                yield day.take(slice(start, start + chunk_size)).to_energy_data()
+
+
+def iter_ndjson(energy_data_iter: Iterator[EnergyData]) -> Iterator[bytes]:
+    """Serializes each EnergyData object into a single line of newline-delimited JSON"""
+
+    for energy_data in energy_data_iter:
+        yield dumps({"date": energy_data.date, "energy_data": energy_data.energy_data}) + b"\n"
+
+
+def encode_data(date: str, from_cache: bool, sensors: List[str] = None, max_points: int = None,
+                method: DownsamplingMethod = DownsamplingMethod.lttb, revision: str = None) -> bytes:
+    """Returns `get_data` encoded as JSON bytes.
+
+    The encodings of past dates are kept in memory, along with the revision of the data they were encoded from. They
+    are served as they are if `from_cache` is set. Otherwise, they are served only if the data are still at the same
+    revision, which is checked without fetching the data.
+
+    date -- a valid date string in `YYYY-MM-DD` format
+    from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
+    sensors -- an inclusive list containing the values of interest
+    max_points -- if given, data are downsampled to (about) that many records
+    method -- the DownsamplingMethod to be used along with `max_points`
+    revision -- the current revision of the data, if it is already known
+    """
+
+    method = DownsamplingMethod(method)
+
+    if not is_past(date):
+        energy_data = get_data(date, from_cache, sensors, max_points, method)
+        return dumps({"date": energy_data.date, "energy_data": energy_data.energy_data})
+
+    key = (current_house.get(), date, sensor_projection(sensors), max_points, method.value)
+    cached = response_cache.get(key)
+    if cached is not None and from_cache:
+        count_cache("response", True)
+        return cached[1]
+
+    if revision is None:
+        with timed("fetch"):
+            revision = fetch_revision(date)
+    count_cache("response", cached is not None and cached[0] == revision)
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+
+    # Cached data are served only if they are at `revision`, unless `from_cache` is set
+    energy_data = get_data(date, from_cache, sensors, max_points, method, revision=revision)
+    encoded = dumps({"date": energy_data.date, "energy_data": energy_data.energy_data})
+    if revision and not from_cache and energy_data.energy_data:
+        response_cache.put(key, (revision, encoded))
+
+    return encoded
+
+
+def _iter_encoded_days(from_date: str, to_date: str, use_cache: bool, sensors: List[str], max_points: int,
+                       method: DownsamplingMethod, concurrency: int,
+                       revisions: Dict[str, str] = None) -> Iterator[bytes]:
+    """Yields the encoding of each day of the range (see `encode_data`), in chronological order"""
+
+    dates = date_range(from_date, to_date)
+    daily_points = -(-max_points // len(dates)) if max_points and dates else None
+    revisions = revisions or {}
+
+    def encode(date: str, **kwargs) -> bytes:
+        return encode_data(date, max_points=daily_points, method=method, revision=revisions.get(date), **kwargs)
+
+    return fetch_many(dates, from_cache=use_cache, sensors=sensors, concurrency=concurrency, fetch=encode)
+
+
+def encode_range_data(from_date: str, to_date: str, use_cache: bool, sensors: List[str] = None,
+                      max_points: int = None, method: DownsamplingMethod = DownsamplingMethod.lttb,
+                      concurrency: int = FETCH_CONCURRENCY, revisions: Dict[str, str] = None) -> bytes:
+    """Returns `get_range_data` encoded as JSON bytes. It is assembled from the encodings of its days, so past days
+    that were already encoded are not encoded again.
+
+    revisions -- date -> current revision of its data, for the dates whose revision is already known
+    """
+
+    days = b",".join(_iter_encoded_days(from_date, to_date, use_cache, sensors, max_points, method, concurrency,
+                                        revisions))
+    return b"".join([b'{"from_date":', dumps(from_date), b',"to_date":', dumps(to_date), b',"range_data":[', days,
+                     b"]}"])
+
+
+def iter_range_ndjson(from_date: str, to_date: str, use_cache: bool, sensors: List[str] = None,
+                      max_points: int = None, method: DownsamplingMethod = DownsamplingMethod.lttb,
+                      chunk_size: int = None, concurrency: int = FETCH_CONCURRENCY,
+                      revisions: Dict[str, str] = None) -> Iterator[bytes]:
+    """Yields `iter_range_data` as newline-delimited JSON. Unless days are split into chunks, the encodings of past
+    days are reused.
+
+    revisions -- date -> current revision of its data, for the dates whose revision is already known
+    """
+
+    if chunk_size:
+        yield from iter_ndjson(iter_range_data(from_date, to_date, use_cache, sensors, max_points=max_points,
+                                               method=method, chunk_size=chunk_size, concurrency=concurrency,
+                                               revisions=revisions))
+        return
+
+    for encoded_day in _iter_encoded_days(from_date, to_date, use_cache, sensors, max_points, method, concurrency,
+                                          revisions):
+        yield encoded_day + b"\n"
+
+
+def get_revisions(from_date: str, to_date: str, concurrency: int = FETCH_CONCURRENCY) -> Dict[str, str]:
+    """Returns the current revision of the data of each date of the range, without fetching the data. Dates without
+    data have an empty revision.
+    """
+
+    dates = date_range(from_date, to_date)
+    revisions = fetch_many(dates, concurrency=concurrency, fetch=lambda date, **kwargs: fetch_revision(date))
+    return dict(zip(dates, revisions))
+
+
+def data_etag(revisions: Sequence[str], *params: Any) -> str:
+    """Returns a strong ETag for a representation of data of the current house at the given `revisions`. `params` must
+    hold everything else that affects the representation (e.g. the selected sensors).
+    """
+
+    content = [current_house.get(), list(revisions), [str(param) for param in params]]
+    digest = hashlib.sha256(dumps(content)).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def get_plot(date: str, from_cache: bool, sensors: List[str] = None, width: float = DEFAULT_WIDTH,
+             height: float = DEFAULT_HEIGHT, dpi: int = DEFAULT_DPI) -> str:
     """Fetches and plots the desired data. Returns the path of the resulting plot.
 
+    Plots are kept in a content-addressed cache. Since past dates do not change (unless they get disaggregated, which
+    invalidates their plots), their plots are served straight from the cache.
+
     date -- a valid date string in `YYYY-MM-DD` format
     from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
     sensors -- an inclusive list containing the values of interest
+    width, height -- the size of the plot in inches
+    dpi -- the resolution of the plot
     """
 
-    energy_data = get_data(date, from_cache, sensors)
-    f_out = plot_data(energy_data, columns=sensors)
+    key = plot_key(date, sensors, width, height, dpi, house=current_house.get())
+    if is_past(date):
+        cached_path = plot_cache.get(key)
+        count_cache("plot", cached_path is not None)
+        if cached_path:
+            return cached_path
+
+    day = fetch_day(date, from_cache=from_cache, sensors=sensors)
+    with timed("plot"):
+        f_out = plot_cache.put(key, lambda f: render_plot(replace(day, date=date), f, columns=sensors, width=width,
+                                                          height=height, dpi=dpi))
+
+    return os.path.join(RES_DIR, f_out)
+
+
+def _range_envelopes(dates: List[str], from_cache: bool, sensors: List[str], n_buckets: int, concurrency: int):
+    """Fetches the given dates concurrently and reduces each sensor of each day into `n_buckets` (min, max) buckets.
+    Returns the timestamp of each bucket, sensor -> (minimum, maximum) of each bucket, and the (timestamp, date) pairs
+    where each day starts.
+    """
+
+    xs = []
+    lowers = {}
+    uppers = {}
+    day_starts = []
+
+    for date, columns in zip(dates, fetch_many(dates, from_cache=from_cache, sensors=sensors, concurrency=concurrency,
+                                               fetch=fetch_columns)):
+        timestamps = columns.get("timestamp")
+        if timestamps is None or not len(timestamps):
+            continue
+
+        x = bucket_aggregate(timestamps, n_buckets, "first")
+        xs.append(x)
+        day_starts.append((float(x[0]), date))
+
+        for sensor, values in columns.items():
+            # Skip any timestamp-like label
+            if "timestamp" in sensor.lower():
+                continue
+            lower, upper = minmax_envelope(values, n_buckets)
+            lowers.setdefault(sensor, {})[date] = lower
+            uppers.setdefault(sensor, {})[date] = upper
+
+    # Sensors may be missing from some days, which are then left blank
+    envelopes = {}
+    for sensor in lowers:
+        lower_parts = []
+        upper_parts = []
+        for x, (_, date) in zip(xs, day_starts):
+            blank = np.full(len(x), np.nan)
+            lower_parts.append(lowers[sensor].get(date, blank))
+            upper_parts.append(uppers[sensor].get(date, blank))
+        envelopes[sensor] = (np.concatenate(lower_parts), np.concatenate(upper_parts))
+
+    x = np.concatenate(xs) if xs else np.array([])
+    return x, envelopes, day_starts
+
+
+def get_range_plot(from_date: str, to_date: str, from_cache: bool, sensors: List[str] = None,
+                   width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT, dpi: int = DEFAULT_DPI,
+                   concurrency: int = FETCH_CONCURRENCY) -> str:
+    """Fetches and plots the data of the given range. Returns the path of the resulting plot.
+
+    Days are fetched concurrently and every sensor is reduced to a min/max envelope of about one bucket per horizontal
+    pixel, so the cost of drawing does not grow with the length of the range. Plots of past ranges are served straight
+    from the plot cache.
+
+    from_date -- a valid date string in `YYYY-MM-DD` format
+    to_date -- a valid date string in `YYYY-MM-DD` format. It MUST be chronologically greater or equal to `from_date`
+    from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
+    sensors -- an inclusive list containing the values of interest
+    width, height -- the size of the plot in inches
+    dpi -- the resolution of the plot
+    concurrency -- the maximum number of days that are fetched concurrently
+    """
+
+    key = plot_key(f"{from_date}..{to_date}", sensors, width, height, dpi, house=current_house.get())
+    if is_past(to_date):
+        cached_path = plot_cache.get(key)
+        count_cache("plot", cached_path is not None)
+        if cached_path:
+            return cached_path
+
+    dates = date_range(from_date, to_date)
+    n_buckets = max(-(-int(width * dpi) // max(len(dates), 1)), 1)
+    x, envelopes, day_starts = _range_envelopes(dates, from_cache, sensors, n_buckets, concurrency)
+
+    with timed("plot"):
+        f_out = plot_cache.put(key, lambda f: render_envelope_plot(f"{from_date} - {to_date}", x, envelopes, f,
+                                                                   ticks=day_starts,
+                                                                   width=width, height=height, dpi=dpi))
 
     return os.path.join(RES_DIR, f_out)
 
@@ -94,32 +380,15 @@ def get_date_consumption(date: str, from_cache: bool, simplify: bool):
 
     Acts as an under-the-curve measurement by subtracting the lowest power measurement from the highest one.
     It's not given that the first record of the energy data will always contain valid power values and thus, the "first
-    value" is actually searched and cherry-picked. Same goes for the "last valid value".
+    value" is actually searched and cherry-picked. Same goes for the "last valid value". Past dates are answered from
+    the daily summary index, without touching their records.
 
     date -- a valid date string in `YYYY-MM-DD` format
     from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
     simplify -- if true, returns a single value, not a JSON object
     """
 
-    data = get_data(date, from_cache)
-
-    kwh_list = [record["kwh"] for record in data.energy_data]
-
-    # Find the first valid kwh measurement
-    first_valid = 0
-    for kwh in kwh_list:
-        if kwh:
-            first_valid = kwh
-            break
-
-    # Find the last valid kwh measurement
-    last_valid = 0
-    for kwh in reversed(kwh_list):
-        if kwh:
-            last_valid = kwh
-            break
-
-    consumption = last_valid - first_valid
+    consumption = fetch_summary(date, from_cache=from_cache).consumption
     if simplify:
         data = consumption
     else:
@@ -131,6 +400,54 @@ def get_date_consumption(date: str, from_cache: bool, simplify: bool):
     return data
 
 
+def _fetch_consumption_day(date: str, *, from_cache: bool, sensors: List[str] = None):
+    columns = fetch_columns(date, from_cache=from_cache, sensors=sensors)
+    # The day is now cached, so its summary can be safely looked up there
+    summary = fetch_summary(date, from_cache=True)
+    return summary, columns
+
+
+def get_range_consumption(from_date: str, to_date: str, from_cache: bool, sensors: List[str] = None,
+                          percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                          concurrency: int = FETCH_CONCURRENCY) -> Dict:
+    """Returns the daily and total consumption (in kwh) of a date range, along with descriptive statistics (min, max,
+    mean and percentiles) of each sensor over the whole range. Days are fetched concurrently and all statistics are
+    computed on their columns in a single vectorized pass.
+
+    from_date -- a valid date string in `YYYY-MM-DD` format
+    to_date -- a valid date string in `YYYY-MM-DD` format. It MUST be chronologically greater or equal to `from_date`
+    from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
+    sensors -- the sensors to be described. If omitted, all sensors are described
+    percentiles -- the percentiles (0-100) to be computed for each sensor
+    concurrency -- the maximum number of days that are fetched concurrently
+    """
+
+    dates = date_range(from_date, to_date)
+
+    daily_consumption = []
+    sensor_values = {}
+    for date, (summary, columns) in zip(dates, fetch_many(dates, from_cache=from_cache, sensors=sensors,
+                                                          concurrency=concurrency, fetch=_fetch_consumption_day)):
+        daily_consumption.append({"date": date, "consumption": summary.consumption})
+
+        for sensor, values in columns.items():
+            if sensor != "timestamp":
+                sensor_values.setdefault(sensor, []).append(values)
+
+    statistics = {sensor: describe(np.concatenate(values), percentiles) for sensor, values in sensor_values.items()}
+
+    return {
+        "from_date": from_date,
+        "to_date": to_date,
+        "consumption": {
+            "daily": daily_consumption,
+            "total": sum(day["consumption"] for day in daily_consumption),
+            "unit": "kwh"
+        },
+        "statistics": statistics
+    }
+
+
 def get_mean_consumption(date: str, from_cache: bool) -> float:
     """Hardcoded fetch-prepare function that returns the daily consumption over the size of the building.
     If the given building has no appropriate information (e.g. no "size" meta-data) -1 is being returned.
@@ -144,15 +461,46 @@ def get_mean_consumption(date: str, from_cache: bool) -> float:
 
     consumption: float = get_date_consumption(date, from_cache, simplify=True)
 
-    if has_meta(_size_field):
-        size = float(get_meta(_size_field))
+    meta = get_meta()
+    if _has_field(meta, _size_field):
+        size = float(meta[_size_field])
         if size:
             return consumption / size
     return -1
 
 
+def get_fleet_mean_consumption(date: str, from_cache: bool, concurrency: int = FETCH_CONCURRENCY) -> Dict:
+    """Returns the mean consumption (see `get_mean_consumption`) of every house, computed concurrently, along with their
+    average. Houses without size information or whose database is unavailable are left out of the average.
+
+    date -- a valid date string in `YYYY-MM-DD` format
+    from_cache -- specifies whether the data should be searched in cache first. This may speed up the response time
+    concurrency -- the maximum number of houses that are processed concurrently
+    """
+
+    houses = list_houses()
+
+    def house_mean_consumption(house: str) -> Optional[float]:
+        try:
+            with using_house(house):
+                return get_mean_consumption(date, from_cache)
+        except (requests.RequestException, UnknownHouseError, BadDateError) as e:
+            logger.warning("Mean consumption of %s on %s is unavailable: %s: %s", house, date, type(e).__name__, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(houses)))) as executor:
+        means = dict(zip(houses, executor.map(house_mean_consumption, houses)))
+
+    valid = [mean for mean in means.values() if mean is not None and mean != -1]
+    return {
+        "date": date,
+        "houses": means,
+        "mean": sum(valid) / len(valid) if valid else -1
+    }
+
+
 def get_meta(field: str = None) -> Union[Dict, Any]:
-    meta = adapter.fetch_meta()
+    meta = fetch_meta()
     if not field:
         return meta
     else:
@@ -161,11 +509,13 @@ def get_meta(field: str = None) -> Union[Dict, Any]:
     return {}
 
 
-def has_meta(field: str) -> bool:
-    meta = get_meta()
-
+def _has_field(meta: Dict, field: str) -> bool:
     if field not in meta:
         return False
 
     value = meta[field]
     return value != "null"
+
+
+def has_meta(field: str) -> bool:
+    return _has_field(get_meta(), field)
@@ -1,30 +1,121 @@
 """This defines the FastAPI boostrap function"""
 
+import os
+import re
 import datetime
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
 from typing import Optional
 
+from fastapi import Depends
 from fastapi import FastAPI
+from fastapi import Query
 from fastapi import Request
+from fastapi import Response
 from fastapi.responses import JSONResponse
 from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.routing import Match
+
+from ..lib.serialization import JSON_MEDIA_TYPE
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+PAST_MAX_AGE = 3600  # Seconds that clients may reuse responses about past dates without revalidating them
+COMPRESSION_MIN_SIZE = 1024  # Responses smaller than that (in bytes) are not worth compressing
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Returns True if `etag` is among the ETags of an `If-None-Match` header"""
+
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.replace("W/", "", 1) == etag:
+            return True
+
+    return False
+
+
+def caching_headers(etag: str, past: bool) -> Dict[str, str]:
+    """Returns the caching headers of a response. Data of past dates rarely change, so clients may reuse them for a
+    while. Anything else must be revalidated (cheaply, thanks to the ETag) every time.
+    """
+
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={PAST_MAX_AGE}" if past else "no-cache"
+    }
+
+
+def conditional_response(request: Request, etag: Optional[str], past: bool,
+                         make_response: Callable[[], Response]) -> Response:
+    """Returns 304 (Not Modified) if the client already holds the representation identified by `etag`, without
+    calling `make_response` at all. Otherwise, returns the response of `make_response` along with its caching headers.
+    Without an ETag, the response is returned as is.
+    """
+
+    if etag is None:
+        return make_response()
+
+    headers = caching_headers(etag, past)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    response = make_response()
+    response.headers.update(headers)
+    return response
 
 
 def create_app():
     """Creates the FastAPI app"""
 
-    from .API import get_data
-    from .API import get_range_data
+    from .API import encode_data
+    from .API import encode_range_data
+    from .API import iter_range_ndjson
     from .API import get_date_consumption
+    from .API import get_range_consumption
     from .API import get_mean_consumption
+    from .API import get_fleet_mean_consumption
     from .API import get_plot
+    from .API import get_range_plot
     from .API import get_meta
     from .API import has_meta
+    from .API import get_revisions
+    from .API import data_etag
 
     from ..lib.exceptions import BadDateError
     from ..lib.exceptions import BadDateRangeError
+    from ..lib.exceptions import BadPercentilesError
+    from ..lib.exceptions import UnknownHouseError
+
+    from ..lib.DBConnector import current_house
+    from ..lib.DBConnector import list_houses
+    from ..lib.DBConnector import resolve_house
 
     from ..lib.validation import is_valid_date
     from ..lib.validation import is_valid_date_range
+    from ..lib.dates import is_past
+
+    from ..lib import metrics
+    from ..lib.profiling import ProfileSession
+    from ..lib.profiling import current_session
+    from ..lib.profiling import is_admin
+    from ..lib.profiling import profile_path
+    from ..lib.profiling import profiled
+
+    from ..lib.downsampling import DownsamplingMethod
+    from ..lib.stats import DEFAULT_PERCENTILES
+    from ..lib.plots import DEFAULT_WIDTH
+    from ..lib.plots import DEFAULT_HEIGHT
+    from ..lib.plots import DEFAULT_DPI
+    from ..lib.plots import MAX_DPI
+    from ..lib.plots import MAX_SIZE
 
     meta_tags = [
         {
@@ -37,7 +128,40 @@ def create_app():
         }
     ]
 
-    app = FastAPI(openapi_tags=meta_tags, swagger_ui_parameters={"defaultModelsExpandDepth": -1})
+    async def select_house(house: Optional[str] = Query(None, description="The database of the house whose data are "
+                                                                             "served. Defaults to the main house")):
+        """Serves the data of the requested house. Every request runs in its own context, so the selection does not
+        leak to other requests.
+        """
+
+        current_house.set(resolve_house(house))
+
+    app = FastAPI(openapi_tags=meta_tags, swagger_ui_parameters={"defaultModelsExpandDepth": -1},
+                  dependencies=[Depends(select_house)])
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+    def endpoint_of(request: Request) -> str:
+        """Returns the route template that matches the request, so that metrics are not split per date"""
+
+        for route in app.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                return route.path
+        return "other"
+
+    @app.middleware("http")
+    async def instrument(request: Request, call_next):
+        endpoint = endpoint_of(request)
+        status = 500
+        start = time.perf_counter()
+        with metrics.REQUESTS_IN_FLIGHT.track_in_progress(endpoint=endpoint):
+            try:
+                response = await call_next(request)
+                status = response.status_code
+            finally:
+                metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                                                method=request.method, status=str(status))
+        return response
 
     def parse_date(date: str) -> str:
         """Simple date parser. A date can either be in a standard YYYY-MM-DD format or a predefined alias.
@@ -58,6 +182,59 @@ def create_app():
 
         return parsed_date
 
+    def parse_percentiles(percentiles: str) -> List[float]:
+        """Parses a comma (,) separated list of percentiles. If any of them is not a number between 0 and 100, a
+        BadPercentilesError is being raised.
+        """
+
+        try:
+            parsed_percentiles = [float(p) for p in percentiles.split(',')]
+        except ValueError:
+            raise BadPercentilesError(percentiles)
+
+        if not all(0 <= p <= 100 for p in parsed_percentiles):
+            raise BadPercentilesError(percentiles)
+
+        return parsed_percentiles
+
+    def range_revisions(from_date: str, to_date: str, from_cache: bool) -> Optional[Dict[str, str]]:
+        """Returns the current revisions of the dates of the given range. Cached data may lag behind those revisions,
+        so, when they are allowed, None is returned instead.
+        """
+
+        if from_cache:
+            return None
+
+        return get_revisions(from_date, to_date)
+
+    def revisions_etag(revisions: Optional[Dict[str, str]], *params) -> Optional[str]:
+        if revisions is None:
+            return None
+
+        return data_etag([revisions[date] for date in sorted(revisions)], *params)
+
+    def range_etag(from_date: str, to_date: str, from_cache: bool, *params) -> Optional[str]:
+        return revisions_etag(range_revisions(from_date, to_date, from_cache), *params)
+
+    def admin_token_of(request: Request) -> Optional[str]:
+        authorization = request.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            return authorization[len("bearer "):].strip()
+        return request.headers.get("x-admin-token")
+
+    def forbidden_response():
+        return JSONResponse(status_code=403, content={"message": "This is only available to admins."})
+
+    def is_valid_plot_size(width: float, height: float, dpi: int) -> bool:
+        return 0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE and 0 < dpi <= MAX_DPI
+
+    def bad_plot_size_response():
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"Plot width and height must be between 0 and {MAX_SIZE} inches and dpi between 0 and "
+                                f"{MAX_DPI}."}
+        )
+
     @app.exception_handler(BadDateError)
     def bad_date_exception_handler(request: Request, exception: BadDateError):
         return JSONResponse(
@@ -73,8 +250,26 @@ def create_app():
                                 f"be in ISO format (YYYY-MM-DD) and placed in correct order."}
         )
 
+    @app.exception_handler(BadPercentilesError)
+    def bad_percentiles_exception_handler(request: Request, exception: BadPercentilesError):
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"Bad percentiles ({exception.bad_percentiles}). Percentiles must be numbers between 0 "
+                                f"and 100."}
+        )
+
+    @app.exception_handler(UnknownHouseError)
+    def unknown_house_exception_handler(request: Request, exception: UnknownHouseError):
+        return JSONResponse(
+            status_code=404,
+            content={"message": f"Unknown house ({exception.house})."}
+        )
+
     @app.get("/json/date/{date}", tags=["Views"])
-    def get_json_date(date: str = None, from_cache: bool = False, sensors: Optional[str] = None):
+    @profiled
+    def get_json_date(request: Request, date: str = None, from_cache: bool = False, sensors: Optional[str] = None,
+                      max_points: Optional[int] = Query(None, gt=0),
+                      method: DownsamplingMethod = DownsamplingMethod.lttb):
         """Returns the daily data for the supplied **{date}**.
 
         - **{date}**: A date in YYYY-MM-DD format
@@ -82,6 +277,12 @@ def create_app():
         data will be looked up in cache and then, if they are not found, fetched from the central database.
         - **sensors**: A comma (,) separated list of sensors to be returned. If present, only sensors defined in that
         list will be returned
+        - **max_points**: If present, data are downsampled to (about) that many records
+        - **method**: The downsampling method. `lttb` keeps the most significant original samples of each sensor, while
+        `mean`, `min` and `max` aggregate equally sized buckets of consecutive records
+
+        Unless **from_cache** is set, responses carry an ETag derived from the revision of the data, so that clients
+        can revalidate them with `If-None-Match`.
         """
 
         parsed_date = parse_date(date)
@@ -89,11 +290,23 @@ def create_app():
         if sensors:
             sensors = sensors.split(',')
 
-        return get_data(parsed_date, from_cache, sensors)
+        method = DownsamplingMethod(method)
+        revisions = range_revisions(parsed_date, parsed_date, from_cache)
+        revision = revisions[parsed_date] if revisions is not None else None
+        etag = revisions_etag(revisions, "json", sensors, max_points, method.value)
+
+        return conditional_response(
+            request, etag, is_past(parsed_date),
+            lambda: Response(encode_data(parsed_date, from_cache, sensors, max_points, method, revision=revision),
+                             media_type=JSON_MEDIA_TYPE)
+        )
 
     @app.get("/json/range/{from_date}/{to_date}", tags=["Views"])
-    def get_json_range(from_date: str, to_date: str, from_cache: bool = False,
-                       sensors: Optional[str] = None):
+    @profiled
+    def get_json_range(request: Request, from_date: str, to_date: str, from_cache: bool = False,
+                       sensors: Optional[str] = None, max_points: Optional[int] = Query(None, gt=0),
+                       method: DownsamplingMethod = DownsamplingMethod.lttb, stream: bool = False,
+                       chunk_size: Optional[int] = Query(None, gt=0)):
         """Returns the range data for the supplied range, from **{from_date}** to **{to_date}**.
 
         - **{from_date}**: A date in YYYY-MM-DD format
@@ -102,6 +315,15 @@ def create_app():
         data will be looked up in cache and then, if they are not found, fetched from the central database.
         - **sensors**: A comma (,) separated list of sensors to be returned. If present, only sensors defined in that
         list will be returned
+        - **max_points**: If present, data are downsampled to (about) that many records in total
+        - **method**: The downsampling method. `lttb` keeps the most significant original samples of each sensor, while
+        `mean`, `min` and `max` aggregate equally sized buckets of consecutive records
+        - **stream**: If set to True (or if `application/x-ndjson` is accepted), data are streamed as newline-delimited
+        JSON, one line per day, as soon as each day is fetched
+        - **chunk_size**: When streaming, split each day into lines of at most that many records
+
+        Unless **from_cache** is set, responses carry an ETag derived from the revisions of the data, so that clients
+        can revalidate them with `If-None-Match`.
         """
 
         if not is_valid_date_range(from_date, to_date):
@@ -110,38 +332,96 @@ def create_app():
         if sensors:
             sensors = sensors.split(',')
 
-        return get_range_data(from_date, to_date, from_cache, sensors)
+        method = DownsamplingMethod(method)
+        revisions = range_revisions(from_date, to_date, from_cache)
+        past = is_past(to_date)
+
+        if stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+            def make_stream_response() -> Response:
+                lines = iter_range_ndjson(from_date, to_date, from_cache, sensors, max_points=max_points,
+                                          method=method, chunk_size=chunk_size, revisions=revisions)
+                if current_session.get() is not None:
+                    # Streams are consumed after the handler returns, so a profiled request is served in one piece,
+                    # in order for the profile to cover the fetching and the encoding of the data
+                    return Response(b"".join(lines), media_type=NDJSON_MEDIA_TYPE)
+                return StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE)
+
+            etag = revisions_etag(revisions, "ndjson", sensors, max_points, method.value, chunk_size)
+            return conditional_response(request, etag, past, make_stream_response)
+
+        etag = revisions_etag(revisions, "json", sensors, max_points, method.value)
+        return conditional_response(
+            request, etag, past,
+            lambda: Response(encode_range_data(from_date, to_date, from_cache, sensors, max_points, method,
+                                               revisions=revisions), media_type=JSON_MEDIA_TYPE)
+        )
 
     @app.get("/plot/date/{date}", tags=["Experimental"])
-    def get_plot_date(date: str = None, from_cache: bool = False, sensors: Optional[str] = None):
-        """Returns the plot of the specified data, as a JPEG image.
+    @profiled
+    def get_plot_date(request: Request, date: str = None, from_cache: bool = False, sensors: Optional[str] = None,
+                      width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT, dpi: int = DEFAULT_DPI):
+        """Returns the plot of the specified data, as a PNG image.
 
         - **{date}**: A date in YYYY-MM-DD format
         - **from_cache**: If set to False, forces data to be fetched again from the central database. If set to True,
         data will be looked up in cache and then, if they are not found, fetched from the central database.
         - **sensors**: A comma (,) separated list of sensors to be returned. If present, only sensors defined in that
         list will be returned
+        - **width**, **height**: The size of the plot in inches
+        - **dpi**: The resolution of the plot, in dots per inch
         """
 
         parsed_date = parse_date(date)
 
+        if not is_valid_plot_size(width, height, dpi):
+            return bad_plot_size_response()
+
         if sensors:
             sensors = sensors.split(',')
 
-        plot_path = get_plot(parsed_date, from_cache, sensors)
+        etag = range_etag(parsed_date, parsed_date, from_cache, "png", sensors, width, height, dpi)
 
-        return FileResponse(plot_path, media_type="image/jpeg")
+        return conditional_response(
+            request, etag, is_past(parsed_date),
+            lambda: FileResponse(get_plot(parsed_date, from_cache, sensors, width, height, dpi), media_type="image/png")
+        )
 
     @app.get("/plot/range/{from_date}/{to_date}", tags=["Experimental"])
-    def get_plot_range(from_date: str, to_date: str, from_cache: bool = False,
-                       sensors: Optional[str] = None):
-        """Under construction :)"""
-        return JSONResponse(
-            status_code=501,
-            content={"message": "This feature is currently not implemented"}
+    @profiled
+    def get_plot_range(request: Request, from_date: str, to_date: str, from_cache: bool = False,
+                       sensors: Optional[str] = None, width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT,
+                       dpi: int = DEFAULT_DPI):
+        """Returns the plot of the supplied range, from **{from_date}** to **{to_date}**, as a PNG image. Each sensor
+        is drawn as its min/max envelope.
+
+        - **{from_date}**: A date in YYYY-MM-DD format
+        - **to_date**: A date in YYYY-MM-DD format. It should be chronologically greater or equal to **{from_date}**
+        - **from_cache**: If set to False, forces data to be fetched again from the central database. If set to True,
+        data will be looked up in cache and then, if they are not found, fetched from the central database.
+        - **sensors**: A comma (,) separated list of sensors to be plotted. If omitted, all sensors are plotted
+        - **width**, **height**: The size of the plot in inches
+        - **dpi**: The resolution of the plot, in dots per inch
+        """
+
+        if not is_valid_date_range(from_date, to_date):
+            raise BadDateRangeError(from_date, to_date)
+
+        if not is_valid_plot_size(width, height, dpi):
+            return bad_plot_size_response()
+
+        if sensors:
+            sensors = sensors.split(',')
+
+        etag = range_etag(from_date, to_date, from_cache, "png", sensors, width, height, dpi)
+
+        return conditional_response(
+            request, etag, is_past(to_date),
+            lambda: FileResponse(get_range_plot(from_date, to_date, from_cache, sensors, width, height, dpi),
+                                 media_type="image/png")
         )
 
     @app.get("/json/date/{date}/consumption", tags=["Views"])
+    @profiled
     def get_json_date_consumption(date: str = None, from_cache: bool = False, simplify: bool = False):
         """Returns the power consumption for the given date.
 
@@ -155,7 +435,36 @@ def create_app():
 
         return get_date_consumption(parsed_date, from_cache, simplify)
 
+    @app.get("/json/range/{from_date}/{to_date}/consumption", tags=["Views"])
+    @profiled
+    def get_json_range_consumption(from_date: str, to_date: str, from_cache: bool = False,
+                                   sensors: Optional[str] = None, percentiles: Optional[str] = None):
+        """Returns the daily and total power consumption for the supplied range, from **{from_date}** to
+        **{to_date}**, along with statistics (min, max, mean and percentiles) of each sensor over the whole range.
+
+        - **{from_date}**: A date in YYYY-MM-DD format
+        - **to_date**: A date in YYYY-MM-DD format. It should be chronologically greater or equal to **{from_date}**
+        - **from_cache**: If set to False, forces data to be fetched again from the central database. If set to True,
+        data will be looked up in cache and then, if they are not found, fetched from the central database
+        - **sensors**: A comma (,) separated list of sensors to be described. If omitted, all sensors are described
+        - **percentiles**: A comma (,) separated list of percentiles (0-100). Defaults to 5,25,50,75,95
+        """
+
+        if not is_valid_date_range(from_date, to_date):
+            raise BadDateRangeError(from_date, to_date)
+
+        if sensors:
+            sensors = sensors.split(',')
+
+        if percentiles:
+            percentiles = parse_percentiles(percentiles)
+        else:
+            percentiles = DEFAULT_PERCENTILES
+
+        return get_range_consumption(from_date, to_date, from_cache, sensors, percentiles)
+
     @app.get("/json/date/{date}/mean-consumption", tags=["Experimental"])
+    @profiled
     def get_json_date_mean_consumption(date: str = None, from_cache: bool = False):
         """Returns the power consumption over the size of the building for the given date.
 
@@ -167,8 +476,89 @@ def create_app():
 
         return get_mean_consumption(parsed_date, from_cache)
 
+    @app.get("/houses", tags=["Views"])
+    def get_houses():
+        """Returns the houses whose data can be served, the main one first. Any of them can be passed as the **house**
+        parameter of the other endpoints.
+        """
+
+        return list_houses()
+
+    @app.get("/fleet/date/{date}/mean-consumption", tags=["Experimental"])
+    @profiled
+    def get_fleet_date_mean_consumption(date: str = None, from_cache: bool = False):
+        """Returns the power consumption over the size of the building of every house for the given date, along with
+        their average. Houses are processed concurrently.
+
+        - **{date}**: A date in YYYY-MM-DD format
+        - **from_cache**: If set to False, forces data to be fetched again from the central database. If set to True,
+        data will be looked up in cache and then, if they are not found, fetched from the central database
+        """
+
+        parsed_date = parse_date(date)
+
+        return get_fleet_mean_consumption(parsed_date, from_cache)
+
+    @app.get("/metrics", tags=["Experimental"])
+    def get_metrics():
+        """Returns the metrics of the backend in the Prometheus text format: the time spent in each stage (fetch,
+        cache, prepare, inference, serialize, plot), cache hits and misses, requests in flight and the durations of
+        disaggregation jobs.
+        """
+
+        families = metrics.with_labels(metrics.REGISTRY.collect(), process="api")
+        disaggregator = metrics.with_labels(metrics.load_snapshot(metrics.DISAGGREGATOR_SNAPSHOT),
+                                            process="disaggregator")
+
+        return Response(metrics.render(families, disaggregator), media_type=metrics.CONTENT_TYPE)
+
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        """Runs the handler of the request under the profiler, if an admin asked so"""
+
+        flag = request.query_params.get("profile") or request.headers.get("x-profile") or ""
+        if flag.lower() not in ("true", "1"):
+            return await call_next(request)
+
+        if not is_admin(admin_token_of(request)):
+            return forbidden_response()
+
+        session = ProfileSession()
+        token = current_session.set(session)
+        try:
+            response = await call_next(request)
+        finally:
+            current_session.reset(token)
+
+        if await run_in_threadpool(session.save):
+            response.headers["X-Profile-Id"] = session.id
+            response.headers["X-Profile-Duration"] = f"{session.duration:.6f}"
+            response.headers["X-Profile-Peak-Memory"] = str(session.peak_memory)
+        return response
+
+    @app.get("/profiles/{profile_id}", tags=["Experimental"])
+    def get_profile(request: Request, profile_id: str, summary: bool = False):
+        """Returns a stored profile, in the pstats format (e.g. for `python -m pstats` or snakeviz). Admins only.
+
+        - **{profile_id}**: The id of the profile, as returned in the `X-Profile-Id` header of a request that was made
+        with `?profile=true`
+        - **summary**: If set to True, a text summary of the profile is returned instead
+        """
+
+        if not is_admin(admin_token_of(request)):
+            return forbidden_response()
+
+        path = profile_path(profile_id, summary=summary)
+        if not re.fullmatch(r"[0-9a-f]{32}", profile_id) or not os.path.isfile(path):
+            return JSONResponse(status_code=404, content={"message": f"No such profile ({profile_id})."})
+
+        if summary:
+            return FileResponse(path, media_type="text/plain")
+        return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
     @app.get("/meta/", tags=["Experimental"])
     @app.get("/meta/{field}", tags=["Experimental"])
+    @profiled
     def get_json_meta(field: str = None):
         """Returns the metadata for the current house.
 
@@ -179,6 +569,7 @@ def create_app():
         return get_meta(field)
 
     @app.get("/has-meta/{field}", tags=["Experimental"])
+    @profiled
     def get_has_meta(field: str):
         """Returns true if given **{field}** exists as metadata field, and it is not equal to string "null".
         """
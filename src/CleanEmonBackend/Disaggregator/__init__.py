@@ -1,3 +1,16 @@
-from .preparation import energy_data_to_dataframe
-from .preparation import dataframe_to_energy_data
-from .inference import disaggregate
+from importlib import import_module
+
+# The disaggregation stack (pandas, NILM-Inference-APIs) is heavy, so its entry points are only imported on first access
+_LAZY_ATTRIBUTES = {
+    "energy_data_to_dataframe": ".preparation",
+    "dataframe_to_energy_data": ".preparation",
+    "disaggregate": ".inference",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,44 +1,119 @@
 import os
+import threading
+from contextlib import contextmanager
 from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
 
 from .. import NILM_INPUT_FILE_PATH
-from .. import NILM_INPUT_DIR
 from ..lib.black_sorcery import nilm_path_fix
+from ..lib.metrics import timed
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where only in-process locking is supported
+    fcntl = None
 
-def _set_inference_input(df: pd.DataFrame) -> bool:
+SAMPLE_PERIOD = 5
+
+# Serializes the inference, as all runs share the same input file of NILM-Inference-APIs
+_input_file_lock = threading.Lock()
+
+# NILM-Inference-APIs' `nilm_inference` and the values of all known devices, once they are loaded (see `_nilm_stack`)
+_loaded_nilm_stack = None
+_nilm_stack_lock = threading.Lock()
+
+
+def _prepare_inference_input(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
 
     # Reformat as expected by NILM-Inference-APIs like "2022-05-16 00:00:17+01:00"
     df["Time"] = pd.to_datetime(df["Time"], unit='s')
-    if not os.path.exists(NILM_INPUT_DIR):
-        os.makedirs(NILM_INPUT_DIR, exist_ok=True)
+    return df
+
+
+def _set_inference_input(df: pd.DataFrame) -> bool:
+    os.makedirs(os.path.dirname(NILM_INPUT_FILE_PATH), exist_ok=True)
 
     df.to_csv(NILM_INPUT_FILE_PATH, index=False)
     return True
 
 
-def _disaggregate_to_files() -> List[Tuple[str, str]]:
-    with nilm_path_fix():
+@contextmanager
+def _exclusive_input_file():
+    """Grants exclusive access to the shared input file of NILM-Inference-APIs, among both threads and processes"""
+
+    with _input_file_lock:
+        if fcntl is None:
+            yield
+            return
+
+        os.makedirs(os.path.dirname(NILM_INPUT_FILE_PATH), exist_ok=True)
+
+        with open(f"{NILM_INPUT_FILE_PATH}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 
-        # ------------------------------------------------------#
-        # Extremely ~spooky~ and error prune piece of code      #
-        # Just for the history, this was deprecated since the   #
-        # time of writing.                                      #
-        #                                                       #
-        # Uncle Bob, if you are reading, please forgive me :(   #
-        # ------------------------------------------------------#
-        from lab.nilm_trainer import nilm_inference
-        from constants.enumerates import ElectricalAppliances
+def _load_nilm_stack():
+    """Imports NILM-Inference-APIs and returns its `nilm_inference` function along with the values of all known devices.
+    It must be called from within NILM-Inference-APIs' directory (see `nilm_path_fix`).
+    """
 
-        # Consider all known devices
-        devices = list(ElectricalAppliances)
-        devices = [dev.value for dev in devices]
+    # ------------------------------------------------------#
+    # Extremely ~spooky~ and error prune piece of code      #
+    # Just for the history, this was deprecated since the   #
+    # time of writing.                                      #
+    #                                                       #
+    # Uncle Bob, if you are reading, please forgive me :(   #
+    # ------------------------------------------------------#
+    from lab.nilm_trainer import nilm_inference
+    from constants.enumerates import ElectricalAppliances
 
-        return nilm_inference(devices=devices, sample_period=5, inference_cpu=True)
+    # Consider all known devices
+    devices = list(ElectricalAppliances)
+    devices = [dev.value for dev in devices]
+
+    return nilm_inference, devices
+
+
+def _nilm_stack():
+    """Loads NILM-Inference-APIs only once per process, so that consecutive dates (e.g. of the disaggregation service)
+    skip its import. It must be called from within NILM-Inference-APIs' directory (see `nilm_path_fix`).
+    """
+
+    global _loaded_nilm_stack
+
+    with _nilm_stack_lock:
+        if _loaded_nilm_stack is None:
+            _loaded_nilm_stack = _load_nilm_stack()
+        return _loaded_nilm_stack
+
+
+def _run_inference(nilm_inference, devices: List[str], df_input: pd.DataFrame) -> List[Tuple[str, np.ndarray]]:
+    """Runs the inference over `df_input` (columns "Time" and "mains") and returns the predictions of each device.
+
+    NILM-Inference-APIs only reads its input from (and writes its predictions to) files. The shared input file is
+    locked for the whole run, so that concurrent runs, even of different processes, never read each other's input.
+    """
+
+    with _exclusive_input_file():
+        _set_inference_input(df_input)
+        devices_files = nilm_inference(devices=devices, sample_period=SAMPLE_PERIOD, inference_cpu=True)
+
+        # Read data back into memory
+        return [(device, pd.read_csv(file, usecols=["preds"])["preds"].to_numpy(dtype=np.float64))
+                for device, file in devices_files]
+
+
+def _infer(df_input: pd.DataFrame) -> List[Tuple[str, np.ndarray]]:
+    with nilm_path_fix():
+        nilm_inference, devices = _nilm_stack()
+        return _run_inference(nilm_inference, devices, df_input)
 
 
 def disaggregate(df: pd.DataFrame, timestamp_label: str = "timestamp", target_label: str = "power") -> pd.DataFrame:
@@ -49,22 +124,17 @@ def disaggregate(df: pd.DataFrame, timestamp_label: str = "timestamp", target_la
     df_filtered[target_label] = df_filtered[target_label].fillna(df_filtered[target_label].mean().round())
     df_filtered = df_filtered.rename(columns={timestamp_label: "Time", target_label: "mains"})
 
-    # Write dataframe to input file
-    _set_inference_input(df_filtered)
-
     # Inference
-    devices_files = _disaggregate_to_files()
+    with timed("inference"):
+        devices_preds = _infer(_prepare_inference_input(df_filtered))
 
-    # Read data back into memory
-    for device, file in devices_files:
-        temp_df = pd.read_csv(file)
-        first_n_missing = df.shape[0] - temp_df.shape[0]
+    for device, preds in devices_preds:
+        first_n_missing = df.shape[0] - preds.shape[0]
 
         col_name = device.lower().replace(" ", "_")
         col_name = f"pred_{col_name}"
 
-        preds = pd.concat([pd.Series(np.zeros(first_n_missing)), temp_df["preds"]])
-        df[col_name] = preds.values
+        df[col_name] = np.concatenate([np.zeros(first_n_missing), preds])
     # Clear rows that originally had NaN as target value, but keep timestamps
     df.loc[df[target_label].isna(), df.columns != timestamp_label] = np.NaN
 
@@ -1,10 +1,15 @@
 from datetime import datetime
 import json
 
+from typing import Union
+
+import numpy as np
 import pandas as pd
 
 from CleanEmonCore.models import EnergyData
 
+from ..lib.columnar import ColumnarEnergyData
+
 INTERVAL = 5
 INTERVAL_STR = f"{INTERVAL}S"
 PERIODS = 60*60*24/INTERVAL
@@ -20,7 +25,7 @@ def revert_to_timestamp(f_datetime: str) -> str:
     return str(dt.timestamp())
 
 
-def quantize_by_time(df: pd.DataFrame) -> pd.DataFrame:
+def quantize_by_time(df: pd.DataFrame, *, interval: float = INTERVAL, periods: int = None) -> pd.DataFrame:
     """Accepts a dataframe indexed by non-continuous datetime objects and returns a fully continuous dataframe.
 
     _Continuous_ refers to the series that has no gaps. Not to be confused with _continuous/discrete_ terms.
@@ -60,61 +65,74 @@ def quantize_by_time(df: pd.DataFrame) -> pd.DataFrame:
         1. Round each timestamp to its closest quantum
         2. If more than one original samples map to the same quantum, keep only one of them
         3. Quantum with no value still get to stay in their position even they may be empty (no sample mapped to them)
+
+    This is done in a single vectorized pass over the int64 epochs of the index, so `df` may also be indexed by raw,
+    unrounded and duplicated timestamps, and span multiple days.
+
+    df -- a dataframe indexed by a DatetimeIndex
+    interval -- the length of each quantum in seconds
+    periods -- the number of quanta of the resulting dataframe, starting from the quantum of the first sample. If
+    omitted, a single day is covered. Samples that fall out of the covered period are dropped
     """
-    df.copy()
-    # Copy some datetime details from the original dataframe
-    today = df.index[0]
-    tz = df.index[0].tz
 
-    # Generate a new index consisting of continuous values
-    continuous_index = pd.date_range(today, periods=PERIODS, freq=INTERVAL_STR, tz=tz)
+    quantum = int(interval * 10**9)  # In nanoseconds
+    epochs = df.index.asi8
+
+    # 1. Round each timestamp to its closest quantum, with ties going to the even one (just like pandas' `round`)
+    remainder = epochs % quantum
+    rounded = epochs - remainder
+    half = quantum // 2
+    round_up = (remainder > half) | ((remainder == half) & ((rounded // quantum) % 2 == 1))
+    rounded = rounded + round_up * quantum
+
+    start = rounded[0] if len(rounded) else 0
+    slots = (rounded - start) // quantum
+
+    if periods is None:
+        periods = 60 * 60 * 24 // interval
+    periods = int(periods)
 
-    # Create the new dataframe with the continuous index
-    new_df = pd.DataFrame(index=continuous_index, columns=df.columns)
+    # 2. If more than one samples map to the same quantum, keep only the first of them
+    in_range = np.flatnonzero((slots >= 0) & (slots < periods))
+    slots, first = np.unique(slots[in_range], return_index=True)
+    positions = in_range[first]
 
-    # Specify which columns can be filled using the old values
-    intersection = new_df.index.intersection(df.index)
+    # 3. Quanta with no value still get to stay in their position, filled with NaN
+    new_df = df.iloc[positions]
+    new_df.index = slots
+    new_df = new_df.reindex(np.arange(periods))
 
-    # Fill the specified time slots with corresponding data from the old dataframe
-    new_df.loc[intersection] = df.loc[intersection].values
+    tz = df.index.tz
+    continuous_index = pd.DatetimeIndex(start + np.arange(periods, dtype=np.int64) * quantum)
+    if tz is not None:
+        continuous_index = continuous_index.tz_localize("UTC").tz_convert(tz)
+    new_df.index = continuous_index
 
     return new_df
 
 
-def energy_data_to_dataframe(data: EnergyData, timestamp_label: str = "timestamp") -> pd.DataFrame:
+def energy_data_to_dataframe(data: Union[EnergyData, ColumnarEnergyData],
+                             timestamp_label: str = "timestamp") -> pd.DataFrame:
     # Convert EnergyData to Dataframe
-    df = pd.DataFrame(data.energy_data)
+    if isinstance(data, ColumnarEnergyData):
+        df = data.to_dataframe()
+    else:
+        df = pd.DataFrame(data.energy_data)
 
     # Keep original timestamp column as "original_timestamp"
     df[f"original_{timestamp_label}"] = df[timestamp_label].copy()
 
-    df[timestamp_label] = pd.to_datetime(df[timestamp_label], unit='s')
-
-    # # Reformat as expected by NILM-Inference-APIs like "2022-05-16 00:00:17+01:00"
-    # df[timestamp_label] = df[timestamp_label].map(reformat_timestamp)
-
     # Index dataframe by time
-    df[timestamp_label] = pd.DatetimeIndex(df[timestamp_label])
-    df = df.set_index(timestamp_label)
-
-    # Quantize time. Every timestamp should be mapped into fixed intervals.
-    df.index = df.index.map(lambda date: date.round(INTERVAL_STR))
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop(timestamp_label), unit='s'))
 
-    # If more than one timestamp map into the same time quantum, arbitrarily remove all duplicates but the first
-    df = df[~df.index.duplicated(keep="first")]
-
-    # Generate a clean dataframe. All potentially empty time slots are filled
+    # Quantize time. Every timestamp is mapped into fixed intervals, duplicates are removed and all potentially empty
+    # time slots are filled, resulting in a clean dataframe.
     df = quantize_by_time(df)
 
-    # Reset index as expected by NILM-Inference-APIs
-    df = df.reset_index()
-    df = df.rename(columns={"index": timestamp_label})
-
-    # Get back the python timestamp format
-    df[timestamp_label] = df[timestamp_label].apply(lambda x: x.timestamp())
-
-    # Convert to string
-    df[timestamp_label] = df[timestamp_label].astype(str)
+    # Reset index as expected by NILM-Inference-APIs, getting back the python timestamp format as a string
+    timestamps = (df.index.asi8 / 10**9).astype(str)
+    df = df.reset_index(drop=True)
+    df.insert(0, timestamp_label, timestamps)
 
     return df
 
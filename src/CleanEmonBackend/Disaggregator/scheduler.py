@@ -0,0 +1,142 @@
+"""This module provides the catch-up scheduler of the disaggregation service.
+
+The scheduler keeps a persisted watermark: the latest date up to which every date has been disaggregated. Whenever it
+wakes up, it queues every date between the watermark and yesterday, disaggregates them with bounded parallelism and
+advances the watermark. Then, it sleeps until the next day boundary.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .. import DATA_DIR
+from ..lib.dates import date_range
+
+WATERMARK_FILE = os.path.join(DATA_DIR, "disaggregator.watermark")
+PARALLELISM = 2  # Maximum number of dates disaggregated at the same time
+MAX_ATTEMPTS = 4  # Attempts per date, before giving up until the next wake-up
+BACKOFF = 30  # Seconds to wait before the first retry. Doubled on every subsequent retry
+DAY_START_DELAY = 60  # Seconds to wait after midnight, so that the last records of the previous day can arrive
+
+
+def read_watermark(path: str = WATERMARK_FILE) -> Optional[str]:
+    """Returns the date up to which everything is disaggregated, or None if there is no such information"""
+
+    try:
+        with open(path, "r") as f_in:
+            watermark = f_in.read().strip()
+    except OSError:
+        return None
+
+    return watermark or None
+
+
+def write_watermark(watermark: str, path: str = WATERMARK_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f_out:
+        f_out.write(watermark)
+    os.replace(tmp_path, path)
+
+
+def _shift_date(date_id: str, days: int) -> str:
+    return (datetime.strptime(date_id, "%Y-%m-%d") + timedelta(days=days)).date().isoformat()
+
+
+def missing_dates(watermark: Optional[str], today: date) -> List[str]:
+    """Returns the dates after `watermark` up to yesterday. Without a watermark, only yesterday is considered
+    missing.
+    """
+
+    yesterday = (today - timedelta(days=1)).isoformat()
+    if watermark is None:
+        return [yesterday]
+
+    return date_range(_shift_date(watermark, 1), yesterday)
+
+
+def seconds_until_next_day(now: datetime, delay: float = DAY_START_DELAY) -> float:
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (tomorrow - now).total_seconds() + delay
+
+
+class CatchUpScheduler:
+    """Disaggregates every date that has been missed, e.g. during downtime, and then keeps up with each new day"""
+
+    def __init__(self, update: Callable[[str], None], *, watermark_file: str = WATERMARK_FILE,
+                 parallelism: int = PARALLELISM, max_attempts: int = MAX_ATTEMPTS, backoff: float = BACKOFF,
+                 now: Callable[[], datetime] = datetime.now, sleep: Callable[[float], None] = time.sleep):
+        """
+        update -- the function that disaggregates a single date
+        watermark_file -- the path where the watermark is persisted
+        parallelism -- the maximum number of dates that are disaggregated at the same time
+        max_attempts -- the number of attempts per date, before giving up until the next wake-up
+        backoff -- seconds before the first retry of a date. Doubled on every subsequent retry
+        now, sleep -- time functions, mainly overridden for testing
+        """
+
+        self.update = update
+        self.watermark_file = watermark_file
+        self.parallelism = max(1, parallelism)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.now = now
+        self.sleep = sleep
+
+    def _update_with_retries(self, date_id: str) -> Optional[str]:
+        """Disaggregates `date_id`, retrying with exponential backoff. Returns the last error or None on success."""
+
+        error = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                self.update(date_id)
+                return None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"Disaggregation of {date_id} failed (attempt {attempt + 1}/{self.max_attempts}): {error}")
+
+        return error
+
+    def run_once(self) -> Dict[str, str]:
+        """Disaggregates all missing dates and advances the watermark. Returns the dates that failed, along with their
+        errors. The watermark never moves past a failed date, so that it is retried on the next wake-up.
+        """
+
+        previous_watermark = read_watermark(self.watermark_file)
+        dates = missing_dates(previous_watermark, self.now().date())
+        if not dates:
+            return {}
+
+        print(f"Disaggregating {len(dates)} missing dates: {dates[0]} .. {dates[-1]}")
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            errors = dict(zip(dates, executor.map(self._update_with_retries, dates)))
+
+        failures = {date_id: error for date_id, error in errors.items() if error}
+
+        # Advance the watermark up to the first failed date. Without a previous watermark, it is set right before the
+        # first date at least, so that the dates that failed on the very first run are still retried later on
+        watermark = _shift_date(dates[0], -1)
+        for date_id in dates:
+            if date_id in failures:
+                break
+            watermark = date_id
+        if watermark != previous_watermark:
+            write_watermark(watermark, self.watermark_file)
+
+        return failures
+
+    def run(self):
+        """Catches up and then sleeps until the next day boundary, forever"""
+
+        while True:
+            self.run_once()
+            self.sleep(seconds_until_next_day(self.now()))
@@ -1,36 +1,50 @@
-from datetime import date
-from datetime import timedelta
+import time
 
-from CleanEmonCore.Events import Observer
-from CleanEmonCore.Events.builtins import DateChange
-
-from ..lib.DBConnector import fetch_data
+from ..lib.DBConnector import fetch_records
 from ..lib.DBConnector import send_data
+from ..lib.metrics import DISAGGREGATION_SECONDS
+from ..lib.metrics import DISAGGREGATOR_SNAPSHOT
+from ..lib.metrics import save_snapshot
+from ..lib.metrics import timed
 
-from ..Disaggregator import energy_data_to_dataframe
-from ..Disaggregator import dataframe_to_energy_data
-from ..Disaggregator import disaggregate
+from ..Disaggregator.scheduler import CatchUpScheduler
 
 
 def update(yesterday: str):
-    energy_data = fetch_data(yesterday)
-    df = energy_data_to_dataframe(energy_data)
-
-    df = disaggregate(df)
-    dis_energy_data = dataframe_to_energy_data(df)
-    send_data(yesterday, dis_energy_data)
+    # Loaded here, so that merely importing the service (e.g. by the CLI) does not load the disaggregation stack
+    from ..Disaggregator import energy_data_to_dataframe
+    from ..Disaggregator import dataframe_to_energy_data
+    from ..Disaggregator import disaggregate
+
+    start = time.perf_counter()
+    result = "failure"
+    try:
+        energy_data = fetch_records(yesterday)
+        with timed("prepare"):
+            df = energy_data_to_dataframe(energy_data)
+
+        df = disaggregate(df)
+        with timed("prepare"):
+            dis_energy_data = dataframe_to_energy_data(df)
+        with timed("send"):
+            send_data(yesterday, dis_energy_data)
+        result = "success"
+    finally:
+        DISAGGREGATION_SECONDS.observe(time.perf_counter() - start, result=result)
+
+
+def _update_and_save_metrics(yesterday: str):
+    # The service runs in its own process, so its metrics are handed over to the API through a snapshot
+    try:
+        update(yesterday)
+    finally:
+        # Metrics are not worth failing (and so retrying) the disaggregation of a date
+        try:
+            save_snapshot(DISAGGREGATOR_SNAPSHOT)
+        except OSError as e:
+            print(f"Could not save the metrics snapshot: {e}")
 
 
 def run():
-    class Updater(Observer):
-        def on_notify(self, *args, **kwargs):
-            if "date" in kwargs:
-                yesterday = kwargs["date"]
-            else:  # By default, get the previous date
-                yesterday = date.today() - timedelta(days=1)
-            update(str(yesterday))
-
-    event = DateChange(3, initial_date=date.today())  # todo: increase interval to reduce execution time?
-    Updater(event)
-
-    event.run()
+    # Catch up with the dates missed while the service was down, then wake up once per day
+    CatchUpScheduler(_update_and_save_metrics).run()
@@ -14,13 +14,31 @@ CACHE_DIR = os.path.join(DATA_DIR, "cache")
 PLOT_DIR = os.path.join(DATA_DIR, "plots")
 
 # --- NILM-Inference-APIs ---
+# The NILM paths are only needed for disaggregation, so they are resolved on first access (see `__getattr__`), rather
+# than every time the package is imported
 _NILM_CONFIG = "NILM-Inference-APIs.path"
-NILM_CONFIG = get_dotfile(_NILM_CONFIG)
-with open(NILM_CONFIG, "r") as f_in:
-    NILM_INFERENCE_APIS_DIR = f_in.read().strip()
+_NILM_ATTRIBUTES = ("NILM_CONFIG", "NILM_INFERENCE_APIS_DIR", "NILM_INPUT_DIR", "NILM_INPUT_FILE_PATH")
 
-NILM_INPUT_DIR = os.path.join(NILM_INFERENCE_APIS_DIR, "input", "data")
-if not os.path.exists(NILM_INPUT_DIR):
-    os.makedirs(NILM_INPUT_DIR, exist_ok=True)
 
-NILM_INPUT_FILE_PATH = os.path.join(NILM_INPUT_DIR, "data.csv")
+def _load_nilm_paths():
+    global NILM_CONFIG, NILM_INFERENCE_APIS_DIR, NILM_INPUT_DIR, NILM_INPUT_FILE_PATH
+
+    NILM_CONFIG = get_dotfile(_NILM_CONFIG)
+    with open(NILM_CONFIG, "r") as f_in:
+        NILM_INFERENCE_APIS_DIR = f_in.read().strip()
+
+    NILM_INPUT_DIR = os.path.join(NILM_INFERENCE_APIS_DIR, "input", "data")
+    if not os.path.exists(NILM_INPUT_DIR):
+        os.makedirs(NILM_INPUT_DIR, exist_ok=True)
+
+    NILM_INPUT_FILE_PATH = os.path.join(NILM_INPUT_DIR, "data.csv")
+
+
+def __getattr__(name: str):
+    if name == "NILM_CONFIG":
+        # Resolving the config file alone must not require a valid config (e.g. `setup nilm` is about to write it)
+        return get_dotfile(_NILM_CONFIG)
+    if name in _NILM_ATTRIBUTES:
+        _load_nilm_paths()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
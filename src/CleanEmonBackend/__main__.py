@@ -9,15 +9,24 @@ service_parser.add_argument("service_name", action="store", choices=["api", "dis
 
 # Script
 script_parser = subparsers.add_parser("script", help="Run a script")
-script_parser.add_argument("script_name", action="store", choices=["disaggregate"])
+script_parser.add_argument("script_name", action="store", choices=["disaggregate", "migrate-cache"])
 script_parser.add_argument("dates", nargs="*",
-                           help="list of dates (YYYY-MM-DD) to be used in `disaggregate` or `reset`")
+                           help="list of dates (YYYY-MM-DD) or date ranges (YYYY-MM-DD..YYYY-MM-DD) to be used in "
+                                "`disaggregate` or `reset`")
 script_parser.add_argument("--no-safe", action="store_false", default=False,
                            help="prompt before proceeding with critical actions")
+script_parser.add_argument("-j", "--jobs", type=int, default=1,
+                           help="number of dates to be processed in parallel (at most 2). Only their fetching and "
+                                "uploading overlap, as the inference of only one date can run at any time")
+script_parser.add_argument("--fresh", action="store_true", default=False,
+                           help="ignore the checkpoint of a previously interrupted `disaggregate`")
+script_parser.add_argument("--house", default=None,
+                           help="the database of the house to work on, as listed in the config file (default: the "
+                                "main house)")
 
 # Setup
 setup_parser = subparsers.add_parser("setup", help="Setup the backend system")
-setup_parser.add_argument("setup_name", action="store", choices=["nilm"])
+setup_parser.add_argument("setup_name", action="store", choices=["nilm", "admin-token"])
 args = parser.parse_args()
 
 if "service_name" in args:
@@ -32,9 +41,16 @@ elif "script_name" in args:
     if args.script_name == "disaggregate":
         from CleanEmonBackend.scripts.disaggregate import disaggregate
         if args.dates:
-            disaggregate(*args.dates, no_prompt=args.no_safe)
+            disaggregate(*args.dates, no_prompt=args.no_safe, jobs=args.jobs, fresh=args.fresh,
+                         house=args.house)
         else:
             print("You should provide at least one date")
+    elif args.script_name == "migrate-cache":
+        from . import CACHE_DIR
+        from .lib.columnar_cache import migrate_cache_dir
+
+        migrated = migrate_cache_dir(CACHE_DIR)
+        print(f"Migrated {len(migrated)} cached dates to the columnar format")
 
 elif "setup_name" in args:
     if args.setup_name == "nilm":
@@ -42,3 +58,7 @@ elif "setup_name" in args:
         from CleanEmonBackend.scripts.setup import generate_nilm_inference_apis_config
 
         generate_nilm_inference_apis_config(NILM_CONFIG)
+    elif args.setup_name == "admin-token":
+        from CleanEmonBackend.scripts.setup import generate_admin_token_file
+
+        generate_admin_token_file()
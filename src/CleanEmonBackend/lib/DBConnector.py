@@ -1,50 +1,467 @@
 """This module contains a set of utilities used to transform and prepare data for torch-nilm inference"""
 
 import os
-import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from contextvars import copy_context
+
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
 
 from CleanEmonCore import CONFIG_FILE
 from CleanEmonCore.models import EnergyData
-from CleanEmonCore.CouchDBAdapter import CouchDBAdapter
 
 from .. import CACHE_DIR
+from .. import PLOT_DIR
+from .adapters import EnergyDataAdapter
+from .adapters import PooledCouchDBAdapter
+from .exceptions import UnknownHouseError
+from .houses import AdapterPool
+from .houses import configured_houses
+from .columnar import ColumnarEnergyData
+from .memory_cache import MemoryCache
+from .metrics import CallbackGauge
+from .metrics import count_cache
+from .metrics import timed
+from .meta_cache import MetaCache
+from .columnar_cache import drop_day
+from .columnar_cache import load_columns
+from .columnar_cache import load_records
+from .columnar_cache import store_columns
+from .dates import is_past
+from .plot_cache import PlotCache
+from .summaries import DaySummary
+from .summaries import summarize_day
+from .summaries import load_summary
+from .summaries import store_summary
+from .summaries import drop_summary
+
+FETCH_CONCURRENCY = 8  # Maximum number of days that are fetched concurrently
+HOUSE_POOL_SIZE = 16  # Maximum number of houses (besides the default one) whose adapters are kept open
+HOUSES_DIR = "houses"  # Where the on-disk caches of the other houses live, under the cache directories
+
+# The adapter of the default house, i.e. the database of CONFIG_FILE
+adapter = PooledCouchDBAdapter(CONFIG_FILE, pool_size=FETCH_CONCURRENCY)
+
+# The databases of all houses that may be served, the default one first
+houses = configured_houses(CONFIG_FILE)
+
+# The house whose data are being served. None means the default house. It is set per request (see `using_house`)
+current_house: ContextVar[Optional[str]] = ContextVar("current_house", default=None)
+
+META_TTL = 60  # Seconds during which the metadata are served without even checking their revision
+MEMORY_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256 MiB
+TODAY_TTL = 60  # Seconds that today's (still growing) data may be served from memory
+RESPONSE_CACHE_MAX_BYTES = 128 * 1024 * 1024  # 128 MiB
+PLOT_CACHE_DIR = os.path.join(PLOT_DIR, "cache")
+PLOT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512 MiB
+
+
+def _estimate_size(entry: Tuple[str, ColumnarEnergyData]) -> int:
+    return entry[1].nbytes
+
+
+# Days of energy data, along with the revision of the document they come from: key -> (revision, ColumnarEnergyData)
+memory_cache = MemoryCache(MEMORY_CACHE_MAX_BYTES, sizeof=_estimate_size)
+
+meta_cache = MetaCache(adapter, ttl=META_TTL)
+
+# The metadata of the other houses (house -> MetaCache). They are dropped along with the adapter of their house.
+house_meta_caches = {}
+_house_meta_lock = threading.Lock()
+
+
+def _drop_house_meta(house: str, _):
+    with _house_meta_lock:
+        house_meta_caches.pop(house, None)
+
+
+adapter_pool = AdapterPool(lambda house: PooledCouchDBAdapter(CONFIG_FILE, pool_size=FETCH_CONCURRENCY, db=house),
+                           HOUSE_POOL_SIZE, on_evict=_drop_house_meta)
+
+# Encoded responses of past dates, along with the revision of the data they were encoded from: key -> (revision, bytes)
+response_cache = MemoryCache(RESPONSE_CACHE_MAX_BYTES, sizeof=lambda entry: len(entry[1]))
+
+# Rendered plots, shared among processes through the disk
+plot_cache = PlotCache(PLOT_CACHE_DIR, PLOT_CACHE_MAX_BYTES)
+
+# In-memory view of the persistent summary index ((house, date) -> DaySummary). Summaries are tiny, so there is no need
+# to bound
+summary_index = {}
+
+# How many times the data of each (house, date) were invalidated. Summaries are never revalidated, so one computed from
+# data that were read before an invalidation must not be indexed after it
+invalidations = {}
+
+CACHE_BYTES = CallbackGauge("cleanemon_cache_bytes", "Bytes held by each cache", ["cache"], lambda: {
+    ("memory",): memory_cache.size,
+    ("response",): response_cache.size,
+    ("plot",): plot_cache.size,
+})
+CACHE_ENTRIES = CallbackGauge("cleanemon_cache_entries", "Entries held by each cache", ["cache"], lambda: {
+    ("memory",): len(memory_cache),
+    ("response",): len(response_cache),
+    ("plot",): len(plot_cache),
+    ("summary",): len(summary_index),
+})
+
+
+@contextmanager
+def using_house(house: Optional[str]):
+    """Serves the data of `house` (one of `houses`) within the enclosed block, including any concurrent fetches it
+    makes. None means the default house.
+
+    Throws:
+    UnknownHouseError -- If `house` is not among the configured houses
+    """
+
+    token = current_house.set(resolve_house(house))
+    try:
+        yield
+    finally:
+        current_house.reset(token)
+
+
+def list_houses() -> List[str]:
+    """Returns the databases of all houses that may be served, the default one first"""
+
+    return list(houses)
+
+
+def resolve_house(house: Optional[str]) -> Optional[str]:
+    """Returns the normalized `house`, i.e. None for the default house
+
+    Throws:
+    UnknownHouseError -- If `house` is not among the configured houses
+    """
+
+    if house is None or house == adapter.db or (houses and house == houses[0]):
+        return None
+    if house not in houses:
+        raise UnknownHouseError(house)
+    return house
+
+
+def house_adapter() -> EnergyDataAdapter:
+    """Returns the adapter of the current house"""
+
+    house = current_house.get()
+    if house is None:
+        return adapter
+    return adapter_pool.get(house)
+
+
+def house_meta_cache() -> MetaCache:
+    house = current_house.get()
+    if house is None:
+        return meta_cache
+
+    house_adapter_ = adapter_pool.get(house)
+    with _house_meta_lock:
+        cache = house_meta_caches.get(house)
+        if cache is None or cache.adapter is not house_adapter_:
+            cache = house_meta_caches[house] = MetaCache(house_adapter_, ttl=META_TTL)
+        return cache
+
+
+def house_cache_dir() -> str:
+    """Returns the on-disk cache directory of the current house"""
+
+    house = current_house.get()
+    if house is None:
+        return CACHE_DIR
+    return os.path.join(CACHE_DIR, HOUSES_DIR, house)
+
+
+def use_adapter(new_adapter: EnergyDataAdapter) -> EnergyDataAdapter:
+    """Makes the backend serve the data of `new_adapter` (e.g. an in-memory stand-in) and returns the previous adapter.
+    In-memory caches are cleared, while the caches on disk are kept, so they should be moved (see `CACHE_DIR` and
+    `plot_cache`) if the new database holds other data.
+    """
+
+    global adapter
+
+    previous, adapter = adapter, new_adapter
+    meta_cache.adapter = new_adapter
+    meta_cache.invalidate()
+    adapter_pool.clear()
+    memory_cache.clear()
+    response_cache.clear()
+    summary_index.clear()
+
+    return previous
+
+
+def sensor_projection(sensors: Optional[List[str]]) -> Optional[Tuple[str, ...]]:
+    """Normalizes `sensors` into a hashable projection that always includes the timestamp. None means "all sensors"."""
 
-adapter = CouchDBAdapter(CONFIG_FILE)
+    if not sensors:
+        return None
+    return tuple(sorted(set(sensors) | {"timestamp"}))
 
 
-def fetch_data(date_id: str, *, from_cache=False) -> EnergyData:
+def _load_cached_day(date_id: str, projection: Optional[Tuple[str, ...]]) -> Optional[Tuple[str, ColumnarEnergyData]]:
+    """Returns the revision and the data of the given date from the on-disk cache, or None if they are not cached"""
 
-    if not os.path.exists(CACHE_DIR):
-        os.mkdir(CACHE_DIR)
+    loaded = load_columns(house_cache_dir(), date_id, projection)
+    if loaded is None:
+        return None
 
-    name = date_id
+    meta, columns = loaded
+    revision = meta.get("revision", "")
+    integral = tuple(name for name in meta["integral"] if name in columns)
+    if not meta.get("records"):
+        return revision, ColumnarEnergyData(meta["date"], columns, integral)
 
-    cache_path = os.path.join(CACHE_DIR, name)
+    records = load_records(house_cache_dir(), date_id)
+    if records is None:
+        return None
+    return revision, ColumnarEnergyData(meta["date"], columns, integral, records).select(projection)
 
-    fetch_ok = False
 
-    energy_data = EnergyData()
+def fetch_day(date_id: str, *, from_cache=False, sensors: List[str] = None, revision: str = None) -> ColumnarEnergyData:
+    """Fetches the energy data of the given date as columns, keeping only the provided `sensors`.
 
-    if from_cache:
-        try:
-            with open(cache_path, "r") as fin:
-                raw_data = json.load(fin)
-                energy_data = EnergyData(raw_data["date"], raw_data["energy_data"])
+    The data are looked up in an in-process memory cache, then in the on-disk columnar cache (reading only the needed
+    sensors) and finally in the central database. Only the needed sensors are requested from the central database and,
+    as long as the document is at the same revision, they are merged into the columnar cache, so that the cost of a
+    fetch scales with the number of sensors.
+    Past dates only change when they get disaggregated, so they are kept in memory for as long as the byte budget
+    allows and they are served from the caches as long as they are at the current revision of their document, which is
+    checked without fetching the data. Today's data keep growing, so they are only served from the caches if
+    `from_cache` is set, and kept in memory for `TODAY_TTL` seconds. The returned object may be shared with other
+    callers, so it should be treated as read-only.
 
-            print("Fetched data from cache")
-            fetch_ok = True
-        except OSError:
-            print("No cached data!")
+    date_id -- a valid date string in `YYYY-MM-DD` format
+    from_cache -- if True, cached data are served without checking their revision. If False, past dates are served
+    from the caches only if they are at the current revision, while today's data are fetched again from the central
+    database
+    sensors -- an inclusive list containing the values of interest. If omitted, all sensors are returned
+    revision -- the current revision of the data, if it is already known
+    """
 
-    if not from_cache or not fetch_ok:
-        energy_data = adapter.fetch_energy_data_by_date(date_id)
+    projection = sensor_projection(sensors)
+    key = (current_house.get(), date_id, projection)
+    past = is_past(date_id)
+    invalidated = invalidations.get(key[:2], 0)
+
+    def is_current(cached_revision: str) -> bool:
+        nonlocal revision
+        if from_cache:
+            return True
+        if revision is None:
+            with timed("fetch"):
+                revision = fetch_revision(date_id)
+        return cached_revision == revision
+
+    cached = None
+    if from_cache or past:
+        cached = memory_cache.get(key)
+        if cached is not None and not is_current(cached[0]):
+            cached = None
+        count_cache("memory", cached is not None)
+        if cached is not None:
+            return cached[1]
+
+        with timed("cache"):
+            cached = _load_cached_day(date_id, projection)
+        if cached is not None and not is_current(cached[0]):
+            cached = None
+        count_cache("disk", cached is not None)
+
+    if cached is not None:
+        revision, day = cached
+    else:
+        with timed("fetch"):
+            energy_data, revision = house_adapter().fetch_energy_data_with_revision(date_id, sensors=projection)
+        with timed("prepare"):
+            day = ColumnarEnergyData.from_energy_data(energy_data).select(projection)
 
         # Cache data for future use
-        with open(cache_path, "w") as fout:
-            json.dump(energy_data.as_json(string=False), fout)
+        cache_dir = house_cache_dir()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        with timed("cache"):
+            store_columns(cache_dir, date_id, day.date, day.columns, day.integral, len(energy_data.energy_data),
+                          projection=projection, records=day.records, revision=revision)
+        if past and len(day) and (projection is None or "kwh" in projection):
+            _index_summary(summarize_day(day), invalidated)
+
+    # Empty days may still get populated later on, so they are never kept in memory
+    if len(day):
+        memory_cache.put(key, (revision, day), ttl=None if past else TODAY_TTL)
+
+    return day
+
+
+def fetch_data(date_id: str, *, from_cache=False, sensors: List[str] = None) -> EnergyData:
+    """Fetches the energy data of the given date as records, keeping only the provided `sensors`. It is the record
+    counterpart of `fetch_day`, meant for consumers that really need records.
+
+    date_id -- a valid date string in `YYYY-MM-DD` format
+    from_cache -- if True, cached data are served without checking their revision (see `fetch_day`)
+    sensors -- an inclusive list containing the values of interest. If omitted, all sensors are returned
+    """
+
+    return fetch_day(date_id, from_cache=from_cache, sensors=sensors).to_energy_data()
+
+
+def fetch_records(date_id: str, *, sensors: List[str] = None) -> EnergyData:
+    """Fetches the energy data of the given date straight from the central database, exactly as they are stored there.
+    Unlike `fetch_data`, the records skip the caches and the columnar representation, so fields of any type, as well as
+    records that lack some fields, are kept intact. It is meant for consumers that write the data back (see
+    `send_data`).
+
+    date_id -- a valid date string in `YYYY-MM-DD` format
+    sensors -- an inclusive list containing the values of interest. If omitted, all sensors are returned
+    """
+
+    with timed("fetch"):
+        return house_adapter().fetch_energy_data_by_date(date_id, sensors=sensor_projection(sensors))
+
+
+def fetch_columns(date_id: str, *, from_cache=False, sensors: List[str] = None) -> Dict[str, np.ndarray]:
+    """Fetches the energy data of the given date as read-only columns (one float64 array per sensor)
+
+    date_id -- a valid date string in `YYYY-MM-DD` format
+    from_cache -- if True, cached data are served without checking their revision (see `fetch_day`)
+    sensors -- an inclusive list containing the values of interest. If omitted, all sensors are returned
+    """
+
+    return fetch_day(date_id, from_cache=from_cache, sensors=sensors).columns
+
+
+def _index_summary(summary: DaySummary, invalidated: int):
+    """Indexes a summary computed from data that were read when the date had been invalidated `invalidated` times. If it
+    got invalidated since, the summary is dropped again, as it may be describing the previous data.
+    """
+
+    key = (current_house.get(), summary.date)
+    store_summary(house_cache_dir(), summary)
+    summary_index[key] = summary
+    if invalidations.get(key, 0) != invalidated:
+        summary_index.pop(key, None)
+        drop_summary(house_cache_dir(), summary.date)
+
+
+def fetch_summary(date_id: str, *, from_cache=False) -> DaySummary:
+    """Returns the summary (first/last valid kwh, number of records and gaps) of the given date.
+
+    Past dates are answered from the summary index, without touching their records. Their kwh measurements never change,
+    so this holds even when `from_cache` is False. Today's summary is always computed on the spot.
 
-    return energy_data
+    date_id -- a valid date string in `YYYY-MM-DD` format
+    from_cache -- if True and the summary has to be computed, cached data are served without checking their revision
+    """
+
+    if not is_past(date_id):
+        return summarize_day(fetch_day(date_id, from_cache=from_cache, sensors=["kwh"]))
+
+    key = (current_house.get(), date_id)
+    summary = summary_index.get(key) or load_summary(house_cache_dir(), date_id)
+    count_cache("summary", summary is not None)
+    if summary is None:
+        invalidated = invalidations.get(key, 0)
+        day = fetch_day(date_id, from_cache=from_cache, sensors=["kwh"])
+        summary = summarize_day(day)
+        if len(day):  # Empty days may still get populated later on, so they are never indexed
+            _index_summary(summary, invalidated)
+        return summary
+
+    summary_index[key] = summary
+    return summary
+
+
+def fetch_many(dates: Iterable[str], *, from_cache=False, sensors: List[str] = None,
+               concurrency: int = FETCH_CONCURRENCY, fetch: Callable = fetch_data) -> Iterator:
+    """Fetches the energy data of multiple dates concurrently, yielding them in the order of `dates`.
+
+    At most `concurrency` dates are in flight at any time, so a consumer that processes each day before asking for the
+    next one keeps a bounded number of days in memory, no matter how many dates were requested.
+
+    dates -- valid date strings in `YYYY-MM-DD` format
+    from_cache -- if True, cached data are served without checking their revision (see `fetch_day`)
+    sensors -- an inclusive list containing the values of interest. If omitted, all sensors are returned
+    concurrency -- the maximum number of concurrent fetches
+    fetch -- the function that fetches a single date, called as `fetch(date, from_cache=..., sensors=...)`
+    """
+
+    dates = iter(dates)
+    concurrency = max(1, concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+
+        def submit_next() -> bool:
+            for date_id in dates:
+                # Each fetch runs in a copy of the caller's context, so that it serves the same house
+                pending.append(executor.submit(copy_context().run, fetch, date_id, from_cache=from_cache,
+                                               sensors=sensors))
+                return True
+            return False
+
+        for _ in range(concurrency):
+            if not submit_next():
+                break
+
+        while pending:
+            energy_data = pending.popleft().result()
+            submit_next()
+            yield energy_data
+
+
+def invalidate_data(date_id: str) -> int:
+    """Drops every in-memory entry (including encoded responses), the cached data and the summary of the given date of
+    the current house, along with the plots of that date. Returns the number of dropped in-memory entries.
+    """
+
+    house = current_house.get()
+    invalidations[(house, date_id)] = invalidations.get((house, date_id), 0) + 1
+    summary_index.pop((house, date_id), None)
+    drop_summary(house_cache_dir(), date_id)
+    drop_day(house_cache_dir(), date_id)
+    plot_cache.invalidate(date_id)  # Plots are not told apart by house, so those of every house are dropped
+    dropped = response_cache.invalidate(lambda key: key[:2] == (house, date_id))
+    return dropped + memory_cache.invalidate(lambda key: key[:2] == (house, date_id))
+
+
+def fetch_revision(date_id: str) -> str:
+    """Returns the current revision of the data of the given date, without fetching them. An empty string means that
+    there are no such data.
+    """
+
+    return house_adapter().fetch_revision_by_date(date_id)
+
+
+def fetch_meta() -> Dict:
+    """Returns the metadata of the current house. They are cached for `META_TTL` seconds and then revalidated against
+    the revision of the metadata document.
+    """
+
+    return house_meta_cache().get()
+
+
+def invalidate_meta():
+    house_meta_cache().invalidate()
 
 
 def send_data(date_id: str, data: EnergyData):
-    return adapter.update_energy_data_by_date(date_id, data)
+    """Writes the given data to the central database. Everything cached about the date is invalidated both before and
+    after the write, so that nothing derived from the previous data while the write was in flight outlives it.
+    """
+
+    invalidate_data(date_id)
+    try:
+        return house_adapter().update_energy_data_by_date(date_id, data)
+    finally:
+        invalidate_data(date_id)
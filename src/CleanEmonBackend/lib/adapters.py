@@ -0,0 +1,297 @@
+"""This module provides the database adapters used by the backend"""
+
+import json
+from abc import ABC
+from abc import abstractmethod
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from CleanEmonCore.CouchDBAdapter import CouchDBAdapter
+from CleanEmonCore.models import EnergyData
+
+DEFAULT_POOL_SIZE = 8
+
+# The fields of a day's document that a fetch needs. The rest of the document is never transferred.
+DAY_FIELDS = ["_id", "_rev", "date", "energy_data"]
+
+# A view that splits each day into one row per sensor, keyed by [date, sensor], so that a projected fetch transfers and
+# parses only the sensors it needs. Each row holds the values of the sensor, along with the indices of the records that
+# hold them (null if every record does), the number of records and the revision of the document. It is installed on
+# first use.
+PROJECTION_DESIGN_DOC = "_design/projection"
+PROJECTION_VIEW = "sensors_by_date"
+PROJECTION_MAP_FUNCTION = """function (doc) {
+    if (!doc.date || !doc.energy_data) {
+        return;
+    }
+    var records = doc.energy_data;
+    var columns = {};
+    var names = [];
+    for (var i = 0; i < records.length; i++) {
+        for (var name in records[i]) {
+            if (!columns.hasOwnProperty(name)) {
+                columns[name] = {indices: [], values: []};
+                names.push(name);
+            }
+            columns[name].indices.push(i);
+            columns[name].values.push(records[i][name]);
+        }
+    }
+    for (var j = 0; j < names.length; j++) {
+        var column = columns[names[j]];
+        emit([doc.date, names[j]], {
+            rev: doc._rev,
+            length: records.length,
+            indices: column.values.length === records.length ? null : column.indices,
+            values: column.values
+        });
+    }
+}"""
+
+
+class EnergyDataAdapter(ABC):
+    """The interface between the backend and the database of a house. Anything that implements it can serve the API
+    (see `DBConnector.use_adapter`), e.g. an in-memory stand-in for testing.
+    """
+
+    db: str  # A human-readable name of the database
+
+    @abstractmethod
+    def fetch_energy_data_by_date(self, date: str, sensors: Sequence[str] = None) -> EnergyData:
+        """Returns the energy data of the given date (empty if there are none). If `sensors` are given, each record
+        holds only those sensors.
+        """
+
+    def fetch_energy_data_with_revision(self, date: str, sensors: Sequence[str] = None) -> Tuple[EnergyData, str]:
+        """Returns the energy data of the given date (see `fetch_energy_data_by_date`) along with their revision. The
+        data are at least as recent as the revision.
+        """
+
+        revision = self.fetch_revision_by_date(date)
+        return self.fetch_energy_data_by_date(date, sensors=sensors), revision
+
+    @abstractmethod
+    def fetch_revision_by_date(self, date: str) -> str:
+        """Returns the current revision of the data of the given date, or an empty string if there are none"""
+
+    @abstractmethod
+    def fetch_document_revision(self, document: str) -> str:
+        """Returns the current revision of `document`, or an empty string if it does not exist"""
+
+    @abstractmethod
+    def fetch_meta_with_revision(self) -> Tuple[Dict, str]:
+        """Returns the metadata along with their revision"""
+
+    @abstractmethod
+    def update_energy_data_by_date(self, date: str, data: EnergyData) -> bool:
+        """Replaces the energy data of the given date. Returns True on success."""
+
+
+class PooledCouchDBAdapter(CouchDBAdapter, EnergyDataAdapter):
+    """A CouchDBAdapter whose read operations reuse pooled, keep-alive HTTP connections. It is safe to be shared among
+    threads, so that multiple documents can be fetched concurrently.
+    """
+
+    def __init__(self, config_file: str, *, pool_size: int = DEFAULT_POOL_SIZE, db: str = None):
+        """
+        config_file -- the config file of the central database
+        pool_size -- the maximum number of connections that are kept open
+        db -- the database to work on, if other than the one of the config file
+        """
+
+        super().__init__(config_file)
+        if db:
+            self.db = db
+
+        self.session = requests.Session()
+        self.session.auth = (self.username, self.password)
+
+        http_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", http_adapter)
+        self.session.mount("https://", http_adapter)
+
+        # Turns False if the projection view can neither be queried nor installed
+        self.supports_projection = True
+
+    def close(self):
+        """Closes the pooled connections. They are reopened on demand, so closing is always safe."""
+
+        self.session.close()
+
+    def _fetch_document(self, *, document: str = None) -> dict:
+        if not document:
+            document = self.document
+
+        assert document, "No document was supplied!"
+
+        res = self.session.get(f"{self.base_url}/{self.db}/{document}")
+
+        data = {}
+
+        if res.ok:
+            data = res.json()
+
+        return data
+
+    def get_document_id_for_date(self, date: str) -> str:
+        """Returns the id of the document that matches the given date, or an empty string if there is no such document.
+        Unlike the base implementation, only the matching row of the view is requested.
+        """
+
+        res = self.session.get(f"{self.base_url}/{self.db}/_design/api/_view/get_dates",
+                               params={"key": json.dumps(date)})
+
+        rows = []
+        if res.ok:
+            rows = res.json().get("rows", [])
+
+        document_id = ""
+        for row in rows:
+            if row["key"] == date:
+                document_id = row["value"]
+                break
+
+        return document_id
+
+    def fetch_document_revision(self, document: str) -> str:
+        """Returns the current revision of `document` without fetching its body, or an empty string if it does not
+        exist. CouchDB exposes the revision as the document's ETag.
+        """
+
+        res = self.session.head(f"{self.base_url}/{self.db}/{document}")
+
+        if not res.ok:
+            return ""
+
+        return res.headers.get("ETag", "").strip('"')
+
+    def fetch_revision_by_date(self, date: str) -> str:
+        """Returns the current revision of the document of the given date, or an empty string if there is no such
+        document
+        """
+
+        document = self.get_document_id_for_date(date)
+        if not document:
+            return ""
+
+        return self.fetch_document_revision(document)
+
+    def fetch_meta_with_revision(self) -> Tuple[Dict, str]:
+        """Returns the metadata along with the revision of the metadata document"""
+
+        meta = self._fetch_document(document="meta")
+        meta.pop("_id", None)
+        revision = meta.pop("_rev", "")
+        return meta, revision
+
+    def _find_document(self, document: str) -> dict:
+        """Returns the fields of `document` that a fetch needs (see `DAY_FIELDS`), or an empty dict if it does not
+        exist. It is a Mango query on the primary index, so it needs no setup.
+        """
+
+        res = self.session.post(f"{self.base_url}/{self.db}/_find", data=json.dumps({
+            "selector": {"_id": document},
+            "fields": DAY_FIELDS,
+            "limit": 1,
+        }), headers={"Content-Type": "application/json"})
+
+        docs = []
+        if res.ok:
+            docs = res.json().get("docs", [])
+
+        return docs[0] if docs else {}
+
+    def install_projection(self) -> bool:
+        """Creates or updates the design document of the projection view. Returns True on success."""
+
+        url = f"{self.base_url}/{self.db}/{PROJECTION_DESIGN_DOC}"
+
+        design_doc = {}
+        res = self.session.get(url)
+        if res.ok:
+            design_doc = res.json()
+
+        design_doc.setdefault("views", {})[PROJECTION_VIEW] = {"map": PROJECTION_MAP_FUNCTION}
+        res = self.session.put(url, data=json.dumps(design_doc), headers={"Content-Type": "application/json"})
+        return res.ok
+
+    def _query_projection(self, date: str, sensors: Sequence[str]) -> Optional[List[dict]]:
+        """Returns the rows of the projection view for the given sensors of the given date, or None if the view is not
+        available. It is installed if it is missing.
+        """
+
+        url = f"{self.base_url}/{self.db}/{PROJECTION_DESIGN_DOC}/_view/{PROJECTION_VIEW}"
+        query = json.dumps({"keys": [[date, sensor] for sensor in sensors]})
+
+        for attempt in range(2):
+            res = self.session.post(url, data=query, headers={"Content-Type": "application/json"})
+            if res.ok:
+                return res.json().get("rows", [])
+            if res.status_code != 404 or attempt or not self.install_projection():
+                break
+
+        print("The projection view is not available, falling back to fetching whole days")
+        self.supports_projection = False
+        return None
+
+    def _fetch_projected(self, date: str, sensors: Sequence[str]) -> Optional[Tuple[EnergyData, str]]:
+        """Fetches only the given sensors of the given date through the projection view. Returns None if the view is
+        not available, or if it holds none of the sensors (e.g. there is no such date).
+        """
+
+        rows = self._query_projection(date, sensors)
+        if not rows:
+            return None
+
+        # The rows of a date come from a single revision of its document
+        revision = rows[0]["value"]["rev"]
+        columns = {row["key"][1]: row["value"] for row in rows if row["value"]["rev"] == revision}
+
+        length = rows[0]["value"]["length"]
+        records = [{} for _ in range(length)]
+        for sensor in sensors:
+            column = columns.get(sensor)
+            if column is None:
+                continue
+            indices = column["indices"] if column["indices"] is not None else range(length)
+            for i, value in zip(indices, column["values"]):
+                records[i][sensor] = value
+
+        return EnergyData(date, records), revision
+
+    def fetch_energy_data_with_revision(self, date: str, sensors: Sequence[str] = None) -> Tuple[EnergyData, str]:
+        """Fetches the energy data of the given date along with their revision. If `sensors` are given, each record
+        holds only those sensors.
+
+        Projected fetches are served by the projection view, so that only the requested sensors are transferred. Whole
+        days (and projected fetches, if the view is not available) are fetched with a Mango query that transfers only
+        the needed fields of the document.
+        """
+
+        if sensors is not None and self.supports_projection:
+            projected = self._fetch_projected(date, sensors)
+            if projected is not None:
+                return projected
+
+        document = self.get_document_id_for_date(date)
+        if not document:
+            return EnergyData(), ""
+
+        doc = self._find_document(document)
+        records = doc.get("energy_data", [])
+        if sensors is not None:
+            records = [{sensor: record[sensor] for sensor in sensors if sensor in record} for record in records]
+
+        return EnergyData(doc.get("date", ""), records), doc.get("_rev", "")
+
+    def fetch_energy_data_by_date(self, date: str, sensors: Sequence[str] = None) -> EnergyData:
+        """Fetches the energy data of the given date. If `sensors` are given, each record holds only those sensors."""
+
+        return self.fetch_energy_data_with_revision(date, sensors=sensors)[0]
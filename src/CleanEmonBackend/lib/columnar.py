@@ -0,0 +1,147 @@
+"""This module provides the columnar (struct-of-arrays) counterpart of EnergyData.
+
+A day holds about 17280 records and, as a list of dicts, every single sample costs a boxed float plus its share of a
+dict. As columns, every sample costs 8 bytes and every consumer can work on whole arrays at once. Days are converted
+back into records only at the boundaries that need them (e.g. JSON responses).
+
+Columns only hold numbers, so the (rare) days whose records cannot be given back exactly from their columns, e.g. days
+with non-numeric fields or with records that lack some fields, also keep their original records.
+"""
+
+import sys
+from dataclasses import dataclass
+from dataclasses import field
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import TYPE_CHECKING
+from typing import Union
+
+import numpy as np
+
+from CleanEmonCore.models import EnergyData
+
+from .columnar_cache import columns_are_exact
+from .columnar_cache import columns_to_records
+from .columnar_cache import integral_columns
+from .columnar_cache import records_to_columns
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+TIMESTAMP = "timestamp"
+
+
+@dataclass
+class ColumnarEnergyData:
+    """The energy data of a day, as one float64 array per sensor (including the timestamps). Missing values are NaN.
+
+    date -- the date of the data in `YYYY-MM-DD` format
+    columns -- sensor -> array of values. All arrays have the same length
+    integral -- the sensors that originally held integers, so that they can be given back as such
+    records -- the original records, only if they cannot be given back exactly from `columns`
+    """
+
+    date: str = ""
+    columns: Dict[str, np.ndarray] = field(default_factory=dict)
+    integral: Tuple[str, ...] = ()
+    records: Optional[List[dict]] = None
+
+    def __len__(self):
+        if self.records is not None:
+            return len(self.records)
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    @property
+    def timestamps(self) -> Optional[np.ndarray]:
+        return self.columns.get(TIMESTAMP)
+
+    @property
+    def sensors(self) -> Tuple[str, ...]:
+        """The names of all columns but the timestamps"""
+
+        return tuple(name for name in self.columns if name != TIMESTAMP)
+
+    @property
+    def nbytes(self) -> int:
+        size = sys.getsizeof(self) + sum(values.nbytes for values in self.columns.values())
+        if self.records is not None:
+            size += sys.getsizeof(self.records) + sum(sys.getsizeof(record) for record in self.records)
+        return size
+
+    def select(self, sensors: Optional[Sequence[str]]) -> "ColumnarEnergyData":
+        """Returns a view that holds only the given `sensors` (if they exist). None means "all sensors"."""
+
+        if sensors is None:
+            return self
+
+        columns = {name: values for name, values in self.columns.items() if name in sensors}
+        records = self.records
+        if records is not None:
+            sensors = set(sensors)
+            records = [{name: value for name, value in record.items() if name in sensors} for record in records]
+        return ColumnarEnergyData(self.date, columns, tuple(name for name in self.integral if name in columns), records)
+
+    def take(self, indices: Union[np.ndarray, slice]) -> "ColumnarEnergyData":
+        """Returns a copy that holds only the records at the given `indices`"""
+
+        columns = {name: np.asarray(values)[indices] for name, values in self.columns.items()}
+        records = self.records
+        if records is not None:
+            records = records[indices] if isinstance(indices, slice) else [records[i] for i in np.asarray(indices)]
+        return ColumnarEnergyData(self.date, columns, self.integral, records)
+
+    @classmethod
+    def from_energy_data(cls, energy_data: EnergyData) -> "ColumnarEnergyData":
+        records = energy_data.energy_data
+        columns = records_to_columns(records)
+        integral = tuple(integral_columns(records, columns))
+        exact = columns_are_exact(records, columns, integral)
+        return cls(energy_data.date, columns, integral, None if exact else records)
+
+    def to_energy_data(self) -> EnergyData:
+        if self.records is not None:
+            return EnergyData(self.date, list(self.records))
+        return EnergyData(self.date, columns_to_records(self.columns, self.integral))
+
+    @classmethod
+    def from_dataframe(cls, date: str, df: "pd.DataFrame") -> "ColumnarEnergyData":
+        """Converts the numeric columns of `df` into a day. Integer columns are remembered as integral."""
+
+        import pandas as pd  # Only the disaggregation works on dataframes, so pandas is loaded on demand
+
+        columns = {}
+        integral = []
+        for name in df.columns:
+            series = df[name]
+            if not pd.api.types.is_numeric_dtype(series):
+                continue
+            columns[str(name)] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            if pd.api.types.is_integer_dtype(series):
+                integral.append(str(name))
+
+        return cls(date, columns, tuple(integral))
+
+    def to_dataframe(self) -> "pd.DataFrame":
+        """Converts the day into a dataframe with one column per sensor. Integral columns without missing values are
+        given back as integers, exactly as if the dataframe was built from the original records.
+        """
+
+        import pandas as pd
+
+        if self.records is not None:
+            return pd.DataFrame(self.records)
+
+        data = {}
+        for name, values in self.columns.items():
+            if name in self.integral and not np.isnan(values).any():
+                data[name] = values.astype(np.int64)
+            else:
+                data[name] = np.array(values)
+
+        return pd.DataFrame(data)
@@ -0,0 +1,313 @@
+"""This module implements the on-disk, columnar cache of the daily energy data.
+
+Each day is stored in its own directory (`CACHE_DIR/<date>/`), that holds one contiguous float64 `.npy` array per
+sensor, plus a small `meta.json` descriptor. Arrays are opened as memory maps, so a read that is only interested in a
+couple of sensors touches only those columns and loading a day is close to zero-copy.
+
+Days that were cached by older versions as a single JSON file (`CACHE_DIR/<date>`) are still readable and are
+transparently migrated to the columnar format on first read.
+
+A day may also be cached partially, holding only the sensors of a projected fetch. Such days record their projection,
+so that reads which need other sensors are treated as misses, and later projected fetches of the same revision of the
+document are merged into them.
+
+Days whose records cannot be given back exactly from their columns (e.g. because they hold non-numeric values, or
+because some records lack some sensors) also keep their original records, in a `records.json` file.
+"""
+
+import os
+import json
+import shutil
+import threading
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+
+from CleanEmonCore.models import EnergyData
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+RECORDS_FILE = "records.json"
+
+
+def records_to_columns(records: List[dict]) -> Dict[str, np.ndarray]:
+    """Converts a list of records into a dict of float64 arrays, one per sensor. Missing or None values become NaN.
+    Sensors whose values are not numeric are skipped.
+    """
+
+    names = {}
+    for record in records:
+        for name in record:
+            names[name] = None  # Preserve the order in which sensors first appear
+
+    columns = {}
+    for name in names:
+        try:
+            columns[name] = np.array([record.get(name) for record in records], dtype=np.float64)
+        except (TypeError, ValueError):
+            continue
+
+    return columns
+
+
+def integral_columns(records: List[dict], names: Sequence[str]) -> List[str]:
+    """Returns the sensors that only hold integers, so that they can be given back as such"""
+
+    integral = []
+    for name in names:
+        values = [record.get(name) for record in records]
+        if all(type(value) is int or value is None for value in values) and any(v is not None for v in values):
+            integral.append(name)
+    return integral
+
+
+def columns_are_exact(records: List[dict], columns: Dict[str, np.ndarray], integral: Sequence[str]) -> bool:
+    """Returns whether `columns_to_records(columns, integral)` gives `records` back exactly, i.e. whether every record
+    holds all the sensors of `columns` (in the same order) and every value is either None, or a number of the type that
+    its column is given back as
+    """
+
+    names = tuple(columns)
+    if any(tuple(record) != names for record in records):
+        return False
+
+    for name in names:
+        expected = int if name in integral else float
+        if not set(map(type, (record[name] for record in records))) <= {expected, type(None)}:
+            return False
+    return True
+
+
+def _to_list(values: np.ndarray, integral: bool) -> list:
+    """Converts an array to a list of python scalars, mapping NaN to None"""
+
+    mask = np.isnan(values)
+    if integral:
+        out = np.where(mask, 0, values).astype(np.int64).astype(object)
+    else:
+        out = values.astype(object)
+    out[mask] = None
+    return out.tolist()
+
+
+def columns_to_records(columns: Dict[str, np.ndarray], integral: Sequence[str] = ()) -> List[dict]:
+    """The inverse of `records_to_columns`. NaN values are given back as None."""
+
+    if not columns:
+        return []
+
+    names = list(columns)
+    lists = [_to_list(columns[name], name in integral) for name in names]
+    return [dict(zip(names, row)) for row in zip(*lists)]
+
+
+def _day_dir(cache_dir: str, date_id: str) -> str:
+    return os.path.join(cache_dir, date_id)
+
+
+def _write_atomically(path: str, write):
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f_out:
+        write(f_out)
+    os.replace(tmp_path, path)
+
+
+def _load_meta(day_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(day_dir, META_FILE), "r") as f_in:
+            return json.load(f_in)
+    except (OSError, ValueError):
+        return None
+
+
+def store_day(cache_dir: str, date_id: str, energy_data: EnergyData, projection: Sequence[str] = None,
+              revision: str = ""):
+    """Stores `energy_data` in the columnar cache, replacing any previous version of the same date.
+
+    projection -- the sensors that were requested, if `energy_data` only holds some of the sensors. If the cached
+    version of the date comes from the same `revision`, the new sensors are merged into it instead of replacing it
+    revision -- the revision of the document that `energy_data` come from. Days without a revision are never merged
+    """
+
+    records = energy_data.energy_data
+    columns = records_to_columns(records)
+    integral = integral_columns(records, columns)
+    store_columns(cache_dir, date_id, energy_data.date, columns, integral, len(records), projection=projection,
+                  records=None if columns_are_exact(records, columns, integral) else records, revision=revision)
+
+
+def store_columns(cache_dir: str, date_id: str, date: str, columns: Dict[str, np.ndarray], integral: Sequence[str],
+                  length: int, projection: Sequence[str] = None, records: Optional[List[dict]] = None,
+                  revision: str = ""):
+    """The columnar counterpart of `store_day`.
+
+    date -- the date recorded in the stored data
+    columns -- sensor -> array of values
+    integral -- the sensors that hold integers
+    length -- the number of records
+    records -- the original records, if they cannot be given back exactly from `columns`. Such days are never merged
+    revision -- the revision of the document that the columns come from
+    """
+
+    day_dir = _day_dir(cache_dir, date_id)
+
+    # Replace a legacy JSON file, if any
+    if os.path.isfile(day_dir):
+        os.remove(day_dir)
+    os.makedirs(day_dir, exist_ok=True)
+
+    integral = list(integral)
+    kept_columns = []
+    kept_integral = []
+    if projection is not None:
+        projection = sorted(set(projection))
+        previous = _load_meta(day_dir)
+        mergeable = previous and revision and previous.get("revision") == revision and previous["length"] == length
+        if mergeable and not previous.get("records") and records is None:
+            kept_columns = [name for name in previous["columns"] if name not in columns]
+            kept_integral = [name for name in previous["integral"] if name in kept_columns]
+            if previous.get("projection") is None:
+                projection = None  # Merged into a complete day, which stays complete
+            else:
+                projection = sorted(set(previous["projection"]) | set(projection))
+
+    # The meta file marks the day as complete, so it is dropped first and written last
+    meta_path = os.path.join(day_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    for name, values in columns.items():
+        _write_atomically(os.path.join(day_dir, f"{name}.npy"), lambda f_out: np.save(f_out, values))
+
+    records_path = os.path.join(day_dir, RECORDS_FILE)
+    if records is not None:
+        _write_atomically(records_path, lambda f_out: f_out.write(json.dumps(records).encode()))
+    elif os.path.exists(records_path):
+        os.remove(records_path)
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "date": date,
+        "length": length,
+        "columns": kept_columns + list(columns),
+        "integral": kept_integral + integral,
+        "projection": projection,
+        "records": records is not None,
+        "revision": revision,
+    }
+    _write_atomically(meta_path, lambda f_out: f_out.write(json.dumps(meta).encode()))
+
+
+def drop_day(cache_dir: str, date_id: str):
+    """Removes the given date from the cache, if it is cached"""
+
+    day_dir = _day_dir(cache_dir, date_id)
+    if os.path.isfile(day_dir):
+        os.remove(day_dir)
+    elif os.path.isdir(day_dir):
+        shutil.rmtree(day_dir, ignore_errors=True)
+
+
+def load_columns(cache_dir: str, date_id: str, sensors: Sequence[str] = None) -> Optional[tuple]:
+    """Loads the cached columns of the given date as read-only memory maps. Returns a `(meta, columns)` tuple, or None
+    if the date is not cached, or if it is only partially cached without some of the requested sensors.
+
+    sensors -- the sensors of interest. If omitted, all cached sensors are loaded
+    """
+
+    day_dir = _day_dir(cache_dir, date_id)
+
+    if os.path.isfile(day_dir):
+        migrate_day(cache_dir, date_id)
+
+    meta = _load_meta(day_dir)
+    if meta is None:
+        return None
+
+    projection = meta.get("projection")
+    if projection is not None and (not sensors or not set(sensors) <= set(projection)):
+        return None
+
+    names = meta["columns"]
+    if sensors:
+        names = [name for name in names if name in sensors]
+
+    columns = {}
+    for name in names:
+        path = os.path.join(day_dir, f"{name}.npy")
+        # Empty arrays cannot be memory-mapped
+        columns[name] = np.load(path, mmap_mode="r") if meta["length"] else np.load(path)
+
+    return meta, columns
+
+
+def load_records(cache_dir: str, date_id: str) -> Optional[List[dict]]:
+    """Loads the original records that are kept along with the columns of the given date (see `store_columns`), or
+    returns None if there are no such records
+    """
+
+    try:
+        with open(os.path.join(_day_dir(cache_dir, date_id), RECORDS_FILE), "r") as f_in:
+            return json.load(f_in)
+    except (OSError, ValueError):
+        return None
+
+
+def load_day(cache_dir: str, date_id: str, sensors: Sequence[str] = None) -> Optional[EnergyData]:
+    """Loads the cached data of the given date, or returns None if the date is not cached.
+
+    sensors -- the sensors of interest. If omitted, all cached sensors are loaded
+    """
+
+    loaded = load_columns(cache_dir, date_id, sensors)
+    if loaded is None:
+        return None
+
+    meta, columns = loaded
+    if meta.get("records"):
+        records = load_records(cache_dir, date_id)
+        if records is None:
+            return None
+        if sensors:
+            records = [{name: value for name, value in record.items() if name in sensors} for record in records]
+        return EnergyData(meta["date"], records)
+
+    return EnergyData(meta["date"], columns_to_records(columns, meta["integral"]))
+
+
+def migrate_day(cache_dir: str, date_id: str) -> bool:
+    """Converts a legacy JSON cache file into the columnar format. Returns True if a file was migrated."""
+
+    path = _day_dir(cache_dir, date_id)
+    if not os.path.isfile(path):
+        return False
+
+    try:
+        with open(path, "r") as f_in:
+            raw_data = json.load(f_in)
+        energy_data = EnergyData(raw_data["date"], raw_data["energy_data"])
+    except (ValueError, KeyError):
+        # Corrupted cache, just drop it
+        os.remove(path)
+        return False
+
+    store_day(cache_dir, date_id, energy_data)
+    return True
+
+
+def migrate_cache_dir(cache_dir: str) -> List[str]:
+    """Converts every legacy JSON cache file of `cache_dir` into the columnar format. Returns the migrated dates."""
+
+    if not os.path.isdir(cache_dir):
+        return []
+
+    migrated = []
+    for name in sorted(os.listdir(cache_dir)):
+        if migrate_day(cache_dir, name):
+            migrated.append(name)
+
+    return migrated
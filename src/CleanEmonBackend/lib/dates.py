@@ -0,0 +1,35 @@
+"""Date helpers shared among the API and the scripts"""
+
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from typing import List
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def date_range(from_date: str, to_date: str) -> List[str]:
+    """Returns every date from `from_date` up to `to_date` (inclusive), in chronological order.
+
+    from_date -- a valid date string in `YYYY-MM-DD` format
+    to_date -- a valid date string in `YYYY-MM-DD` format
+    """
+
+    from_dt = datetime.strptime(from_date, DATE_FORMAT)
+    to_dt = datetime.strptime(to_date, DATE_FORMAT)
+    one_day = timedelta(days=1)
+
+    dates = []
+    now = from_dt
+    while now <= to_dt:
+        dates.append(now.strftime(DATE_FORMAT))
+        now += one_day
+
+    return dates
+
+
+def is_past(date_id: str) -> bool:
+    """Returns True if the given date is over, meaning that its data are not expected to change anymore"""
+
+    return date_id < date.today().isoformat()
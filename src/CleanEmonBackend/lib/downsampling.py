@@ -0,0 +1,193 @@
+"""This module provides vectorized downsampling routines, used to reduce the number of points that get sent to clients
+that only need to chart the data.
+"""
+
+from enum import Enum
+
+import numpy as np
+
+from CleanEmonCore.models import EnergyData
+
+from .columnar import ColumnarEnergyData
+from .columnar_cache import records_to_columns
+from .columnar_cache import columns_to_records
+
+
+class DownsamplingMethod(str, Enum):
+    """The supported downsampling methods.
+
+    - lttb: Largest-Triangle-Three-Buckets. Keeps the original samples that best preserve the visual shape of each
+      sensor
+    - mean, min, max: Splits the day into equally sized buckets and aggregates each one of them into a single point
+    """
+
+    lttb = "lttb"
+    mean = "mean"
+    min = "min"
+    max = "max"
+
+
+def _bucket_starts(n: int, n_out: int) -> np.ndarray:
+    """Returns the starting indices of `n_out` (almost) equally sized buckets that cover `n` points"""
+
+    return np.linspace(0, n, n_out + 1).astype(np.int64)[:-1]
+
+
+def bucket_aggregate(values: np.ndarray, n_out: int, how: str) -> np.ndarray:
+    """Splits `values` into `n_out` equally sized buckets and reduces each one into a single value, ignoring NaNs.
+    Buckets that only contain NaNs are reduced to NaN.
+
+    values -- a 1-D float array
+    n_out -- the number of buckets. If it is not less than the number of values, `values` are returned as-is
+    how -- one of "mean", "min", "max" or "first"
+    """
+
+    n = len(values)
+    if n_out >= n:
+        return np.asarray(values)
+
+    starts = _bucket_starts(n, n_out)
+
+    if how == "first":
+        return values[starts]
+    if how == "min":
+        return np.fmin.reduceat(values, starts)
+    if how == "max":
+        return np.fmax.reduceat(values, starts)
+    if how == "mean":
+        finite = np.isfinite(values)
+        sums = np.add.reduceat(np.where(finite, values, 0), starts)
+        counts = np.add.reduceat(finite.astype(np.int64), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+
+    raise ValueError(f"Unknown aggregation: {how}")
+
+
+def minmax_envelope(values: np.ndarray, n_out: int) -> tuple:
+    """Returns the (min, max) envelope of `values` over `n_out` equally sized buckets"""
+
+    return bucket_aggregate(values, n_out, "min"), bucket_aggregate(values, n_out, "max")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling. Returns the indices of the (at most) `n_out` selected points.
+
+    The first and last points are always kept. The inner points are split into `n_out - 2` buckets and, from each
+    bucket, the point that forms the largest triangle with the previously selected point and the average of the next
+    bucket is selected. Everything but the (inherently sequential) selection is vectorized.
+
+    x -- a 1-D, monotonically increasing float array without NaNs
+    y -- a 1-D float array without NaNs, of the same length as `x`
+    n_out -- the number of points to be selected
+    """
+
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # The average point of every bucket, which acts as the third vertex for the bucket preceding it
+    lengths = ends - starts
+    avg_x = np.add.reduceat(x[1:n - 1], starts - 1) / lengths
+    avg_y = np.add.reduceat(y[1:n - 1], starts - 1) / lengths
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = starts[i], ends[i]
+        ax, ay = x[a], y[a]
+        areas = np.abs((ax - next_x[i]) * (y[start:end] - ay) - (ax - x[start:end]) * (next_y[i] - ay))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def _lttb_indices(timestamps: np.ndarray, columns: dict, sensors: list, n: int, max_points: int) -> np.ndarray:
+    """Lets every sensor select its own most significant samples, sharing the budget of `max_points`. Returns the
+    sorted union of the selected indices.
+    """
+
+    budget = max(3, max_points // max(1, len(sensors)))
+
+    selected = [_bucket_starts(n, max_points)]  # Fallback if there is nothing to select
+    for name in sensors:
+        values = np.asarray(columns[name])
+        valid = np.flatnonzero(np.isfinite(values) & np.isfinite(timestamps))
+        if len(valid):
+            selected.append(valid[lttb(timestamps[valid], values[valid], budget)])
+    if len(selected) > 1:
+        selected = selected[1:]
+
+    return np.unique(np.concatenate(selected))
+
+
+def _aggregate_buckets(columns: dict, max_points: int, method: DownsamplingMethod) -> dict:
+    aggregated = {}
+    for name, values in columns.items():
+        how = "first" if name == "timestamp" else method.value
+        aggregated[name] = bucket_aggregate(np.asarray(values), max_points, how)
+    return aggregated
+
+
+def downsample_day(day: ColumnarEnergyData, max_points: int,
+                   method: DownsamplingMethod = DownsamplingMethod.lttb) -> ColumnarEnergyData:
+    """The columnar counterpart of `downsample_energy_data`"""
+
+    n = len(day)
+    if not max_points or max_points < 1 or n <= max_points:
+        return day
+
+    method = DownsamplingMethod(method)
+    timestamps = day.timestamps
+    if timestamps is None:
+        timestamps = np.arange(n, dtype=np.float64)
+
+    if method is DownsamplingMethod.lttb:
+        return day.take(_lttb_indices(timestamps, day.columns, list(day.sensors), n, max_points))
+
+    # Bucket minima, maxima and first values are original samples, so they keep their type
+    integral = day.integral if method is not DownsamplingMethod.mean else ("timestamp",)
+    aggregated = _aggregate_buckets(day.columns, max_points, method)
+    return ColumnarEnergyData(day.date, aggregated, tuple(name for name in integral if name in day.integral))
+
+
+def downsample_energy_data(energy_data: EnergyData, max_points: int,
+                           method: DownsamplingMethod = DownsamplingMethod.lttb) -> EnergyData:
+    """Reduces `energy_data` to (about) `max_points` records.
+
+    With LTTB, every sensor selects its own most significant samples, sharing the budget of `max_points`. The returned
+    records are the union of those original samples. With bucket aggregation, each returned record summarizes a bucket
+    of consecutive records and is stamped with the timestamp of the bucket's first record.
+
+    energy_data -- the data to be downsampled. If it contains no more than `max_points` records, it is returned as-is
+    max_points -- the desired number of records
+    method -- a DownsamplingMethod
+    """
+
+    records = energy_data.energy_data
+    if not max_points or max_points < 1 or len(records) <= max_points:
+        return energy_data
+
+    method = DownsamplingMethod(method)
+    columns = records_to_columns(records)
+    timestamps = columns.get("timestamp")
+    if timestamps is None:
+        timestamps = np.arange(len(records), dtype=np.float64)
+    sensors = [name for name in columns if name != "timestamp"]
+
+    if method is DownsamplingMethod.lttb:
+        indices = _lttb_indices(timestamps, columns, sensors, len(records), max_points)
+        return EnergyData(energy_data.date, [records[i] for i in indices])
+
+    return EnergyData(energy_data.date, columns_to_records(_aggregate_buckets(columns, max_points, method)))
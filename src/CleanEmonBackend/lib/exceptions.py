@@ -7,3 +7,13 @@ class BadDateRangeError(ValueError):
     def __init__(self, bad_from_date: str, bad_to_date):
         self.bad_from_date = bad_from_date
         self.bad_to_date = bad_to_date
+
+
+class BadPercentilesError(ValueError):
+    def __init__(self, bad_percentiles: str):
+        self.bad_percentiles = bad_percentiles
+
+
+class UnknownHouseError(LookupError):
+    def __init__(self, house: str):
+        self.house = house
@@ -0,0 +1,139 @@
+"""This module provides an in-memory stand-in for the central database, for load tests and local experiments.
+
+It serves synthetic days of a synthetic house and simulates the latency of a remote database, so that the behaviour of
+the API under load can be reproduced without a CouchDB server.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from datetime import date as Date
+from datetime import datetime
+
+from typing import Dict
+from typing import Sequence
+from typing import Tuple
+
+from CleanEmonCore.models import EnergyData
+
+from .adapters import EnergyDataAdapter
+from .synthetic import INTERVAL
+from .synthetic import SAMPLES_PER_DAY
+from .synthetic import synthetic_day
+
+DEFAULT_META = {"size": 85}
+
+
+class InMemoryAdapter(EnergyDataAdapter):
+    """Serves synthetic days, generated (deterministically) on first access and kept in memory. Past days are complete,
+    while today holds the samples up to now. Every operation sleeps for `latency` plus up to `jitter` seconds.
+    """
+
+    def __init__(self, house: str = "house", *, latency: float = 0, jitter: float = 0, meta: Dict = None):
+        """
+        house -- the name of the house. Different houses get different data
+        latency -- the minimum simulated round-trip time of each operation, in seconds
+        jitter -- the maximum extra (random) round-trip time of each operation, in seconds
+        meta -- the metadata of the house
+        """
+
+        self.db = f"memory:{house}"
+        self.house = house
+        self.latency = latency
+        self.jitter = jitter
+
+        self._meta = dict(DEFAULT_META if meta is None else meta)
+        self._days = {}  # date -> (revision, EnergyData)
+        self._generated = {}  # date -> number of samples that were generated for it
+        self._updated = set()  # dates whose data were replaced through `update_energy_data_by_date`
+        self._lock = threading.Lock()
+        self._random = random.Random(house)
+
+        self.operations = 0
+
+    def _round_trip(self):
+        with self._lock:
+            self.operations += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _seed(self, date: str) -> int:
+        return int(hashlib.sha256(f"{self.house}|{date}".encode()).hexdigest()[:8], 16)
+
+    def _revision(self, date: str, generation: int) -> str:
+        """Returns a CouchDB-like revision (`<generation>-<hash>`)"""
+
+        return f"{generation}-{hashlib.sha256(f'{self.house}|{date}|{generation}'.encode()).hexdigest()[:32]}"
+
+    def _day(self, date: str) -> Tuple[str, EnergyData]:
+        """Returns the revision and the data of the given date, generating them if needed"""
+
+        today = Date.today().isoformat()
+        if date > today:
+            return "", EnergyData(date, [])
+
+        samples = SAMPLES_PER_DAY
+        if date == today:
+            midnight = datetime.combine(Date.today(), datetime.min.time())
+            samples = min(SAMPLES_PER_DAY, int((datetime.now() - midnight).total_seconds() // INTERVAL))
+
+        with self._lock:
+            stored = self._days.get(date)
+            if stored is not None and (date in self._updated or self._generated.get(date) == samples):
+                return stored
+
+        # Today keeps growing, so it gets a new revision with every new sample
+        data = synthetic_day(date, self._seed(date), samples=samples)
+        with self._lock:
+            if date in self._updated:
+                return self._days[date]
+            self._days[date] = (self._revision(date, samples), data)
+            self._generated[date] = samples
+            return self._days[date]
+
+    def fetch_energy_data_by_date(self, date: str, sensors: Sequence[str] = None) -> EnergyData:
+        return self.fetch_energy_data_with_revision(date, sensors=sensors)[0]
+
+    def fetch_energy_data_with_revision(self, date: str, sensors: Sequence[str] = None) -> Tuple[EnergyData, str]:
+        self._round_trip()
+
+        revision, data = self._day(date)
+        records = data.energy_data
+        if sensors is not None:
+            records = [{sensor: record[sensor] for sensor in sensors if sensor in record} for record in records]
+        else:
+            records = [dict(record) for record in records]
+
+        return EnergyData(data.date, records), revision
+
+    def fetch_revision_by_date(self, date: str) -> str:
+        self._round_trip()
+
+        revision, _ = self._day(date)
+        return revision
+
+    def fetch_document_revision(self, document: str) -> str:
+        """Documents are named after their dates, except for the "meta" document"""
+
+        self._round_trip()
+
+        if document == "meta":
+            return "1-meta"
+        return self._day(document)[0]
+
+    def fetch_meta_with_revision(self) -> Tuple[Dict, str]:
+        self._round_trip()
+
+        return dict(self._meta), "1-meta"
+
+    def update_energy_data_by_date(self, date: str, data: EnergyData) -> bool:
+        self._round_trip()
+
+        with self._lock:
+            revision = self._days.get(date, ("0-",))[0]
+            generation = int(revision.split("-", 1)[0]) + 1
+            self._days[date] = (self._revision(date, generation), EnergyData(date, list(data.energy_data)))
+            self._updated.add(date)
+        return True
@@ -0,0 +1,104 @@
+"""This module provides the building blocks of multi-house support.
+
+Every house lives in its own database of the central CouchDB server. The house of the `[DB]` section of the config file
+is the default one, while any other served house is listed in the `[Houses]` section:
+
+    [Houses]
+    databases = house_a, house_b
+"""
+
+import configparser
+import threading
+from collections import OrderedDict
+
+from typing import Callable
+from typing import Generic
+from typing import List
+from typing import Optional
+from typing import TypeVar
+
+DEFAULT_POOL_SIZE = 16
+
+T = TypeVar("T")
+
+
+def configured_houses(config_file: str) -> List[str]:
+    """Returns the databases of all houses that may be served, the default one first"""
+
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.read(config_file)
+
+    houses = [cfg["DB"]["db_name"]] if cfg.has_option("DB", "db_name") else []
+    if cfg.has_option("Houses", "databases"):
+        for house in cfg["Houses"]["databases"].replace(",", " ").split():
+            if house not in houses:
+                houses.append(house)
+
+    return houses
+
+
+class AdapterPool(Generic[T]):
+    """A bounded, thread-safe pool of adapters, one per database. Whenever more than `max_size` databases are in use,
+    the adapter of the least recently used one is closed (if it can be) and dropped.
+    """
+
+    def __init__(self, factory: Callable[[str], T], max_size: int = DEFAULT_POOL_SIZE, *,
+                 on_evict: Callable[[str, T], None] = None):
+        """
+        factory -- creates the adapter of a database
+        max_size -- the maximum number of adapters that are kept open at the same time
+        on_evict -- called with the database and its adapter, whenever an adapter is dropped
+        """
+
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.on_evict = on_evict
+
+        self._adapters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, database: str) -> T:
+        with self._lock:
+            adapter = self._adapters.get(database)
+            if adapter is not None:
+                self._adapters.move_to_end(database)
+                return adapter
+
+            adapter = self.factory(database)
+            self._adapters[database] = adapter
+
+            evicted = []
+            while len(self._adapters) > self.max_size:
+                evicted.append(self._adapters.popitem(last=False))
+
+        for evicted_database, evicted_adapter in evicted:
+            self._close(evicted_database, evicted_adapter)
+
+        return adapter
+
+    def _close(self, database: str, adapter: T):
+        if self.on_evict is not None:
+            self.on_evict(database, adapter)
+
+        close = getattr(adapter, "close", None)
+        if close is not None:
+            close()
+
+    def clear(self):
+        with self._lock:
+            adapters = list(self._adapters.items())
+            self._adapters.clear()
+
+        for database, adapter in adapters:
+            self._close(database, adapter)
+
+    def __contains__(self, database: str) -> bool:
+        with self._lock:
+            return database in self._adapters
+
+    def __len__(self) -> int:
+        return len(self._adapters)
+
+    def databases(self) -> List[Optional[str]]:
+        with self._lock:
+            return list(self._adapters)
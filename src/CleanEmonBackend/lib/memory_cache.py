@@ -0,0 +1,127 @@
+"""This module provides a memory-bounded, in-process LRU cache that sits in front of the slower data sources"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MiB
+
+
+class MemoryCache:
+    """Thread-safe LRU cache, bounded by the total (estimated) size of its values rather than by their count.
+
+    Whenever a new value would make the cache exceed `max_bytes`, the least recently used entries are evicted. Each
+    entry may also carry its own time-to-live, after which it is treated as missing.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, *, sizeof: Callable[[Any], int] = sys.getsizeof):
+        """
+        max_bytes -- the byte budget of the cache
+        sizeof -- a function that estimates the size of a value in bytes
+        """
+
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+
+        # key -> (value, size, expiration time or None)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        """The estimated number of bytes that are currently held by the cache"""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key: Hashable) -> Optional[tuple]:
+        """Returns the (non-expired) entry of `key` or None. Must be called while holding the lock."""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        _, _, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+
+        return entry
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the value stored under `key`, marking it as the most recently used one. If there is no such value,
+        or it has expired, `default` is returned instead.
+        """
+
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, *, ttl: float = None) -> bool:
+        """Stores `value` under `key`. Returns False if the value alone exceeds the byte budget and thus was not stored.
+
+        key -- any hashable object
+        value -- the value to be stored. It should be treated as read-only from now on, as it will be shared among
+        all callers of `get`
+        ttl -- seconds after which the entry expires. If omitted, the entry lives until it gets evicted
+        """
+
+        size = self._sizeof(value)
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if size > self.max_bytes:
+                return False
+
+            self._entries[key] = (value, size, expires_at)
+            self._size += size
+
+            # Evict the least recently used entries until we are back within budget
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+        return True
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Removes every entry whose key satisfies `predicate`. Returns the number of removed entries."""
+
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
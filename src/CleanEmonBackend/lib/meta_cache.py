@@ -0,0 +1,56 @@
+"""This module provides a cache for the metadata document of a house"""
+
+import time
+import threading
+
+from typing import Dict
+
+DEFAULT_TTL = 60  # Seconds
+
+
+class MetaCache:
+    """Caches the metadata document that is served by `adapter`.
+
+    Within `ttl` seconds from the last validation, the cached metadata are served as-is. After that, the revision of the
+    document is compared against the cached one, which is a cheap HEAD request, and the document is fetched again only
+    if it has actually changed.
+    """
+
+    def __init__(self, adapter, ttl: float = DEFAULT_TTL):
+        """
+        adapter -- an object that provides `fetch_meta_with_revision()` and `fetch_document_revision(document)`
+        ttl -- seconds during which the cached metadata are considered fresh
+        """
+
+        self.adapter = adapter
+        self.ttl = ttl
+
+        self._meta = None
+        self._revision = ""
+        self._validated_at = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> Dict:
+        """Returns (a copy of) the metadata"""
+
+        with self._lock:
+            now = time.monotonic()
+
+            if self._meta is not None and now - self._validated_at < self.ttl:
+                return dict(self._meta)
+
+            if self._meta is not None and self._revision:
+                if self.adapter.fetch_document_revision("meta") == self._revision:
+                    self._validated_at = now
+                    return dict(self._meta)
+
+            self._meta, self._revision = self.adapter.fetch_meta_with_revision()
+            self._validated_at = now
+            return dict(self._meta)
+
+    def invalidate(self):
+        """Forces the next `get` to fetch the metadata again"""
+
+        with self._lock:
+            self._meta = None
+            self._revision = ""
@@ -0,0 +1,326 @@
+"""This module provides lightweight, thread-safe instrumentation that is exposed in the Prometheus text format.
+
+Metrics live in a process-wide registry. The API serves it on `/metrics`, while the disaggregation service, which runs
+in its own process, periodically saves a snapshot of it, so that the API can serve its metrics as well.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from .. import DATA_DIR
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DISAGGREGATOR_SNAPSHOT = os.path.join(DATA_DIR, "disaggregator.metrics.json")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+# A sample is (name, labels, value). A family is (type, documentation, samples).
+Sample = Tuple[str, Dict[str, str], float]
+Family = Tuple[str, str, List[Sample]]
+
+
+class Registry:
+    """A collection of metrics that are rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def collect(self) -> Dict[str, Family]:
+        """Returns name -> family of every metric that has at least one sample"""
+
+        families = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        for metric in metrics:
+            samples = metric.samples()
+            if samples:
+                families[metric.name] = (metric.type, metric.documentation, samples)
+
+        return families
+
+    def reset(self):
+        """Drops the samples of every metric. Mainly meant for testing."""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), *,
+                 registry: Optional[Registry] = REGISTRY):
+        """
+        name -- the name of the metric
+        documentation -- a short description of the metric
+        labelnames -- the names of the labels that every sample carries
+        registry -- where the metric is registered. None means nowhere
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> state
+        self._lock = threading.Lock()
+
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_in_progress(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class CallbackGauge(Metric):
+    """A gauge whose samples are computed on collection, e.g. the size of a cache"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]], *, registry: Optional[Registry] = REGISTRY):
+        """
+        callback -- returns label values -> value
+        """
+
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.callback = callback
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, self._labels(tuple(key)), value) for key, value in self.callback().items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), *,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        """
+        buckets -- the upper bounds of the buckets, in increasing order
+        """
+
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        for key, counts, total in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+
+        return samples
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(float(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(*families: Dict[str, Family]) -> str:
+    """Renders the given collections of families in the Prometheus text format. Families of the same name are merged,
+    so their samples must be told apart by their labels.
+    """
+
+    merged = {}
+    for collection in families:
+        for name, (metric_type, documentation, samples) in collection.items():
+            if name in merged:
+                merged[name][2].extend(samples)
+            else:
+                merged[name] = (metric_type, documentation, list(samples))
+
+    lines = []
+    for name in sorted(merged):
+        metric_type, documentation, samples = merged[name]
+        lines.append(f"# HELP {name} {_escape(documentation)}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample_name, labels, value in samples:
+            if labels:
+                label_str = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+                lines.append(f"{sample_name}{{{label_str}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def with_labels(families: Dict[str, Family], **labels: str) -> Dict[str, Family]:
+    """Returns the given families with extra labels added to every sample"""
+
+    return {name: (metric_type, documentation, [(sample, dict(sample_labels, **labels), value)
+                                                for sample, sample_labels, value in samples])
+            for name, (metric_type, documentation, samples) in families.items()}
+
+
+def save_snapshot(path: str, registry: Registry = REGISTRY):
+    """Saves the current samples of `registry` into `path`, so that another process can serve them. It is safe to be
+    called concurrently, by multiple threads and processes.
+    """
+
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "w") as f_out:
+        json.dump(registry.collect(), f_out)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> Dict[str, Family]:
+    """Returns the families saved by `save_snapshot`, or nothing if there is no (valid) snapshot"""
+
+    try:
+        with open(path, "r") as f_in:
+            families = json.load(f_in)
+    except (OSError, ValueError):
+        return {}
+
+    return {name: (metric_type, documentation, [(sample, labels, value) for sample, labels, value in samples])
+            for name, (metric_type, documentation, samples) in families.items()}
+
+
+# --- Backend metrics ---
+
+STAGE_SECONDS = Histogram("cleanemon_stage_duration_seconds",
+                          "Time spent in each stage of request handling and disaggregation", ["stage"],
+                          buckets=DEFAULT_BUCKETS + (30, 60, 120, 300))
+CACHE_REQUESTS = Counter("cleanemon_cache_requests_total", "Cache lookups, by cache and result", ["cache", "result"])
+REQUESTS_IN_FLIGHT = Gauge("cleanemon_http_requests_in_flight", "Requests currently being handled", ["endpoint"])
+REQUEST_SECONDS = Histogram("cleanemon_http_request_duration_seconds", "Time until the response starts",
+                            ["endpoint", "method", "status"])
+DISAGGREGATION_SECONDS = Histogram("cleanemon_disaggregation_job_duration_seconds",
+                                   "Duration of the disaggregation of a single date", ["result"], buckets=JOB_BUCKETS)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Records the time spent in the enclosed block as the given stage (fetch, cache, prepare, inference, serialize,
+    plot, ...)
+    """
+
+    with STAGE_SECONDS.time(stage=stage):
+        yield
+
+
+def count_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
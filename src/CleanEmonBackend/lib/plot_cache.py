@@ -0,0 +1,167 @@
+"""This module provides a content-addressed, size-bounded on-disk cache for rendered plots.
+
+Each plot is stored as `<date>-<digest>.png`, where the digest is derived from everything that affects the rendered
+image. The date prefix allows all plots of a date to be invalidated at once, e.g. after its data were disaggregated.
+"""
+
+import os
+import hashlib
+import threading
+
+from typing import BinaryIO
+from typing import Callable
+from typing import List
+from typing import Optional
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MiB
+PLOT_EXTENSION = ".png"
+
+
+def plot_key(date: str, sensors: Optional[List[str]], width: float, height: float, dpi: int,
+             house: str = None) -> str:
+    """Returns the cache key of a plot.
+
+    date -- a valid date string in `YYYY-MM-DD` format, or a range of dates like `YYYY-MM-DD..YYYY-MM-DD`
+    sensors -- the plotted sensors. The order and case of the sensors do not matter, while None means "all sensors"
+    width, height -- the size of the plot in inches
+    dpi -- the resolution of the plot
+    house -- the house of the plotted data. None means the default house
+    """
+
+    if sensors:
+        sensors = ",".join(sorted({sensor.lower() for sensor in sensors}))
+    else:
+        sensors = "*"
+
+    content = f"{sensors}|{width:g}|{height:g}|{dpi}"
+    if house is not None:
+        content = f"{content}|{house}"
+
+    digest = hashlib.sha256(content.encode()).hexdigest()[:32]
+    return f"{date}-{digest}"
+
+
+class PlotCache:
+    """A directory of rendered plots, bounded by their total size. Whenever it grows beyond `max_bytes`, the least
+    recently used plots are removed. Since the cache lives on disk, it is shared among processes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        directory -- where the plots are stored
+        max_bytes -- the byte budget of the cache
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{PLOT_EXTENSION}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the path of the cached plot, or None if it is not cached"""
+
+        path = self.path(key)
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def put(self, key: str, write: Callable[[BinaryIO], None]) -> str:
+        """Stores the plot that `write` writes into the given binary file and returns its path. The plot replaces any
+        previous version atomically, so that concurrent readers never get a partially written file.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = self.path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, "wb") as f_out:
+                write(f_out)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict(keep=path)
+        return path
+
+    def _entries(self):
+        """Returns (mtime, size, path) of every cached plot, least recently used first"""
+
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+
+        for name in names:
+            if not name.endswith(PLOT_EXTENSION):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # Removed in the meantime
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        return entries
+
+    def evict(self, keep: str = None) -> int:
+        """Removes the least recently used plots, until the cache fits in its budget. Returns the number of removed
+        plots. The plot at `keep` is never removed.
+        """
+
+        with self._lock:
+            entries = self._entries()
+            size = sum(entry_size for _, entry_size, _ in entries)
+
+            evicted = 0
+            for _, entry_size, path in entries:
+                if size <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                size -= entry_size
+                evicted += 1
+
+        return evicted
+
+    def invalidate(self, date: str) -> int:
+        """Removes every plot of the given date (including any range that contains it). Returns the number of removed
+        plots.
+        """
+
+        removed = 0
+        for _, _, path in self._entries():
+            prefix = os.path.basename(path).rsplit("-", 1)[0]
+            from_date, _, to_date = prefix.partition("..")
+            if from_date <= date <= (to_date or from_date):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+
+        return removed
+
+    @property
+    def size(self) -> int:
+        return sum(entry_size for _, entry_size, _ in self._entries())
+
+    def __len__(self):
+        return len(self._entries())
@@ -1,18 +1,25 @@
 import os
 from datetime import datetime
 
+from typing import BinaryIO
+from typing import Dict
 from typing import List
+from typing import Sequence
+from typing import Tuple
+from typing import Union
 
-from matplotlib import pyplot as plt
-import pandas as pd
 import numpy as np
 
 from CleanEmonCore.models import EnergyData
 
 from .. import PLOT_DIR
+from .columnar import ColumnarEnergyData
 
-if not os.path.exists(PLOT_DIR):
-    os.makedirs(PLOT_DIR, exist_ok=True)
+DEFAULT_WIDTH = 12  # inches
+DEFAULT_HEIGHT = 6  # inches
+DEFAULT_DPI = 100
+MAX_SIZE = 40  # inches
+MAX_DPI = 600
 
 
 def timestamp_to_label(stamp):
@@ -23,42 +30,99 @@ def timestamp_to_label(stamp):
     return dt.strftime("%H:%M:%S")
 
 
-def plot_data(energy_data: EnergyData, *, columns: List[str] = None, name="plot"):
-    """Visualization the given dataframe"""
+def _new_figure(width: float, height: float):
+    """Returns a new figure, drawn on its own Agg canvas. matplotlib is only loaded once the first plot is rendered."""
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(width, height))
+    FigureCanvasAgg(fig)
+    return fig
+
 
-    df = pd.DataFrame(energy_data.energy_data)
+def render_plot(energy_data: Union[EnergyData, ColumnarEnergyData], f_out: Union[str, BinaryIO], *,
+                columns: List[str] = None, width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT,
+                dpi: int = DEFAULT_DPI):
+    """Renders the given data as a PNG image into `f_out` (a path or a binary file).
+
+    Every call draws on its own figure rather than on the global pyplot state, so that plots can be safely rendered
+    from multiple threads at once.
+    """
+
+    if isinstance(energy_data, EnergyData):
+        energy_data = ColumnarEnergyData.from_energy_data(energy_data)
 
     if not columns:
         columns = []
     else:
         columns = [col.lower() for col in columns]
 
-    timestamp_label = "timestamp"
+    time = energy_data.timestamps
+    if time is None:
+        time = np.arange(len(energy_data), dtype=np.float64)
 
-    if timestamp_label in df:
-        time = df[timestamp_label]
-        df = df.drop([timestamp_label], axis=1)
-    else:
-        time = df.index
+    fig = _new_figure(width, height)
+    ax = fig.add_subplot()
 
-    for col, data in df.iteritems():
+    for col, data in energy_data.columns.items():
         # Skip any timestamp-like label
         if "timestamp" in str(col).lower():
             continue
         # Filter only selected columns
         if (columns and str(col).lower() in columns) or (not columns):
             mask = np.isfinite(data)
-            plt.plot(time[mask], data[mask], label=col)
-    skip = len(time) // 15
-
-    plt.subplots_adjust(bottom=0.25)
-    plt.xticks(time[0:-1:skip], time[0:-1:skip].map(timestamp_to_label), rotation=90, fontsize=8)
-    plt.legend()
-    plt.title(energy_data.date)
-    plt.xlabel("Time")
+            ax.plot(time[mask], data[mask], label=col)
+    skip = max(len(time) // 15, 1)
+
+    fig.subplots_adjust(bottom=0.25)
+    ax.set_xticks(time[0:-1:skip])
+    ax.set_xticklabels([timestamp_to_label(stamp) for stamp in time[0:-1:skip]], rotation=90, fontsize=8)
+    if ax.get_legend_handles_labels()[0]:
+        ax.legend()
+    ax.set_title(energy_data.date)
+    ax.set_xlabel("Time")
+    fig.savefig(f_out, format="png", dpi=dpi)
+
+
+def plot_data(energy_data: Union[EnergyData, ColumnarEnergyData], *, columns: List[str] = None, name="plot",
+              width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT, dpi: int = DEFAULT_DPI):
+    """Visualization the given dataframe. Returns the path of the resulting plot."""
+
+    os.makedirs(PLOT_DIR, exist_ok=True)
     fout_name = os.path.join(PLOT_DIR, f"{name}.png")
-    plt.savefig(fout_name, dpi=1000)
-    plt.cla()
-    plt.clf()
+    render_plot(energy_data, fout_name, columns=columns, width=width, height=height, dpi=dpi)
     return fout_name
 
+
+def render_envelope_plot(title: str, x: np.ndarray, envelopes: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                         f_out: Union[str, BinaryIO], *, ticks: Sequence[Tuple[float, str]] = (),
+                         width: float = DEFAULT_WIDTH, height: float = DEFAULT_HEIGHT, dpi: int = DEFAULT_DPI):
+    """Renders pre-reduced (min, max) envelopes as a PNG image into `f_out` (a path or a binary file). Each sensor is
+    drawn as a band between its minimum and maximum, which, at (about) one bucket per pixel, is visually identical to
+    plotting every single sample.
+
+    title -- the title of the plot
+    x -- the x-coordinate (timestamp) of each bucket
+    envelopes -- sensor -> (minimum, maximum) of each bucket. NaN buckets are left blank
+    ticks -- (x-coordinate, label) pairs of the x-axis ticks
+    """
+
+    fig = _new_figure(width, height)
+    ax = fig.add_subplot()
+
+    for sensor, (lower, upper) in envelopes.items():
+        ax.fill_between(x, lower, upper, label=sensor, linewidth=0.6, alpha=0.6)
+
+    if ticks:
+        skip = max(len(ticks) // 15, 1)
+        ticks = ticks[::skip]
+        ax.set_xticks([position for position, _ in ticks])
+        ax.set_xticklabels([label for _, label in ticks], rotation=90, fontsize=8)
+
+    fig.subplots_adjust(bottom=0.25)
+    if envelopes:
+        ax.legend()
+    ax.set_title(title)
+    ax.set_xlabel("Date")
+    fig.savefig(f_out, format="png", dpi=dpi)
@@ -0,0 +1,140 @@
+"""This module provides opt-in profiling of single API requests.
+
+An admin requests a profile with `?profile=true` (or the `X-Profile: true` header), authenticating with the token of
+the `admin.token` dot-file. The handler then runs under cProfile, while tracemalloc records its peak memory. Profiles
+are stored under `PROFILE_DIR`, from where they can be downloaded for inspection with `pstats` or snakeviz.
+"""
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import secrets
+import threading
+import time
+import tracemalloc
+import uuid
+from contextvars import ContextVar
+from functools import wraps
+
+from typing import Callable
+from typing import Optional
+
+from CleanEmonCore.dotfiles import get_dotfile
+
+from .. import DATA_DIR
+
+ADMIN_TOKEN_FILE = "admin.token"
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_SUFFIX = ".prof"
+SUMMARY_SUFFIX = ".txt"
+SUMMARY_LINES = 40  # Number of functions listed in the text summary of a profile
+
+# Set (per request) to the session of a request that should be profiled
+current_session: ContextVar[Optional["ProfileSession"]] = ContextVar("current_session", default=None)
+
+# tracemalloc is process-wide, so profiled handlers run one at a time
+_profile_lock = threading.Lock()
+
+
+def read_admin_token() -> Optional[str]:
+    """Returns the admin token, or None if there is none, in which case profiling is disabled"""
+
+    try:
+        with open(get_dotfile(ADMIN_TOKEN_FILE, fn=lambda path: None), "r") as f_in:
+            token = f_in.read().strip()
+    except OSError:
+        return None
+
+    return token or None
+
+
+def generate_admin_token(path: str) -> str:
+    """Generates a new admin token into `path` (readable only by its owner) and returns it"""
+
+    token = secrets.token_urlsafe(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f_out:
+        f_out.write(token)
+
+    return token
+
+
+def is_admin(token: Optional[str]) -> bool:
+    admin_token = read_admin_token()
+    if not admin_token or not token:
+        return False
+
+    return hmac.compare_digest(token.encode(), admin_token.encode())
+
+
+class ProfileSession:
+    """The profile of a single request"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.profile = None
+        self.duration = 0.0
+        self.peak_memory = 0
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Runs `fn` under the profiler, recording its duration and peak memory. Allocations of other threads during
+        that time are included in the peak memory as well.
+        """
+
+        profile = cProfile.Profile()
+        with _profile_lock:
+            tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                return profile.runcall(fn, *args, **kwargs)
+            finally:
+                self.duration = time.perf_counter() - start
+                _, self.peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.profile = profile
+
+    def summary(self) -> str:
+        stream = io.StringIO()
+        stream.write(f"Duration: {self.duration:.3f}s\n")
+        stream.write(f"Peak memory: {self.peak_memory / 2 ** 20:.1f} MiB\n\n")
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(SUMMARY_LINES)
+        return stream.getvalue()
+
+    def save(self, directory: str = None) -> Optional[str]:
+        """Stores the profile (in pstats format) and its text summary into `directory` (`PROFILE_DIR` by default).
+        Returns the path of the profile, or None if nothing was profiled.
+        """
+
+        if self.profile is None:
+            return None
+
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = profile_path(self.id, directory)
+        self.profile.dump_stats(path)
+        with open(profile_path(self.id, directory, summary=True), "w") as f_out:
+            f_out.write(self.summary())
+
+        return path
+
+
+def profile_path(profile_id: str, directory: str = None, *, summary: bool = False) -> str:
+    return os.path.join(directory or PROFILE_DIR, f"{profile_id}{SUMMARY_SUFFIX if summary else PROFILE_SUFFIX}")
+
+
+def profiled(fn: Callable) -> Callable:
+    """Decorates a request handler, so that it runs under the profiler whenever its request is being profiled. The
+    handler runs in the very same thread either way.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        session = current_session.get()
+        if session is None:
+            return fn(*args, **kwargs)
+
+        return session.run(fn, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,43 @@
+"""Vectorized descriptive statistics over columnar energy data"""
+
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _as_float(value) -> Optional[float]:
+    """Converts a numpy scalar into a JSON-friendly float. NaN becomes None."""
+
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def describe(values: np.ndarray, percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> Dict:
+    """Returns the count of valid values, min, max, mean and the requested percentiles of `values`, ignoring NaNs.
+    If there are no valid values, all statistics but the count are None.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    valid = values[np.isfinite(values)]
+
+    if not len(valid):
+        return {
+            "count": 0,
+            "min": None,
+            "max": None,
+            "mean": None,
+            "percentiles": {f"{p:g}": None for p in percentiles}
+        }
+
+    computed = np.percentile(valid, percentiles) if len(percentiles) else []
+    return {
+        "count": int(len(valid)),
+        "min": _as_float(valid.min()),
+        "max": _as_float(valid.max()),
+        "mean": _as_float(valid.mean()),
+        "percentiles": {f"{p:g}": _as_float(value) for p, value in zip(percentiles, computed)}
+    }
@@ -0,0 +1,98 @@
+"""This module implements the per-day summary index, which lets consumption-related queries be answered without
+touching the raw records of a day. The summary of each day lives next to its columnar cache, in
+`CACHE_DIR/<date>/summary.json`.
+"""
+
+import os
+import json
+import threading
+from dataclasses import dataclass
+from dataclasses import asdict
+
+from typing import Optional
+
+import numpy as np
+
+from CleanEmonCore.models import EnergyData
+
+from .columnar import ColumnarEnergyData
+
+SUMMARY_FILE = "summary.json"
+GAP_THRESHOLD = 10  # Seconds between two consecutive records, after which they are considered to be a gap
+
+
+@dataclass
+class DaySummary:
+    date: str
+    first_kwh: float = 0
+    last_kwh: float = 0
+    records: int = 0
+    gaps: int = 0
+
+    @property
+    def consumption(self) -> float:
+        return self.last_kwh - self.first_kwh
+
+
+def summarize(date_id: str, timestamps: np.ndarray, kwh: np.ndarray) -> DaySummary:
+    """Summarizes the given columns of a day.
+
+    It's not given that the first record of a day will always contain a valid kwh value and thus, the first valid
+    (finite and non-zero) value is actually searched. Same goes for the last valid value.
+    """
+
+    valid = np.flatnonzero(np.isfinite(kwh) & (kwh != 0))
+    first_kwh = float(kwh[valid[0]]) if len(valid) else 0
+    last_kwh = float(kwh[valid[-1]]) if len(valid) else 0
+
+    finite_timestamps = np.sort(timestamps[np.isfinite(timestamps)])
+    gaps = int(np.count_nonzero(np.diff(finite_timestamps) > GAP_THRESHOLD))
+
+    return DaySummary(date_id, first_kwh, last_kwh, len(kwh), gaps)
+
+
+def summarize_day(day: ColumnarEnergyData) -> DaySummary:
+    kwh = day.columns.get("kwh")
+    if kwh is None:
+        kwh = np.full(len(day), np.nan)
+    timestamps = day.timestamps
+    if timestamps is None:
+        timestamps = np.full(len(day), np.nan)
+
+    return summarize(day.date, timestamps, kwh)
+
+
+def summarize_energy_data(date_id: str, energy_data: EnergyData) -> DaySummary:
+    records = energy_data.energy_data
+    timestamps = np.array([record.get("timestamp") for record in records], dtype=np.float64)
+    kwh = np.array([record.get("kwh") for record in records], dtype=np.float64)
+
+    return summarize(date_id, timestamps, kwh)
+
+
+def load_summary(cache_dir: str, date_id: str) -> Optional[DaySummary]:
+    """Returns the stored summary of the given date, or None if there is no such summary"""
+
+    try:
+        with open(os.path.join(cache_dir, date_id, SUMMARY_FILE), "r") as f_in:
+            return DaySummary(**json.load(f_in))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def store_summary(cache_dir: str, summary: DaySummary):
+    day_dir = os.path.join(cache_dir, summary.date)
+    os.makedirs(day_dir, exist_ok=True)
+
+    path = os.path.join(day_dir, SUMMARY_FILE)
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "w") as f_out:
+        json.dump(asdict(summary), f_out)
+    os.replace(tmp_path, path)
+
+
+def drop_summary(cache_dir: str, date_id: str):
+    try:
+        os.remove(os.path.join(cache_dir, date_id, SUMMARY_FILE))
+    except OSError:
+        pass
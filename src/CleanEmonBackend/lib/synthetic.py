@@ -0,0 +1,60 @@
+"""This module generates synthetic, yet realistic, energy data for benchmarks and load tests.
+
+A real day holds one record every 5 seconds (17280 records), although samples arrive with some jitter, some of them
+are lost (gaps) and some sensors occasionally report nothing (NaNs, stored as nulls).
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+from CleanEmonCore.models import EnergyData
+
+SAMPLES_PER_DAY = 17280
+INTERVAL = 5  # seconds
+
+
+def synthetic_day(date: str = "2022-05-15", seed: int = 0, *, samples: int = SAMPLES_PER_DAY,
+                  gap_ratio: float = 0.02, nan_ratio: float = 0.01, jitter: float = INTERVAL / 2) -> EnergyData:
+    """Returns a day of synthetic energy data, with the same sensors as the real ones.
+
+    date -- the date of the data in `YYYY-MM-DD` format. Samples start at its (local) midnight
+    seed -- the seed of the random generator, so that days can be reproduced
+    samples -- the number of samples, before gaps are introduced
+    gap_ratio -- the ratio of samples that are lost
+    nan_ratio -- the ratio of sensor values that are missing (null)
+    jitter -- the maximum delay of each sample, in seconds
+    """
+
+    rng = np.random.default_rng(seed)
+    start = datetime.strptime(date, "%Y-%m-%d").timestamp()
+
+    timestamps = start + np.arange(samples) * INTERVAL + rng.uniform(0, jitter, samples)
+    hours = np.arange(samples) * INTERVAL / 3600
+
+    # Power follows a daily pattern (low at night, peaks in the evening), with random appliance spikes
+    daily = 150 + 250 * np.clip(np.sin((hours - 6) / 24 * 2 * np.pi), 0, None) + 600 * np.exp(-((hours - 20) ** 2) / 4)
+    spikes = rng.random(samples) < 0.005
+    power = np.round(daily + rng.normal(0, 30, samples) + spikes * rng.uniform(500, 2500, samples)).clip(0)
+    kwh = 760 + np.cumsum(power) * INTERVAL / 3600 / 1000
+    sensors = {
+        "power": power,
+        "kwh": kwh,
+        "vrms": rng.normal(240, 3, samples).round(2),
+        "temp": (24 + 2 * np.sin(hours / 24 * 2 * np.pi) + rng.normal(0, 0.1, samples)).round(1),
+        "external_temp": (20 + 6 * np.sin((hours - 9) / 24 * 2 * np.pi) + rng.normal(0, 0.2, samples)).round(1),
+        "humidity": (55 + 10 * np.cos(hours / 24 * 2 * np.pi) + rng.normal(0, 0.5, samples)).round(1),
+    }
+
+    columns = {}
+    for name, values in sensors.items():
+        values = values.astype(object)
+        values[rng.random(samples) < nan_ratio] = None
+        if name == "power":
+            values = [None if value is None else int(value) for value in values]
+        columns[name] = list(values)
+    columns["timestamp"] = timestamps.tolist()
+
+    kept = np.flatnonzero(rng.random(samples) >= gap_ratio)
+    records = [{name: values[i] for name, values in columns.items()} for i in kept.tolist()]
+    return EnergyData(date, records)
@@ -1,27 +1,206 @@
-from CleanEmonCore import CONFIG_FILE
-from CleanEmonCore.CouchDBAdapter import CouchDBAdapter
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
 
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+
+from CleanEmonBackend import DATA_DIR
 from CleanEmonBackend.Disaggregator.service import update
+from CleanEmonBackend.lib.DBConnector import adapter
+from CleanEmonBackend.lib.DBConnector import resolve_house
+from CleanEmonBackend.lib.DBConnector import using_house
+from CleanEmonBackend.lib.dates import date_range
+from CleanEmonBackend.lib.exceptions import BadDateError
+from CleanEmonBackend.lib.exceptions import BadDateRangeError
+from CleanEmonBackend.lib.exceptions import UnknownHouseError
+from CleanEmonBackend.lib.validation import is_valid_date
+from CleanEmonBackend.lib.validation import is_valid_date_range
 
-adapter = CouchDBAdapter(CONFIG_FILE)
-print(f"You are working on database: {adapter.db}")
+CHECKPOINT_FILE = os.path.join(DATA_DIR, "disaggregate.checkpoint")
+RANGE_SEPARATOR = ".."
 
+# NILM-Inference-APIs reads its input from a single file, so the inference of only one date can run at any time (see
+# `_exclusive_input_file`). Parallel jobs only overlap the fetching and uploading of dates with that inference, which
+# one more job is enough for.
+MAX_JOBS = 2
 
-def _disaggregate(date: str):
-    print(f"Working on {date}")
-    print("Disaggregating...")
-    update(date)
-    print("Done")
 
+def expand_dates(*specs: str) -> List[str]:
+    """Expands the given date specifications into a list of unique dates, in the order they were given.
+    A specification is either a single date (`YYYY-MM-DD`) or an inclusive range of dates (`YYYY-MM-DD..YYYY-MM-DD`).
 
-def disaggregate(*dates: str, no_prompt=False):
-    for date in dates:
-        if no_prompt:
-            ans = True
-        else:
-            ans = input(f"Proceed with {date}? (<enter>: no) ")
+    Throws:
+    BadDateError -- If a single date is invalid
+    BadDateRangeError -- If a range is invalid
+    """
 
-        if ans:
-            _disaggregate(date)
+    dates = {}
+    for spec in specs:
+        if RANGE_SEPARATOR in spec:
+            from_date, _, to_date = spec.partition(RANGE_SEPARATOR)
+            if not is_valid_date_range(from_date, to_date):
+                raise BadDateRangeError(from_date, to_date)
+            for date in date_range(from_date, to_date):
+                dates[date] = None
         else:
-            break
+            if not is_valid_date(spec):
+                raise BadDateError(spec)
+            dates[spec] = None
+
+    return list(dates)
+
+
+def load_checkpoint(checkpoint: str = CHECKPOINT_FILE) -> Set[str]:
+    """Returns the dates that were successfully disaggregated by an interrupted run"""
+
+    try:
+        with open(checkpoint, "r") as f_in:
+            return {line.strip() for line in f_in if line.strip()}
+    except OSError:
+        return set()
+
+
+def _mark_done(date: str, checkpoint: str):
+    with open(checkpoint, "a") as f_out:
+        f_out.write(f"{date}\n")
+
+
+def _clear_checkpoint(checkpoint: str):
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def checkpoint_file(house: Optional[str]) -> str:
+    """Returns the default checkpoint file of `house`, so that interrupted runs of different houses do not mix"""
+
+    if house is None:
+        return CHECKPOINT_FILE
+    return f"{CHECKPOINT_FILE}.{house}"
+
+
+def _run_job(date: str, house: Optional[str]) -> float:
+    start = time.monotonic()
+    with using_house(house):
+        update(date)
+    return time.monotonic() - start
+
+
+def _record_outcome(date: str, outcome: Callable[[], float], progress: str, checkpoint: str, failures: Dict[str, str]):
+    """Records the outcome of the job of `date`, i.e. marks it as done or adds it to `failures`
+
+    outcome -- returns the duration of the job, or raises its error
+    progress -- the position of the job among all jobs, as shown to the user
+    """
+
+    try:
+        elapsed = outcome()
+    except Exception as e:
+        failures[date] = f"{type(e).__name__}: {e}"
+        print(f"{progress} {date}: FAILED ({failures[date]})")
+    else:
+        _mark_done(date, checkpoint)
+        print(f"{progress} {date}: done in {elapsed:.1f}s")
+
+
+def _disaggregate_serially(dates: List[str], checkpoint: str, house: Optional[str],
+                           no_prompt: bool) -> Optional[Dict[str, str]]:
+    """Disaggregates `dates` of `house` one after the other, in this process. Returns the failed dates along with their
+    errors, or None if the user chose to stop.
+    """
+
+    failures = {}
+    for done, date in enumerate(dates, start=1):
+        if not no_prompt and not input(f"Proceed with {date}? (<enter>: no) "):
+            return None
+
+        _record_outcome(date, lambda: _run_job(date, house), f"[{done}/{len(dates)}]", checkpoint, failures)
+
+    return failures
+
+
+def _disaggregate_in_parallel(dates: List[str], jobs: int, checkpoint: str, house: Optional[str]) -> Dict[str, str]:
+    """Disaggregates `dates` of `house` across `jobs` processes. Returns the failed dates along with their errors.
+    Their inference is still serialized, so the processes only overlap the fetching and uploading of dates with it.
+    """
+
+    failures = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_run_job, date, house): date for date in dates}
+        for done, future in enumerate(as_completed(futures), start=1):
+            _record_outcome(futures[future], future.result, f"[{done}/{len(dates)}]", checkpoint, failures)
+
+    return failures
+
+
+def disaggregate(*dates: str, no_prompt=False, jobs: int = 1, checkpoint: str = None, fresh=False,
+                 house: str = None):
+    """Disaggregates the given dates of a house and sends the results back to its database.
+
+    Each successfully disaggregated date is recorded in a checkpoint file, so that an interrupted run can be resumed by
+    re-running it with the same dates. The checkpoint file is removed once a run completes without failures.
+
+    dates -- single dates (`YYYY-MM-DD`) and/or inclusive date ranges (`YYYY-MM-DD..YYYY-MM-DD`)
+    no_prompt -- if True, no confirmation is requested before proceeding
+    jobs -- the number of dates that are processed in parallel, each one in its own process. Their inference cannot
+    run in parallel, so only fetching and uploading are overlapped with it, and at most `MAX_JOBS` jobs are used
+    checkpoint -- the path of the checkpoint file. Defaults to the checkpoint file of the house
+    fresh -- if True, the checkpoint of a previous run is ignored
+    house -- the database of the house to work on. Defaults to the main house
+    """
+
+    try:
+        house = resolve_house(house)
+    except UnknownHouseError as e:
+        print(f"Unknown house ({e.house}), not listed in the config file")
+        return
+
+    print(f"You are working on database: {house or adapter.db}")
+    checkpoint = checkpoint or checkpoint_file(house)
+
+    try:
+        dates = expand_dates(*dates)
+    except BadDateError as e:
+        print(f"Bad date ({e.bad_date}), not in ISO format (YYYY-MM-DD)")
+        return
+    except BadDateRangeError as e:
+        print(f"Bad date range ({e.bad_from_date}..{e.bad_to_date})")
+        return
+
+    if fresh:
+        _clear_checkpoint(checkpoint)
+
+    completed = load_checkpoint(checkpoint)
+    pending = [date for date in dates if date not in completed]
+    if len(pending) < len(dates):
+        print(f"Resuming: skipping {len(dates) - len(pending)} already disaggregated dates")
+
+    if not pending:
+        _clear_checkpoint(checkpoint)
+        return
+
+    if jobs > MAX_JOBS:
+        print(f"Using {MAX_JOBS} jobs instead of {jobs}, as the inference of only one date can run at any time")
+        jobs = MAX_JOBS
+
+    if jobs <= 1:
+        failures = _disaggregate_serially(pending, checkpoint, house, no_prompt)
+        if failures is None:
+            return
+    else:
+        if not no_prompt and not input(f"Proceed with {len(pending)} dates using {jobs} jobs? (<enter>: no) "):
+            return
+
+        failures = _disaggregate_in_parallel(pending, jobs, checkpoint, house)
+
+    print(f"Disaggregated {len(pending) - len(failures)}/{len(pending)} dates")
+    if failures:
+        print("Failed dates (re-run to retry them):")
+        for date in sorted(failures):
+            print(f"  {date}: {failures[date]}")
+    else:
+        _clear_checkpoint(checkpoint)
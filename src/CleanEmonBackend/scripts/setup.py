@@ -13,3 +13,14 @@ def generate_nilm_inference_apis_config(config_file):
         with open(config_file, "w") as f_out:
             f_out.write(nilm_path)
         print(f"Config file was generated successfully at {config_file}")
+
+
+def generate_admin_token_file():
+    from CleanEmonCore.dotfiles import get_dotfile
+    from CleanEmonBackend.lib.profiling import ADMIN_TOKEN_FILE
+    from CleanEmonBackend.lib.profiling import generate_admin_token
+
+    token_file = get_dotfile(ADMIN_TOKEN_FILE, fn=lambda path: None)
+    token = generate_admin_token(token_file)
+    print(f"Admin token was generated successfully at {token_file}")
+    print(f"Use it as `Authorization: Bearer {token}` to profile requests (`?profile=true`)")
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -78,3 +80,409 @@ class TestGetData:
 
         assert "message" in data
         assert to_date in data["message"]
+
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path):
+    """Serves synthetic data instead of the central database and caches into a temporary directory. Returns the dates
+    that were fetched from the "database" (`fetched`), the revisions of the data (`revisions`) and the records served
+    for specific dates instead of the synthetic ones (`days`). The last two can be changed.
+    """
+
+    from types import SimpleNamespace
+    from datetime import datetime
+    from CleanEmonCore.models import EnergyData
+    from CleanEmonBackend.lib import DBConnector
+
+    fetched = []
+    revisions = {}
+    days = {}
+
+    def fetch_energy_data_by_date(date, sensors=None):
+        fetched.append(date)
+        start = datetime.strptime(date, "%Y-%m-%d").timestamp()
+        records = days.get(date) or [{"timestamp": start + 5 * i, "power": float(i % 50), "kwh": i / 1000}
+                                     for i in range(1000)]
+        if sensors is not None:
+            records = [{sensor: record[sensor] for sensor in sensors if sensor in record} for record in records]
+        return EnergyData(date, records)
+
+    def fetch_revision_by_date(date):
+        return revisions.get(date, "1-a")
+
+    def fetch_energy_data_with_revision(date, sensors=None):
+        return fetch_energy_data_by_date(date, sensors), fetch_revision_by_date(date)
+
+    monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_by_date", fetch_energy_data_by_date)
+    monkeypatch.setattr(DBConnector.adapter, "fetch_revision_by_date", fetch_revision_by_date)
+    monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_with_revision", fetch_energy_data_with_revision)
+    monkeypatch.setattr(DBConnector, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(DBConnector.plot_cache, "directory", str(tmp_path / "plots"))
+    DBConnector.memory_cache.clear()
+    DBConnector.response_cache.clear()
+    DBConnector.summary_index.clear()
+
+    return SimpleNamespace(fetched=fetched, revisions=revisions, days=days)
+
+
+class TestEncodedResponses:
+
+    def test_json_date(self, offline):
+        response = client.get("/json/date/2022-05-01?sensors=power&max_points=100")
+        data = response.json()
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert data["date"] == "2022-05-01"
+        assert 0 < len(data["energy_data"]) <= 100
+        assert set(data["energy_data"][0]) == {"timestamp", "power"}
+
+        # The encoded day is reused as long as the revision of the data does not change
+        assert client.get("/json/date/2022-05-01?sensors=power&max_points=100").content == response.content
+        assert len(offline.fetched) == 1
+
+        offline.revisions["2022-05-01"] = "2-b"
+        assert client.get("/json/date/2022-05-01?sensors=power&max_points=100").content == response.content
+        assert len(offline.fetched) == 2
+
+    def test_bad_max_points(self, offline):
+        for max_points in [0, -1]:
+            assert client.get(f"/json/date/2022-05-01?max_points={max_points}").status_code == 422
+            assert client.get(f"/json/range/2022-05-01/2022-05-02?max_points={max_points}").status_code == 422
+        assert not offline.fetched
+
+    def test_json_range(self, offline):
+        day = client.get("/json/date/2022-05-01").json()
+        data = client.get("/json/range/2022-05-01/2022-05-03").json()
+
+        assert data["from_date"] == "2022-05-01"
+        assert data["to_date"] == "2022-05-03"
+        assert [day["date"] for day in data["range_data"]] == ["2022-05-01", "2022-05-02", "2022-05-03"]
+        assert data["range_data"][0] == day
+        assert len(offline.fetched) == 3  # The first day was already encoded
+
+        lines = client.get("/json/range/2022-05-01/2022-05-03?stream=true").text.splitlines()
+        assert [json.loads(line) for line in lines] == data["range_data"]
+        assert len(offline.fetched) == 3
+
+    def test_irregular_records(self, offline):
+        from CleanEmonBackend.lib import DBConnector
+
+        # Non-numeric fields and records that lack some fields are given back as they are
+        records = [
+            {"timestamp": 1, "power": 1.5, "status": "ok"},
+            {"timestamp": 6, "power": 2},
+            {"timestamp": 11, "status": "late", "kwh": 0.1},
+        ]
+        offline.days["2022-05-01"] = records
+
+        assert client.get("/json/date/2022-05-01").json()["energy_data"] == records
+        assert client.get("/json/range/2022-05-01/2022-05-01").json()["range_data"][0]["energy_data"] == records
+        assert client.get("/json/date/2022-05-01?sensors=status").json()["energy_data"] == [
+            {"timestamp": 1, "status": "ok"}, {"timestamp": 6}, {"timestamp": 11, "status": "late"}]
+
+        # ... even when they are read from the disk cache
+        DBConnector.memory_cache.clear()
+        assert client.get("/json/date/2022-05-01?from_cache=true").json()["energy_data"] == records
+        lines = client.get("/json/range/2022-05-01/2022-05-01?stream=true&chunk_size=2&from_cache=true").text
+        assert [json.loads(line)["energy_data"] for line in lines.splitlines()] == [records[:2], records[2:]]
+
+    def test_empty_range(self, offline):
+        from CleanEmonBackend.API.API import encode_range_data
+        from CleanEmonBackend.API.API import iter_range_data
+
+        assert list(iter_range_data("2022-05-02", "2022-05-01", False, max_points=100)) == []
+        assert json.loads(encode_range_data("2022-05-02", "2022-05-01", False, max_points=100))["range_data"] == []
+
+
+class TestStreaming:
+
+    def test_json_range_stream(self, offline):
+        response = client.get("/json/range/2022-05-01/2022-05-02?stream=true")
+        lines = response.text.splitlines()
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+
+        assert len(lines) == 2
+        for line, date in zip(lines, ["2022-05-01", "2022-05-02"]):
+            data = json.loads(line)
+            assert data["date"] == date
+            assert type(data["energy_data"]) is list
+
+    def test_chunks(self, offline):
+        response = client.get("/json/range/2022-05-01/2022-05-02", params={"chunk_size": 400},
+                              headers={"Accept": "application/x-ndjson"})
+        chunks = [json.loads(line) for line in response.text.splitlines()]
+
+        assert [chunk["date"] for chunk in chunks] == ["2022-05-01"] * 3 + ["2022-05-02"] * 3
+        assert [len(chunk["energy_data"]) for chunk in chunks] == [400, 400, 200] * 2
+
+    def test_bad_chunk_size(self, offline):
+        for chunk_size in [0, -1]:
+            response = client.get(f"/json/range/2022-05-01/2022-05-02?stream=true&chunk_size={chunk_size}")
+            assert response.status_code == 422
+        assert not offline.fetched
+
+
+class TestConditionalResponses:
+
+    def test_not_modified(self, offline):
+        response = client.get("/json/date/2022-05-01?sensors=power")
+        etag = response.headers["etag"]
+
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "public, max-age=3600"
+
+        # A matching ETag is answered without loading the data again
+        fetched = len(offline.fetched)
+        not_modified = client.get("/json/date/2022-05-01?sensors=power", headers={"If-None-Match": f'"x", {etag}'})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["etag"] == etag
+        assert not not_modified.content
+        assert len(offline.fetched) == fetched
+
+        # Other parameters and newer revisions yield other ETags
+        assert client.get("/json/date/2022-05-01?sensors=kwh").headers["etag"] != etag
+        offline.revisions["2022-05-01"] = "2-b"
+        response = client.get("/json/date/2022-05-01?sensors=power", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    def test_range_and_plot(self, offline):
+        for url in ["/json/range/2022-05-01/2022-05-02", "/json/range/2022-05-01/2022-05-02?stream=true",
+                    "/plot/date/2022-05-01?width=4&height=3&dpi=50"]:
+            etag = client.get(url).headers["etag"]
+            assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+        # Cached data may be stale, so they cannot be revalidated
+        assert "etag" not in client.get("/json/date/2022-05-01?from_cache=true").headers
+
+    def test_today(self, offline):
+        response = client.get("/json/date/today?sensors=power")
+        assert response.headers["cache-control"] == "no-cache"
+
+    def test_compression(self, offline):
+        response = client.get("/json/date/2022-05-01", headers={"Accept-Encoding": "gzip"})
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json()["date"] == "2022-05-01"
+
+
+class TestMetrics:
+
+    def test_metrics(self, offline):
+        client.get("/json/date/2022-05-01?sensors=power")
+        client.get("/json/date/2022-05-01?sensors=power&from_cache=true")
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+
+        text = response.text
+        for stage in ["fetch", "prepare", "serialize"]:
+            assert f'cleanemon_stage_duration_seconds_count{{stage="{stage}",process="api"}}' in text
+        assert 'cleanemon_cache_requests_total{cache="response",result="hit",process="api"}' in text
+        assert ('cleanemon_http_request_duration_seconds_count{endpoint="/json/date/{date}",method="GET",'
+                'status="200",process="api"}') in text
+        assert 'cleanemon_http_requests_in_flight{endpoint="/metrics",process="api"} 1' in text
+
+
+class TestProfiling:
+
+    @pytest.fixture
+    def admin(self, monkeypatch, tmp_path):
+        from CleanEmonBackend.lib import profiling
+
+        monkeypatch.setattr(profiling, "read_admin_token", lambda: "secret")
+        monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path / "profiles"))
+        return {"Authorization": "Bearer secret"}
+
+    def test_profile(self, offline, admin):
+        response = client.get("/json/date/2022-05-01?sensors=power&profile=true", headers=admin)
+        profile_id = response.headers["x-profile-id"]
+
+        assert response.status_code == 200
+        assert response.json()["date"] == "2022-05-01"
+        assert int(response.headers["x-profile-peak-memory"]) > 0
+
+        summary = client.get(f"/profiles/{profile_id}?summary=true", headers=admin)
+        assert summary.status_code == 200
+        assert "encode_data" in summary.text  # The handler ran under the profiler, in its worker thread
+
+        profile = client.get(f"/profiles/{profile_id}", headers=admin)
+        assert profile.status_code == 200
+        assert profile.headers["content-type"] == "application/octet-stream"
+
+        assert client.get("/profiles/0123456789abcdef0123456789abcdef", headers=admin).status_code == 404
+        assert client.get("/profiles/..%2F..%2Fclean.cfg", headers=admin).status_code == 404
+
+    def test_profile_stream(self, offline, admin):
+        response = client.get("/json/range/2022-05-01/2022-05-02?stream=true&profile=true", headers=admin)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert len(response.text.splitlines()) == 2
+
+        # The stream was consumed under the profiler, so the profile covers the fetching of the data
+        summary = client.get(f"/profiles/{response.headers['x-profile-id']}?summary=true", headers=admin)
+        assert "iter_range_ndjson" in summary.text
+
+    def test_admins_only(self, offline, admin):
+        assert client.get("/json/date/2022-05-01?profile=true").status_code == 403
+        assert client.get("/json/date/2022-05-01", headers={"X-Profile": "true",
+                                                            "X-Admin-Token": "wrong"}).status_code == 403
+        assert client.get("/profiles/0123456789abcdef0123456789abcdef").status_code == 403
+
+        # Without the switch, nothing is profiled
+        assert "x-profile-id" not in client.get("/json/date/2022-05-01", headers=admin).headers
+
+
+class TestPlots:
+
+    def test_plot_range(self, offline):
+        response = client.get("/plot/range/2022-05-01/2022-05-03?sensors=power&width=4&height=3&dpi=50")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/png"
+        assert response.content.startswith(b"\x89PNG")
+        assert sorted(offline.fetched) == ["2022-05-01", "2022-05-02", "2022-05-03"]
+
+        # Past ranges are served from the plot cache
+        cached_response = client.get("/plot/range/2022-05-01/2022-05-03?sensors=power&width=4&height=3&dpi=50")
+        assert cached_response.content == response.content
+        assert len(offline.fetched) == 3
+
+    def test_plot_during_update(self, fleet, monkeypatch):
+        from CleanEmonCore.models import EnergyData
+        from CleanEmonBackend.lib import DBConnector
+
+        url = "/plot/date/2022-05-01?sensors=power&width=4&height=3&dpi=50"
+        before = client.get(url).content
+        update = DBConnector.adapter.update_energy_data_by_date
+
+        def update_energy_data_by_date(date_id, data):
+            # The plot is requested after the caches were dropped, but before the new data were written
+            assert client.get(url).content == before
+            return update(date_id, data)
+
+        monkeypatch.setattr(DBConnector.adapter, "update_energy_data_by_date", update_energy_data_by_date)
+        records = DBConnector.fetch_data("2022-05-01").energy_data
+        for record in records:
+            record["power"] = 2 * (record.get("power") or 0) + 1
+        DBConnector.send_data("2022-05-01", EnergyData("2022-05-01", records))
+
+        assert client.get(url).content != before
+
+    def test_bad_plot_size(self, offline):
+        assert client.get("/plot/range/2022-05-01/2022-05-03?dpi=0").status_code == 400
+        assert client.get("/plot/date/2022-05-01?width=1000").status_code == 400
+        assert client.get("/plot/range/2022-05-03/2022-05-01").status_code == 400
+        assert not offline.fetched
+
+
+class TestRangeConsumption:
+
+    def test_percentiles(self, offline):
+        response = client.get("/json/range/2022-05-01/2022-05-02/consumption?sensors=power&percentiles=10,90")
+
+        assert response.status_code == 200
+        assert set(response.json()["statistics"]["power"]["percentiles"]) == {"10", "90"}
+
+    def test_bad_percentiles(self, offline):
+        for percentiles in ["ten", "50,101", "-1"]:
+            response = client.get(f"/json/range/2022-05-01/2022-05-02/consumption?percentiles={percentiles}")
+
+            assert response.status_code == 400
+            assert percentiles in response.json()["message"]
+        assert not offline.fetched
+
+
+@pytest.fixture
+def fleet(monkeypatch, tmp_path):
+    """Serves three in-memory houses: `main` (the default one), `house-b` and `house-c`, which has no size"""
+
+    from CleanEmonBackend.lib import DBConnector
+    from CleanEmonBackend.lib.fake_adapter import InMemoryAdapter
+
+    monkeypatch.setattr(DBConnector, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(DBConnector.plot_cache, "directory", str(tmp_path / "plots"))
+    monkeypatch.setattr(DBConnector, "houses", ["main", "house-b", "house-c"])
+    monkeypatch.setattr(DBConnector.adapter_pool, "factory",
+                        lambda house: InMemoryAdapter(house, meta={} if house == "house-c" else None))
+
+    previous = DBConnector.use_adapter(InMemoryAdapter("main"))
+    yield
+    DBConnector.use_adapter(previous)
+
+
+class TestHouses:
+
+    def test_houses(self, fleet):
+        assert client.get("/houses").json() == ["main", "house-b", "house-c"]
+
+    def test_house_data(self, fleet):
+        main = client.get("/json/date/2022-05-01").json()
+        other = client.get("/json/date/2022-05-01?house=house-b").json()
+
+        assert main["energy_data"] != other["energy_data"]
+        assert client.get("/json/date/2022-05-01?house=main").json() == main
+        assert client.get("/json/date/2022-05-01?house=house-b").json() == other
+
+        etag = client.get("/json/date/2022-05-01").headers["etag"]
+        assert client.get("/json/date/2022-05-01?house=house-b").headers["etag"] != etag
+
+    def test_unknown_house(self, fleet):
+        response = client.get("/json/date/2022-05-01?house=house-z")
+
+        assert response.status_code == 404
+        assert "house-z" in response.json()["message"]
+
+    def test_fleet_mean_consumption(self, fleet):
+        response = client.get("/fleet/date/2022-05-01/mean-consumption")
+        data = response.json()
+
+        assert response.status_code == 200
+        assert data["date"] == "2022-05-01"
+        assert set(data["houses"]) == {"main", "house-b", "house-c"}
+        assert data["houses"]["main"] == client.get("/json/date/2022-05-01/mean-consumption").json()
+        assert data["houses"]["house-c"] == -1
+        assert data["mean"] == pytest.approx((data["houses"]["main"] + data["houses"]["house-b"]) / 2)
+
+    def test_fleet_mean_consumption_errors(self, fleet, monkeypatch):
+        import requests
+        from CleanEmonBackend.API import API
+        from CleanEmonBackend.lib.DBConnector import current_house
+
+        mean_consumption = API.get_mean_consumption
+
+        def get_mean_consumption(date, from_cache):
+            if current_house.get() == "house-b":
+                raise failure
+            return mean_consumption(date, from_cache)
+
+        monkeypatch.setattr(API, "get_mean_consumption", get_mean_consumption)
+
+        # Houses whose database is unavailable are left out
+        failure = requests.ConnectionError("unreachable")
+        data = API.get_fleet_mean_consumption("2022-05-01", False)
+        assert data["houses"]["house-b"] is None
+        assert data["mean"] == data["houses"]["main"]
+
+        # ... but bugs are not hidden
+        failure = KeyError("size")
+        with pytest.raises(KeyError):
+            API.get_fleet_mean_consumption("2022-05-01", False)
+
+
+def test_lazy_imports():
+    """The API and the CLI scripts must not load the plotting and disaggregation stacks until they are needed"""
+
+    import subprocess
+    import sys
+
+    probe = ("import sys, CleanEmonBackend.API, CleanEmonBackend.scripts.disaggregate; "
+             "print('loaded:', *(m for m in ('pandas', 'matplotlib') if m in sys.modules))")
+    completed = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+
+    assert completed.stdout.strip().splitlines()[-1] == "loaded:"
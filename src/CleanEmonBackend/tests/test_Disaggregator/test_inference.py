@@ -1,6 +1,88 @@
+import os
+import sys
+import textwrap
+
 import pytest
 
+from CleanEmonBackend.Disaggregator import inference
 from CleanEmonBackend.Disaggregator.inference import disaggregate
+from CleanEmonBackend.lib.black_sorcery import nilm_path_fix
+
+ENUMERATES = """
+from enum import Enum
+
+
+class ElectricalAppliances(Enum):
+    FRIDGE = "fridge"
+    WASHING_MACHINE = "washing machine"
+"""
+
+TRAINER = """
+import pandas as pd
+
+
+def nilm_inference(devices, sample_period, inference_cpu):
+    data = pd.read_csv("input/data/data.csv")
+    # Models usually skip the first few samples
+    files = []
+    for device in devices:
+        file = f"{device}.csv"
+        pd.DataFrame({"preds": data["mains"].values[10:] / 2}).to_csv(file, index=False)
+        files.append((device, file))
+    return files
+"""
+
+
+def _install_fake_nilm(path, monkeypatch):
+    for package, module, source in [("lab", "nilm_trainer", TRAINER), ("constants", "enumerates", ENUMERATES)]:
+        os.makedirs(path / package)
+        (path / package / "__init__.py").write_text("")
+        (path / package / f"{module}.py").write_text(textwrap.dedent(source))
+
+    monkeypatch.setattr(inference, "nilm_path_fix", lambda: nilm_path_fix(str(path)))
+    monkeypatch.setattr(inference, "NILM_INPUT_FILE_PATH", str(path / "input" / "data" / "data.csv"))
+    monkeypatch.setattr(inference, "_loaded_nilm_stack", None)
+
+
+@pytest.fixture
+def clean_modules():
+    yield
+    for module in ["lab", "lab.nilm_trainer", "constants", "constants.enumerates"]:
+        sys.modules.pop(module, None)
+
+
+def test_disaggregate_fake_nilm(dataframe, tmp_path, monkeypatch, clean_modules):
+    _install_fake_nilm(tmp_path, monkeypatch)
+
+    df = disaggregate(dataframe)
+
+    assert df.shape[0] == 17280
+    for col in ["pred_fridge", "pred_washing_machine"]:
+        assert col in df
+        assert (df[col].iloc[:10].dropna() == 0).all()
+
+    valid = df["power"].notna()
+    assert (df.loc[valid, "pred_fridge"].iloc[10:] == df.loc[valid, "power"].iloc[10:] / 2).all()
+    assert df.loc[~valid, "pred_fridge"].isna().all()
+
+
+def test_nilm_stack_loaded_once(dataframe, tmp_path, monkeypatch, clean_modules):
+    _install_fake_nilm(tmp_path, monkeypatch)
+    cwd = os.getcwd()
+
+    loads = []
+    load_nilm_stack = inference._load_nilm_stack
+    monkeypatch.setattr(inference, "_load_nilm_stack", lambda: loads.append(1) or load_nilm_stack())
+
+    first = disaggregate(dataframe)
+    second = disaggregate(dataframe)
+
+    assert len(loads) == 1
+    assert first.equals(second)
+
+    # The calling process is left as it was
+    assert os.getcwd() == cwd
+    assert str(tmp_path) not in sys.path
 
 
 @pytest.mark.slow
@@ -1,4 +1,9 @@
+import numpy as np
+import pandas as pd
+
 from CleanEmonBackend.Disaggregator.preparation import energy_data_to_dataframe
+from CleanEmonBackend.Disaggregator.preparation import quantize_by_time
+from CleanEmonBackend.lib.columnar import ColumnarEnergyData
 
 
 def test_energy_data_to_dataframe(energy_data):
@@ -8,3 +13,31 @@ def test_energy_data_to_dataframe(energy_data):
     assert len(df.columns) == len(old_cols) + 1
     assert df.shape[0] == 17280
     assert any([("original" in col) for col in df.columns])
+
+
+def test_quantize_by_time():
+    index = pd.to_datetime([0, 3, 7, 8, 21], unit="s")
+    df = pd.DataFrame({"power": [1, 2, 3, 4, 5]}, index=index)
+
+    quantized = quantize_by_time(df, periods=6)
+
+    assert list(quantized.index) == list(pd.to_datetime([0, 5, 10, 15, 20, 25], unit="s"))
+    # 3 and 7 both round to 5, so only the first of them is kept. 21 rounds to 20.
+    assert np.array_equal(quantized["power"].values, [1, 2, 4, np.nan, 5, np.nan], equal_nan=True)
+
+
+def test_quantize_by_time_multi_day():
+    index = pd.to_datetime([0, 86400 + 2.4], unit="s")
+    df = pd.DataFrame({"power": [1, 2]}, index=index)
+
+    assert quantize_by_time(df).shape[0] == 17280
+    quantized = quantize_by_time(df, interval=60, periods=2 * 1440)
+    assert quantized.shape[0] == 2 * 1440
+    assert quantized["power"].iloc[1440] == 2
+
+
+def test_energy_data_to_dataframe_columnar(energy_data):
+    expected = energy_data_to_dataframe(energy_data)
+    df = energy_data_to_dataframe(ColumnarEnergyData.from_energy_data(energy_data))
+
+    pd.testing.assert_frame_equal(df, expected)
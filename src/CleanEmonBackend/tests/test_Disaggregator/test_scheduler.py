@@ -0,0 +1,69 @@
+from datetime import date
+from datetime import datetime
+
+from CleanEmonBackend.Disaggregator.scheduler import CatchUpScheduler
+from CleanEmonBackend.Disaggregator.scheduler import missing_dates
+from CleanEmonBackend.Disaggregator.scheduler import read_watermark
+from CleanEmonBackend.Disaggregator.scheduler import seconds_until_next_day
+from CleanEmonBackend.Disaggregator.scheduler import write_watermark
+
+
+def test_missing_dates():
+    today = date(2022, 5, 16)
+
+    assert missing_dates(None, today) == ["2022-05-15"]
+    assert missing_dates("2022-05-12", today) == ["2022-05-13", "2022-05-14", "2022-05-15"]
+    assert missing_dates("2022-05-15", today) == []
+
+
+def test_seconds_until_next_day():
+    assert seconds_until_next_day(datetime(2022, 5, 16, 23, 59, 0), delay=0) == 60
+    assert seconds_until_next_day(datetime(2022, 5, 16, 0, 0, 0), delay=10) == 24 * 60 * 60 + 10
+
+
+def test_catch_up(tmp_path):
+    watermark_file = str(tmp_path / "watermark")
+    write_watermark("2022-05-12", watermark_file)
+
+    attempts = {}
+    sleeps = []
+
+    def update(date_id):
+        attempts[date_id] = attempts.get(date_id, 0) + 1
+        if date_id == "2022-05-14" or (date_id == "2022-05-13" and attempts[date_id] == 1):
+            raise RuntimeError("Unavailable")
+
+    scheduler = CatchUpScheduler(update, watermark_file=watermark_file, parallelism=2, max_attempts=3, backoff=1,
+                                 now=lambda: datetime(2022, 5, 16, 0, 1), sleep=sleeps.append)
+    failures = scheduler.run_once()
+
+    # 2022-05-13 succeeded on retry, 2022-05-14 failed for good, so the watermark must not move past it
+    assert list(failures) == ["2022-05-14"]
+    assert attempts == {"2022-05-13": 2, "2022-05-14": 3, "2022-05-15": 1}
+    assert sorted(sleeps) == [1, 1, 2]
+    assert read_watermark(watermark_file) == "2022-05-13"
+
+    # Once everything succeeds, the watermark catches up with yesterday
+    scheduler.update = lambda date_id: None
+    assert scheduler.run_once() == {}
+    assert read_watermark(watermark_file) == "2022-05-15"
+
+
+def test_first_run_failure(tmp_path):
+    watermark_file = str(tmp_path / "watermark")
+    updated = []
+
+    def update(date_id):
+        raise RuntimeError("Unavailable")
+
+    scheduler = CatchUpScheduler(update, watermark_file=watermark_file, max_attempts=1,
+                                 now=lambda: datetime(2022, 5, 16, 0, 1), sleep=lambda seconds: None)
+    assert list(scheduler.run_once()) == ["2022-05-15"]
+    assert read_watermark(watermark_file) == "2022-05-14"
+
+    # The next day, the date that failed on the first run is retried along with the new one
+    scheduler.update = updated.append
+    scheduler.now = lambda: datetime(2022, 5, 17, 0, 1)
+    assert scheduler.run_once() == {}
+    assert sorted(updated) == ["2022-05-15", "2022-05-16"]
+    assert read_watermark(watermark_file) == "2022-05-16"
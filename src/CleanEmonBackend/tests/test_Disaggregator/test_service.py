@@ -1,8 +1,54 @@
 import pytest
 
+from CleanEmonCore.models import EnergyData
+from CleanEmonBackend import Disaggregator
+from CleanEmonBackend.Disaggregator import service
 from CleanEmonBackend.Disaggregator.service import update
+from CleanEmonBackend.lib import DBConnector
 
 
 @pytest.mark.skip
 def test_update():
     update("2022-05-14")
+
+
+def test_update_keeps_records(monkeypatch):
+    # Fields of any type and records that lack some fields reach the disaggregation untouched
+    records = [
+        {"timestamp": 0, "power": 1, "status": "ok", "online": True},
+        {"timestamp": 5, "power": "2.5", "status": "late"},
+        {"timestamp": 10, "power": 3, "temp": 20.5},
+    ]
+    monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_by_date",
+                        lambda date_id, sensors=None: EnergyData(date_id, [dict(record) for record in records]))
+
+    seen = []
+    sent = []
+    monkeypatch.setattr(Disaggregator, "disaggregate", lambda df: seen.append(df) or df, raising=False)
+    monkeypatch.setattr(service, "send_data", lambda date_id, data: sent.append((date_id, data)))
+
+    update("1970-01-01")
+
+    df = seen[0]
+    assert list(df["status"].iloc[:2]) == ["ok", "late"]
+    assert df["online"].iloc[0] is True
+    assert df["power"].iloc[1] == "2.5"
+    assert df["temp"].iloc[2] == 20.5
+
+    date_id, data = sent[0]
+    assert date_id == "1970-01-01"
+    assert data.energy_data[0]["status"] == "ok"
+    assert data.energy_data[1]["power"] == "2.5"
+
+
+def test_snapshot_errors_do_not_fail_the_job(monkeypatch):
+    updated = []
+    monkeypatch.setattr(service, "update", updated.append)
+
+    def save_snapshot(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(service, "save_snapshot", save_snapshot)
+
+    service._update_and_save_metrics("2022-05-01")
+    assert updated == ["2022-05-01"]
@@ -1,9 +1,16 @@
+import time
+import random
+
 import pytest
 
 from CleanEmonCore.models import EnergyData
 from CleanEmonBackend.lib.DBConnector import fetch_data
+from CleanEmonBackend.lib.DBConnector import fetch_day
+from CleanEmonBackend.lib.DBConnector import fetch_many
+from CleanEmonBackend.lib.DBConnector import fetch_records
 from CleanEmonBackend.lib.DBConnector import send_data
 from CleanEmonBackend.lib.DBConnector import adapter
+from CleanEmonBackend.lib import DBConnector
 
 DUMMY_DATE = "2000-01-01"
 
@@ -17,6 +24,213 @@ def energy_data():
     ])
 
 
+@pytest.fixture
+def revisions():
+    """The revisions of the data served by `offline_adapter` (date -> revision). They can be changed."""
+
+    return {}
+
+
+@pytest.fixture
+def offline_adapter(monkeypatch, tmp_path, energy_data, revisions):
+    """Serves `energy_data` instead of the central database and caches into a temporary directory.
+    Returns the list of (date, sensors) that were requested from the "database".
+    """
+
+    calls = []
+
+    def fetch_energy_data_by_date(date_id, sensors=None):
+        calls.append((date_id, sensors))
+        if sensors is None:
+            return energy_data
+        return EnergyData(energy_data.date, [{sensor: record[sensor] for sensor in sensors if sensor in record}
+                                             for record in energy_data.energy_data])
+
+    def fetch_revision_by_date(date_id):
+        return revisions.get(date_id, "1-a")
+
+    def fetch_energy_data_with_revision(date_id, sensors=None):
+        return fetch_energy_data_by_date(date_id, sensors), fetch_revision_by_date(date_id)
+
+    monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_by_date", fetch_energy_data_by_date)
+    monkeypatch.setattr(DBConnector.adapter, "fetch_revision_by_date", fetch_revision_by_date)
+    monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_with_revision", fetch_energy_data_with_revision)
+    monkeypatch.setattr(DBConnector, "CACHE_DIR", str(tmp_path))
+    DBConnector.memory_cache.clear()
+    DBConnector.summary_index.clear()
+    yield calls
+    DBConnector.memory_cache.clear()
+    DBConnector.summary_index.clear()
+
+
+def test_fetch_data_from_memory(offline_adapter, revisions):
+    calls = offline_adapter
+
+    full = fetch_day(DUMMY_DATE, from_cache=True)
+    projected = fetch_day(DUMMY_DATE, from_cache=True, sensors=["power"])
+    assert projected.to_energy_data().energy_data[0] == {"timestamp": 1, "power": 1}
+
+    # Served from memory
+    assert fetch_day(DUMMY_DATE, from_cache=True) is full
+    assert fetch_day(DUMMY_DATE, from_cache=True, sensors=["timestamp", "power"]) is projected
+    assert fetch_data(DUMMY_DATE, from_cache=True) == full.to_energy_data()
+    assert len(calls) == 1  # The projected data were read from disk
+
+    # Past dates are served from memory even if fresh data are requested, as long as their revision holds
+    assert fetch_day(DUMMY_DATE) is full
+    assert len(calls) == 1
+
+    revisions[DUMMY_DATE] = "2-b"
+    assert fetch_day(DUMMY_DATE, from_cache=True) is full  # Not revalidated
+    assert fetch_day(DUMMY_DATE) is not full
+    assert len(calls) == 2
+    assert fetch_day(DUMMY_DATE) is fetch_day(DUMMY_DATE, revision="2-b")
+    assert len(calls) == 2
+
+    DBConnector.invalidate_data(DUMMY_DATE)
+    assert len(DBConnector.memory_cache) == 0
+
+
+def test_fetch_data_from_disk(offline_adapter, energy_data):
+    calls = offline_adapter
+
+    fetch_data(DUMMY_DATE)
+    DBConnector.memory_cache.clear()
+
+    assert fetch_data(DUMMY_DATE, from_cache=True) == energy_data
+    assert fetch_data(DUMMY_DATE, from_cache=True, sensors=["temp"]).energy_data[-1] == {"timestamp": 3, "temp": 3}
+    assert len(calls) == 1
+
+
+def test_projection_pushdown(offline_adapter, energy_data):
+    calls = offline_adapter
+
+    assert fetch_data(DUMMY_DATE, sensors=["power"]).energy_data[0] == {"timestamp": 1, "power": 1}
+    assert calls == [(DUMMY_DATE, ("power", "timestamp"))]
+    DBConnector.memory_cache.clear()
+
+    # The other sensors were never fetched, so they are not served from the partially cached day
+    assert fetch_data(DUMMY_DATE, from_cache=True, sensors=["power"]).energy_data[-1] == {"timestamp": 3, "power": 3}
+    assert fetch_data(DUMMY_DATE, from_cache=True, sensors=["temp"]).energy_data[-1] == {"timestamp": 3, "temp": 3}
+    assert calls[1:] == [(DUMMY_DATE, ("temp", "timestamp"))]
+
+    # ... but merged into it
+    DBConnector.memory_cache.clear()
+    assert fetch_data(DUMMY_DATE, from_cache=True, sensors=["power", "temp"]) == energy_data
+    assert fetch_data(DUMMY_DATE, from_cache=True) == energy_data
+    assert calls[2:] == [(DUMMY_DATE, None)]
+
+
+def test_fetch_today(offline_adapter, monkeypatch):
+    calls = offline_adapter
+    monkeypatch.setattr(DBConnector, "is_past", lambda date_id: False)
+
+    today = fetch_day(DUMMY_DATE)
+    assert fetch_day(DUMMY_DATE, from_cache=True) is today
+    assert len(calls) == 1
+
+    # Today's data keep growing, so they are fetched again unless cached data are explicitly accepted
+    assert fetch_day(DUMMY_DATE) is not today
+    assert len(calls) == 2
+
+
+def test_fetch_data_from_disk_revision(offline_adapter, revisions):
+    calls = offline_adapter
+
+    fetch_day(DUMMY_DATE)
+    DBConnector.memory_cache.clear()
+    fetch_day(DUMMY_DATE)
+    assert len(calls) == 1  # Read from disk, as it is still at the same revision
+
+    DBConnector.memory_cache.clear()
+    revisions[DUMMY_DATE] = "2-b"
+    fetch_day(DUMMY_DATE)
+    assert len(calls) == 2
+
+
+def test_fetch_records(offline_adapter, energy_data):
+    calls = offline_adapter
+    energy_data.energy_data[0]["status"] = "ok"
+    del energy_data.energy_data[1]["temp"]
+
+    fetch_day(DUMMY_DATE, from_cache=True)
+    assert fetch_records(DUMMY_DATE) == energy_data
+    assert fetch_records(DUMMY_DATE, sensors=["power"]).energy_data[0] == {"timestamp": 1, "power": 1}
+
+    # Always read from the central database, as they are
+    assert calls == [(DUMMY_DATE, None), (DUMMY_DATE, None), (DUMMY_DATE, ("power", "timestamp"))]
+
+
+def test_fetch_summary(offline_adapter, energy_data):
+    calls = offline_adapter
+    energy_data.energy_data[0]["kwh"] = 1
+    energy_data.energy_data[2]["kwh"] = 3
+
+    assert DBConnector.fetch_summary(DUMMY_DATE).consumption == 2
+    DBConnector.memory_cache.clear()
+    DBConnector.summary_index.clear()
+
+    # Answered from the persistent index, even though no cache was requested
+    assert DBConnector.fetch_summary(DUMMY_DATE).consumption == 2
+    assert len(calls) == 1
+
+    DBConnector.invalidate_data(DUMMY_DATE)
+    assert DBConnector.fetch_summary(DUMMY_DATE).consumption == 2
+    assert len(calls) == 2
+
+
+def test_fetch_summary_during_update(offline_adapter, energy_data, revisions, monkeypatch):
+    for i, record in enumerate(energy_data.energy_data):
+        record["kwh"] = i + 1
+
+    def update_energy_data_by_date(date_id, data):
+        # A summary requested after the caches were dropped, but before the new data were written
+        records = energy_data.energy_data
+        assert DBConnector.fetch_summary(date_id).consumption == records[-1]["kwh"] - records[0]["kwh"]
+        energy_data.energy_data = data.energy_data
+        revisions[date_id] = f"{len(revisions) + 2}-b"
+        return True
+
+    def disaggregate():
+        records = [dict(record, kwh=2 * record["kwh"]) for record in energy_data.energy_data]
+        send_data(DUMMY_DATE, EnergyData(DUMMY_DATE, records))
+
+    monkeypatch.setattr(DBConnector.adapter, "update_energy_data_by_date", update_energy_data_by_date)
+    disaggregate()
+    assert DBConnector.fetch_summary(DUMMY_DATE).consumption == 4
+
+    # A summary whose data were read just before they got written
+    DBConnector.invalidate_data(DUMMY_DATE)
+    fetch = DBConnector.adapter.fetch_energy_data_with_revision
+
+    def fetch_before_update(date_id, sensors=None):
+        fetched = fetch(date_id, sensors)
+        monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_with_revision", fetch)
+        disaggregate()
+        return fetched
+
+    monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_with_revision", fetch_before_update)
+    assert DBConnector.fetch_summary(DUMMY_DATE).consumption == 4
+    assert DBConnector.fetch_summary(DUMMY_DATE).consumption == 8
+
+
+def test_fetch_many(monkeypatch, tmp_path):
+    def fetch_energy_data_by_date(date_id, sensors=None):
+        time.sleep(random.random() / 100)
+        return EnergyData(date_id, [{"timestamp": 1, "power": 1}])
+
+    monkeypatch.setattr(DBConnector.adapter, "fetch_energy_data_with_revision",
+                        lambda date_id, sensors=None: (fetch_energy_data_by_date(date_id, sensors), "1-a"))
+    monkeypatch.setattr(DBConnector, "CACHE_DIR", str(tmp_path))
+
+    dates = [f"2000-01-{day:02}" for day in range(1, 31)]
+    fetched = [energy_data.date for energy_data in fetch_many(dates, concurrency=4)]
+
+    assert fetched == dates
+    DBConnector.memory_cache.clear()
+    DBConnector.summary_index.clear()
+
+
 @pytest.mark.projectwise
 def test_fetch_data():
     data = fetch_data("2022-05-01")
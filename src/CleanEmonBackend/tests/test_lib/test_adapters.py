@@ -0,0 +1,145 @@
+import json
+
+from CleanEmonCore import CONFIG_FILE
+from CleanEmonBackend.lib.adapters import PooledCouchDBAdapter
+from CleanEmonBackend.lib.adapters import PROJECTION_DESIGN_DOC
+
+DOCUMENT = {
+    "_id": "doc",
+    "_rev": "1-a",
+    "date": "2022-05-01",
+    "energy_data": [{"timestamp": t, "power": 10 * t, "temp": 20 + t, "kwh": t / 1000} for t in range(100)],
+    "other": "not needed",
+}
+DOCUMENT["energy_data"][1].pop("temp")
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._data = data
+        self.content = json.dumps(data).encode()
+
+    def json(self):
+        return self._data
+
+
+def _projection_rows(keys):
+    """What the projection view holds for DOCUMENT"""
+
+    records = DOCUMENT["energy_data"]
+    rows = []
+    for date, sensor in keys:
+        indices = [i for i, record in enumerate(records) if sensor in record]
+        if date != DOCUMENT["date"] or not indices:
+            continue
+        rows.append({"id": DOCUMENT["_id"], "key": [date, sensor], "value": {
+            "rev": DOCUMENT["_rev"],
+            "length": len(records),
+            "indices": None if len(indices) == len(records) else indices,
+            "values": [records[i][sensor] for i in indices],
+        }})
+    return rows
+
+
+class FakeSession:
+    def __init__(self, has_projection=True, can_install=True):
+        self.has_projection = has_projection
+        self.can_install = can_install
+        self.urls = []
+        self.received = {}  # url -> bytes of the last response
+
+    def _respond(self, url, response):
+        self.received[url] = len(response.content)
+        return response
+
+    def get(self, url, params=None):
+        self.urls.append(url)
+        if "_view/get_dates" in url:
+            return FakeResponse(200, {"rows": [{"key": "2022-05-01", "value": "doc"}]})
+        if url.endswith(PROJECTION_DESIGN_DOC):
+            return FakeResponse(404, {"error": "not_found"})
+        return FakeResponse(200, DOCUMENT)
+
+    def post(self, url, data=None, headers=None):
+        self.urls.append(url)
+        query = json.loads(data)
+        if PROJECTION_DESIGN_DOC in url:
+            if not self.has_projection:
+                return FakeResponse(404, {"error": "not_found"})
+            return self._respond(url, FakeResponse(200, {"rows": _projection_rows(query["keys"])}))
+        if url.endswith("/_find") and query["selector"] == {"_id": DOCUMENT["_id"]}:
+            return self._respond(url, FakeResponse(200, {"docs": [{field: DOCUMENT[field]
+                                                                   for field in query["fields"]}]}))
+        return FakeResponse(200, {"docs": []})
+
+    def put(self, url, data=None, headers=None):
+        self.urls.append(url)
+        if not self.can_install:
+            return FakeResponse(401, {"error": "unauthorized"})
+        self.has_projection = True
+        return FakeResponse(201, {"ok": True})
+
+
+def _project(sensors):
+    return [{sensor: record[sensor] for sensor in sensors if sensor in record} for record in DOCUMENT["energy_data"]]
+
+
+def test_projected_fetch():
+    adapter = PooledCouchDBAdapter(CONFIG_FILE)
+    adapter.session = FakeSession()
+
+    energy_data, revision = adapter.fetch_energy_data_with_revision("2022-05-01", sensors=("power", "temp"))
+    assert energy_data.date == "2022-05-01"
+    assert energy_data.energy_data == _project(["power", "temp"])
+    assert energy_data.energy_data[1] == {"power": 10}
+    assert revision == "1-a"
+    assert not [url for url in adapter.session.urls if "_find" in url]  # The whole day was never fetched
+
+
+def test_projected_fetch_transfers_less():
+    adapter = PooledCouchDBAdapter(CONFIG_FILE)
+    adapter.session = FakeSession()
+
+    received = []
+    for sensors in [("timestamp",), ("timestamp", "power"), ("timestamp", "power", "temp"), None]:
+        adapter.session.received.clear()
+        adapter.fetch_energy_data_with_revision("2022-05-01", sensors=sensors)
+        received.append(sum(adapter.session.received.values()))
+
+    # The bytes read from the database grow with the number of requested sensors
+    assert received == sorted(received)
+    assert len(set(received)) == len(received)
+
+
+def test_projection_installation():
+    adapter = PooledCouchDBAdapter(CONFIG_FILE)
+    adapter.session = FakeSession(has_projection=False)
+
+    assert adapter.fetch_energy_data_by_date("2022-05-01", sensors=("kwh",)).energy_data == _project(["kwh"])
+    assert f"{adapter.base_url}/{adapter.db}/{PROJECTION_DESIGN_DOC}" in adapter.session.urls
+    assert adapter.supports_projection
+
+
+def test_projection_fallback():
+    adapter = PooledCouchDBAdapter(CONFIG_FILE)
+    adapter.session = FakeSession(has_projection=False, can_install=False)
+
+    for _ in range(2):
+        energy_data = adapter.fetch_energy_data_by_date("2022-05-01", sensors=("power", "timestamp"))
+        assert energy_data.energy_data == _project(["power", "timestamp"])
+
+    # The view was only tried once
+    assert not adapter.supports_projection
+    assert len([url for url in adapter.session.urls if PROJECTION_DESIGN_DOC in url and "_view" in url]) == 1
+
+
+def test_fetch():
+    adapter = PooledCouchDBAdapter(CONFIG_FILE)
+    adapter.session = FakeSession()
+
+    energy_data, revision = adapter.fetch_energy_data_with_revision("2022-05-01")
+    assert energy_data.date == "2022-05-01"
+    assert energy_data.energy_data == DOCUMENT["energy_data"]
+    assert revision == "1-a"
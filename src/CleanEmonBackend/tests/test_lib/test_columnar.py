@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from CleanEmonCore.models import EnergyData
+from CleanEmonBackend.lib.columnar import ColumnarEnergyData
+
+DUMMY_DATE = "2000-01-01"
+
+
+@pytest.fixture
+def energy_data():
+    return EnergyData(DUMMY_DATE, [
+        {"timestamp": 1, "power": 1.5, "temp": 20},
+        {"timestamp": 6, "power": None, "temp": 21},
+        {"timestamp": 11, "power": 3.5, "temp": None}
+    ])
+
+
+def test_energy_data_round_trip(energy_data):
+    day = ColumnarEnergyData.from_energy_data(energy_data)
+
+    assert len(day) == 3
+    assert day.sensors == ("power", "temp")
+    assert day.timestamps.dtype == np.float64
+    assert day.to_energy_data() == energy_data
+
+
+def test_dataframe_round_trip(energy_data):
+    day = ColumnarEnergyData.from_energy_data(energy_data)
+    df = day.to_dataframe()
+
+    pd.testing.assert_frame_equal(df, pd.DataFrame(energy_data.energy_data))
+    assert ColumnarEnergyData.from_dataframe(DUMMY_DATE, df).to_energy_data() == energy_data
+
+
+def test_select_take(energy_data):
+    day = ColumnarEnergyData.from_energy_data(energy_data)
+
+    assert day.select(None) is day
+    assert day.select(["timestamp", "temp", "other"]).to_energy_data().energy_data[0] == {"timestamp": 1, "temp": 20}
+    assert day.take(np.array([2])).to_energy_data().energy_data == [{"timestamp": 11, "power": 3.5, "temp": None}]
+    assert day.take(slice(0, 2)).to_energy_data().energy_data == energy_data.energy_data[:2]
+
+
+def test_irregular_records(energy_data):
+    # Non-numeric fields, numeric strings, booleans and records that lack some fields cannot be held by columns alone
+    energy_data.energy_data[0]["status"] = "ok"
+    energy_data.energy_data[1]["power"] = "2.5"
+    energy_data.energy_data[2]["online"] = True
+    del energy_data.energy_data[2]["temp"]
+    day = ColumnarEnergyData.from_energy_data(energy_data)
+
+    assert day.records is not None
+    assert day.to_energy_data() == energy_data
+    assert day.select(["timestamp", "status"]).to_energy_data().energy_data[:2] == [
+        {"timestamp": 1, "status": "ok"}, {"timestamp": 6}]
+    assert day.take(np.array([2])).to_energy_data().energy_data == [energy_data.energy_data[2]]
+    assert day.take(slice(0, 2)).to_energy_data().energy_data == energy_data.energy_data[:2]
+    pd.testing.assert_frame_equal(day.to_dataframe(), pd.DataFrame(energy_data.energy_data))
+
+    # Regular records are given back from the columns
+    assert ColumnarEnergyData.from_energy_data(EnergyData(DUMMY_DATE, [{"timestamp": 1, "power": 1.5}])).records is None
+
+
+def test_empty():
+    day = ColumnarEnergyData.from_energy_data(EnergyData(DUMMY_DATE))
+
+    assert len(day) == 0
+    assert day.timestamps is None
+    assert day.to_energy_data() == EnergyData(DUMMY_DATE)
@@ -0,0 +1,120 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from CleanEmonCore.models import EnergyData
+from CleanEmonBackend.lib.columnar_cache import load_columns
+from CleanEmonBackend.lib.columnar_cache import load_day
+from CleanEmonBackend.lib.columnar_cache import store_day
+from CleanEmonBackend.lib.columnar_cache import drop_day
+from CleanEmonBackend.lib.columnar_cache import migrate_cache_dir
+
+DUMMY_DATE = "2000-01-01"
+
+
+@pytest.fixture
+def energy_data():
+    return EnergyData(DUMMY_DATE, [
+        {"timestamp": 1.5, "power": 1, "kwh": 0.1},
+        {"timestamp": 6.5, "power": None, "kwh": 0.2},
+        {"timestamp": 11.5, "power": 3, "kwh": None}
+    ])
+
+
+def test_round_trip(tmp_path, energy_data):
+    store_day(str(tmp_path), DUMMY_DATE, energy_data)
+
+    assert load_day(str(tmp_path), DUMMY_DATE) == energy_data
+    assert load_day(str(tmp_path), "2000-01-02") is None
+
+
+def test_projection(tmp_path, energy_data):
+    store_day(str(tmp_path), DUMMY_DATE, energy_data)
+
+    meta, columns = load_columns(str(tmp_path), DUMMY_DATE, ["timestamp", "kwh"])
+
+    assert list(columns) == ["timestamp", "kwh"]
+    assert isinstance(columns["kwh"], np.memmap)
+    assert columns["kwh"].dtype == np.float64
+    assert np.isnan(columns["kwh"][2])
+    assert meta["length"] == 3
+
+
+def _project(energy_data, sensors):
+    return EnergyData(energy_data.date, [{sensor: record[sensor] for sensor in sensors}
+                                         for record in energy_data.energy_data])
+
+
+def test_partial_day(tmp_path, energy_data):
+    cache_dir = str(tmp_path)
+    store_day(cache_dir, DUMMY_DATE, _project(energy_data, ["timestamp", "power"]), projection=["timestamp", "power"],
+              revision="1-a")
+
+    assert load_day(cache_dir, DUMMY_DATE, ["power"]).energy_data[0] == {"power": 1}
+    assert load_day(cache_dir, DUMMY_DATE, ["timestamp", "kwh"]) is None
+    assert load_day(cache_dir, DUMMY_DATE) is None
+
+    # Merged into the cached records
+    store_day(cache_dir, DUMMY_DATE, _project(energy_data, ["timestamp", "kwh"]), projection=["timestamp", "kwh"],
+              revision="1-a")
+    assert load_day(cache_dir, DUMMY_DATE, ["timestamp", "power", "kwh"]) == energy_data
+    assert load_day(cache_dir, DUMMY_DATE, ["timestamp", "kwh", "other"]) is None
+
+    # A complete day serves every projection
+    store_day(cache_dir, DUMMY_DATE, energy_data)
+    assert load_day(cache_dir, DUMMY_DATE, ["kwh", "other"]).energy_data[0] == {"kwh": 0.1}
+
+    drop_day(cache_dir, DUMMY_DATE)
+    assert load_day(cache_dir, DUMMY_DATE, ["kwh"]) is None
+
+
+def test_partial_day_with_new_records(tmp_path, energy_data):
+    cache_dir = str(tmp_path)
+    store_day(cache_dir, DUMMY_DATE, _project(energy_data, ["timestamp", "power"]), projection=["timestamp", "power"],
+              revision="1-a")
+
+    # Records of another revision replace the cached ones, instead of being merged with them, even if they are as many
+    changed = EnergyData(DUMMY_DATE, [dict(record, kwh=1) for record in energy_data.energy_data])
+    store_day(cache_dir, DUMMY_DATE, _project(changed, ["timestamp", "kwh"]), projection=["timestamp", "kwh"],
+              revision="2-b")
+
+    assert load_day(cache_dir, DUMMY_DATE, ["timestamp", "power"]) is None
+    assert load_day(cache_dir, DUMMY_DATE, ["timestamp", "kwh"]) == _project(changed, ["timestamp", "kwh"])
+
+    # ... and so are records without a revision
+    store_day(cache_dir, DUMMY_DATE, _project(changed, ["timestamp", "power"]), projection=["timestamp", "power"])
+    assert load_day(cache_dir, DUMMY_DATE, ["timestamp", "kwh"]) is None
+
+
+def test_irregular_records(tmp_path, energy_data):
+    cache_dir = str(tmp_path)
+    energy_data.energy_data[0]["status"] = "ok"
+    del energy_data.energy_data[1]["kwh"]
+    store_day(cache_dir, DUMMY_DATE, energy_data)
+
+    assert load_day(cache_dir, DUMMY_DATE) == energy_data
+    assert load_day(cache_dir, DUMMY_DATE, ["timestamp", "status"]).energy_data[:2] == [
+        {"timestamp": 1.5, "status": "ok"}, {"timestamp": 6.5}]
+
+    # Regular records replace them
+    store_day(cache_dir, DUMMY_DATE, _project(energy_data, ["timestamp", "power"]))
+    assert not os.path.exists(os.path.join(cache_dir, DUMMY_DATE, "records.json"))
+    assert load_day(cache_dir, DUMMY_DATE) == _project(energy_data, ["timestamp", "power"])
+
+
+def test_empty_day(tmp_path):
+    store_day(str(tmp_path), DUMMY_DATE, EnergyData())
+
+    assert load_day(str(tmp_path), DUMMY_DATE) == EnergyData()
+
+
+def test_legacy_json(tmp_path, energy_data):
+    legacy_path = os.path.join(str(tmp_path), DUMMY_DATE)
+    with open(legacy_path, "w") as f_out:
+        json.dump(energy_data.as_json(string=False), f_out)
+
+    assert migrate_cache_dir(str(tmp_path)) == [DUMMY_DATE]
+    assert os.path.isdir(legacy_path)
+    assert load_day(str(tmp_path), DUMMY_DATE) == energy_data
@@ -0,0 +1,7 @@
+from CleanEmonBackend.lib.dates import date_range
+
+
+def test_date_range():
+    assert date_range("2022-01-01", "2022-01-01") == ["2022-01-01"]
+    assert date_range("2022-02-27", "2022-03-02") == ["2022-02-27", "2022-02-28", "2022-03-01", "2022-03-02"]
+    assert date_range("2022-01-02", "2022-01-01") == []
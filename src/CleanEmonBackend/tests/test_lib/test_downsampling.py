@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from CleanEmonCore.models import EnergyData
+from CleanEmonBackend.lib.columnar import ColumnarEnergyData
+from CleanEmonBackend.lib.downsampling import bucket_aggregate
+from CleanEmonBackend.lib.downsampling import downsample_day
+from CleanEmonBackend.lib.downsampling import downsample_energy_data
+from CleanEmonBackend.lib.downsampling import DownsamplingMethod
+from CleanEmonBackend.lib.downsampling import lttb
+from CleanEmonBackend.lib.downsampling import minmax_envelope
+
+
+@pytest.fixture
+def energy_data():
+    records = [{"timestamp": 5.0 * i, "power": float(i % 100), "kwh": i / 1000} for i in range(17280)]
+    records[10]["power"] = None
+    return EnergyData("2000-01-01", records)
+
+
+def test_bucket_aggregate():
+    values = np.array([1, 2, np.nan, 4, np.nan, np.nan], dtype=float)
+
+    assert np.allclose(bucket_aggregate(values, 3, "mean"), [1.5, 4, np.nan], equal_nan=True)
+    assert np.allclose(bucket_aggregate(values, 3, "min"), [1, 4, np.nan], equal_nan=True)
+    assert np.allclose(bucket_aggregate(values, 3, "max"), [2, 4, np.nan], equal_nan=True)
+    assert np.allclose(bucket_aggregate(values, 3, "first"), [1, np.nan, np.nan], equal_nan=True)
+    assert len(bucket_aggregate(values, 10, "mean")) == len(values)
+
+
+def test_minmax_envelope():
+    lows, highs = minmax_envelope(np.arange(10, dtype=float), 2)
+
+    assert list(lows) == [0, 5]
+    assert list(highs) == [4, 9]
+
+
+def test_lttb():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[500] = 100  # A spike should never be lost
+
+    indices = lttb(x, y, 50)
+
+    assert len(indices) == 50
+    assert indices[0] == 0
+    assert indices[-1] == 999
+    assert 500 in indices
+    assert np.all(np.diff(indices) > 0)
+
+    assert len(lttb(x, y, 2000)) == 1000
+
+
+def test_downsample_lttb(energy_data):
+    downsampled = downsample_energy_data(energy_data, 1000)
+
+    assert 0 < len(downsampled.energy_data) <= 1000
+    # Original samples are kept as-is
+    for record in downsampled.energy_data:
+        assert record is energy_data.energy_data[int(record["timestamp"] // 5)]
+
+
+def test_downsample_buckets(energy_data):
+    downsampled = downsample_energy_data(energy_data, 1000, "max")
+
+    assert len(downsampled.energy_data) == 1000
+    assert downsampled.energy_data[0]["timestamp"] == 0
+    assert downsampled.energy_data[0]["power"] == 16
+
+
+def test_downsample_noop(energy_data):
+    assert downsample_energy_data(energy_data, None) is energy_data
+    assert downsample_energy_data(energy_data, 20000) is energy_data
+
+
+def test_downsample_day(energy_data):
+    day = ColumnarEnergyData.from_energy_data(energy_data)
+
+    for method in DownsamplingMethod:
+        expected = downsample_energy_data(energy_data, 500, method)
+        assert downsample_day(day, 500, method).to_energy_data() == expected
+
+    assert downsample_day(day, None) is day
@@ -0,0 +1,62 @@
+import time
+from datetime import date
+
+from CleanEmonCore.models import EnergyData
+
+from CleanEmonBackend.lib import DBConnector
+from CleanEmonBackend.lib.fake_adapter import InMemoryAdapter
+from CleanEmonBackend.lib.synthetic import SAMPLES_PER_DAY
+
+
+def test_synthetic_days():
+    adapter = InMemoryAdapter("house-1")
+
+    data = adapter.fetch_energy_data_by_date("2022-05-01")
+    assert data.date == "2022-05-01"
+    assert 0.95 * SAMPLES_PER_DAY < len(data.energy_data) < SAMPLES_PER_DAY  # Some samples are lost
+    assert set(data.energy_data[0]) == {"timestamp", "power", "kwh", "vrms", "temp", "external_temp", "humidity"}
+
+    # Days are deterministic per house
+    assert InMemoryAdapter("house-1").fetch_energy_data_by_date("2022-05-01") == data
+    assert InMemoryAdapter("house-2").fetch_energy_data_by_date("2022-05-01") != data
+
+    projected = adapter.fetch_energy_data_by_date("2022-05-01", sensors=["timestamp", "power"])
+    assert set(projected.energy_data[0]) == {"timestamp", "power"}
+
+    assert adapter.fetch_energy_data_by_date("2999-01-01").energy_data == []
+    assert adapter.fetch_revision_by_date("2999-01-01") == ""
+    assert len(adapter.fetch_energy_data_by_date(date.today().isoformat()).energy_data) < SAMPLES_PER_DAY
+
+
+def test_revisions():
+    adapter = InMemoryAdapter()
+
+    revision = adapter.fetch_revision_by_date("2022-05-01")
+    assert revision and adapter.fetch_revision_by_date("2022-05-01") == revision
+
+    assert adapter.update_energy_data_by_date("2022-05-01", EnergyData("2022-05-01", [{"timestamp": 1}]))
+    assert adapter.fetch_revision_by_date("2022-05-01") != revision
+    assert adapter.fetch_energy_data_by_date("2022-05-01").energy_data == [{"timestamp": 1}]
+    assert adapter.fetch_energy_data_with_revision("2022-05-01")[1] == adapter.fetch_revision_by_date("2022-05-01")
+
+
+def test_latency():
+    adapter = InMemoryAdapter(latency=0.05)
+
+    start = time.monotonic()
+    adapter.fetch_meta_with_revision()
+    assert time.monotonic() - start >= 0.05
+    assert adapter.operations == 1
+
+
+def test_use_adapter(monkeypatch, tmp_path):
+    monkeypatch.setattr(DBConnector, "CACHE_DIR", str(tmp_path))
+    adapter = InMemoryAdapter(meta={"size": 100})
+
+    previous = DBConnector.use_adapter(adapter)
+    try:
+        assert DBConnector.fetch_meta() == {"size": 100}
+        assert len(DBConnector.fetch_data("2022-05-01").energy_data) > 0
+        assert DBConnector.fetch_revision("2022-05-01") == adapter.fetch_revision_by_date("2022-05-01")
+    finally:
+        assert DBConnector.use_adapter(previous) is adapter
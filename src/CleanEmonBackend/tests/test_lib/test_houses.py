@@ -0,0 +1,84 @@
+import pytest
+
+from CleanEmonBackend.lib import DBConnector
+from CleanEmonBackend.lib.exceptions import UnknownHouseError
+from CleanEmonBackend.lib.fake_adapter import InMemoryAdapter
+from CleanEmonBackend.lib.houses import AdapterPool
+from CleanEmonBackend.lib.houses import configured_houses
+
+
+def test_configured_houses(tmp_path):
+    config_file = tmp_path / "db.cfg"
+    config_file.write_text("[DB]\ndb_name = main\n\n[Houses]\ndatabases = house_a, house_b\n  main house_c\n")
+
+    assert configured_houses(str(config_file)) == ["main", "house_a", "house_b", "house_c"]
+    assert configured_houses(str(tmp_path / "missing.cfg")) == []
+
+
+def test_adapter_pool():
+    closed = []
+    evicted = []
+
+    class Adapter:
+        def __init__(self, database):
+            self.database = database
+
+        def close(self):
+            closed.append(self.database)
+
+    pool = AdapterPool(Adapter, 2, on_evict=lambda database, _: evicted.append(database))
+
+    a = pool.get("a")
+    assert pool.get("a") is a
+    pool.get("b")
+    pool.get("a")  # "b" is now the least recently used
+    pool.get("c")
+
+    assert pool.databases() == ["a", "c"]
+    assert "b" not in pool and len(pool) == 2
+    assert closed == evicted == ["b"]
+
+    pool.clear()
+    assert len(pool) == 0
+    assert sorted(closed) == ["a", "b", "c"]
+
+
+@pytest.fixture
+def houses(monkeypatch, tmp_path):
+    """Serves three in-memory houses: `main` (the default one), `house-b` and `house-c`"""
+
+    monkeypatch.setattr(DBConnector, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(DBConnector, "houses", ["main", "house-b", "house-c"])
+    monkeypatch.setattr(DBConnector.adapter_pool, "factory", InMemoryAdapter)
+
+    previous = DBConnector.use_adapter(InMemoryAdapter("main"))
+    yield
+    DBConnector.use_adapter(previous)
+
+
+def test_caches_are_partitioned(houses):
+    main = DBConnector.fetch_data("2022-05-01")
+    with DBConnector.using_house("house-b"):
+        other = DBConnector.fetch_data("2022-05-01")
+        assert DBConnector.current_house.get() == "house-b"
+        assert DBConnector.house_cache_dir() != DBConnector.CACHE_DIR
+
+    assert main != other
+    assert DBConnector.current_house.get() is None
+    assert DBConnector.fetch_data("2022-05-01", from_cache=True) == main
+    with DBConnector.using_house("house-b"):
+        assert DBConnector.fetch_data("2022-05-01", from_cache=True) == other
+
+    # Concurrent fetches serve the house of their caller
+    with DBConnector.using_house("house-c"):
+        assert len(list(DBConnector.fetch_many(["2022-05-01", "2022-05-02"]))) == 2
+    assert ("house-c", "2022-05-01", None) in DBConnector.memory_cache
+    assert ("house-c", "2022-05-02", None) in DBConnector.memory_cache
+    assert DBConnector.adapter_pool.databases() == ["house-b", "house-c"]
+
+    with DBConnector.using_house("main"):
+        assert DBConnector.current_house.get() is None
+
+    with pytest.raises(UnknownHouseError):
+        with DBConnector.using_house("house-z"):
+            pass
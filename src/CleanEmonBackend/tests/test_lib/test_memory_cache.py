@@ -0,0 +1,61 @@
+import time
+
+from CleanEmonBackend.lib.memory_cache import MemoryCache
+
+
+def test_get_put():
+    cache = MemoryCache(100, sizeof=lambda value: 10)
+
+    assert cache.get("a") is None
+    assert cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert "a" in cache
+    assert cache.size == 10
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_lru_eviction():
+    cache = MemoryCache(30, sizeof=lambda value: 10)
+
+    for key in "abc":
+        cache.put(key, key)
+
+    cache.get("a")  # "b" is now the least recently used entry
+    cache.put("d", "d")
+
+    assert "b" not in cache
+    for key in "acd":
+        assert key in cache
+    assert cache.size == 30
+
+
+def test_oversized_value():
+    cache = MemoryCache(10, sizeof=len)
+
+    assert not cache.put("big", "x" * 11)
+    assert "big" not in cache
+    assert cache.size == 0
+
+
+def test_ttl():
+    cache = MemoryCache(100, sizeof=lambda value: 1)
+
+    cache.put("short", 1, ttl=0.01)
+    cache.put("long", 2)
+    time.sleep(0.02)
+
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    assert cache.size == 1
+
+
+def test_invalidate():
+    cache = MemoryCache(100, sizeof=lambda value: 1)
+
+    cache.put(("2022-05-01", None), 1)
+    cache.put(("2022-05-01", ("power", "timestamp")), 2)
+    cache.put(("2022-05-02", None), 3)
+
+    assert cache.invalidate(lambda key: key[0] == "2022-05-01") == 2
+    assert len(cache) == 1
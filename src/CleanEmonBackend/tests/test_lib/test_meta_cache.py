@@ -0,0 +1,52 @@
+from CleanEmonBackend.lib.meta_cache import MetaCache
+
+
+class FakeAdapter:
+    def __init__(self):
+        self.meta = {"size": "100"}
+        self.revision = "1-a"
+        self.fetches = 0
+        self.revision_checks = 0
+
+    def fetch_meta_with_revision(self):
+        self.fetches += 1
+        return dict(self.meta), self.revision
+
+    def fetch_document_revision(self, document):
+        self.revision_checks += 1
+        return self.revision
+
+
+def test_ttl():
+    adapter = FakeAdapter()
+    cache = MetaCache(adapter, ttl=60)
+
+    assert cache.get() == {"size": "100"}
+    assert cache.get() == {"size": "100"}
+    assert adapter.fetches == 1
+    assert adapter.revision_checks == 0
+
+
+def test_revalidation():
+    adapter = FakeAdapter()
+    cache = MetaCache(adapter, ttl=0)
+
+    cache.get()
+    cache.get()
+    assert adapter.fetches == 1
+    assert adapter.revision_checks == 1
+
+    adapter.meta = {"size": "200"}
+    adapter.revision = "2-b"
+    assert cache.get() == {"size": "200"}
+    assert adapter.fetches == 2
+
+
+def test_invalidate():
+    adapter = FakeAdapter()
+    cache = MetaCache(adapter, ttl=60)
+
+    cache.get()
+    cache.invalidate()
+    cache.get()
+    assert adapter.fetches == 2
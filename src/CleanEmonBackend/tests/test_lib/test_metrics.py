@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from CleanEmonBackend.lib.metrics import Counter
+from CleanEmonBackend.lib.metrics import Gauge
+from CleanEmonBackend.lib.metrics import Histogram
+from CleanEmonBackend.lib.metrics import Registry
+from CleanEmonBackend.lib.metrics import load_snapshot
+from CleanEmonBackend.lib.metrics import render
+from CleanEmonBackend.lib.metrics import save_snapshot
+from CleanEmonBackend.lib.metrics import with_labels
+
+
+def test_render():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ["cache"], registry=registry)
+    in_flight = Gauge("in_flight", "In flight", registry=registry)
+    latency = Histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1), registry=registry)
+    Gauge("unused", "Never set", registry=registry)
+
+    requests.inc(cache="memory")
+    requests.inc(2, cache="memory")
+    with in_flight.track_in_progress():
+        assert in_flight.value() == 1
+    for value in [0.05, 0.5, 5]:
+        latency.observe(value, stage="fetch")
+
+    assert render(registry.collect()) == "\n".join([
+        "# HELP in_flight In flight",
+        "# TYPE in_flight gauge",
+        "in_flight 0",
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{stage="fetch",le="0.1"} 1',
+        'latency_seconds_bucket{stage="fetch",le="1"} 2',
+        'latency_seconds_bucket{stage="fetch",le="+Inf"} 3',
+        'latency_seconds_sum{stage="fetch"} 5.55',
+        'latency_seconds_count{stage="fetch"} 3',
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{cache="memory"} 3',
+    ]) + "\n"
+
+
+def test_labels_are_checked():
+    counter = Counter("checked_total", "Checked", ["cache"], registry=None)
+
+    with pytest.raises(ValueError):
+        counter.inc(stage="fetch")
+
+
+def test_snapshot(tmp_path):
+    registry = Registry()
+    Counter("jobs_total", "Jobs", ["result"], registry=registry).inc(result="success")
+    path = str(tmp_path / "snapshot.json")
+
+    save_snapshot(path, registry)
+    snapshot = load_snapshot(path)
+    assert snapshot == registry.collect()
+    assert load_snapshot(str(tmp_path / "missing.json")) == {}
+
+    # Samples of other processes are merged into the same families
+    merged = render(with_labels(registry.collect(), process="api"), with_labels(snapshot, process="disaggregator"))
+    assert merged.count("# TYPE jobs_total counter") == 1
+    assert 'jobs_total{result="success",process="api"} 1' in merged
+    assert 'jobs_total{result="success",process="disaggregator"} 1' in merged
+
+
+def test_concurrent_snapshots(tmp_path):
+    registry = Registry()
+    Counter("jobs_total", "Jobs", ["result"], registry=registry).inc(result="success")
+    path = str(tmp_path / "snapshot.json")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(save_snapshot, path, registry) for _ in range(50)]:
+            future.result()
+
+    assert load_snapshot(path) == registry.collect()
+    assert os.listdir(str(tmp_path)) == ["snapshot.json"]
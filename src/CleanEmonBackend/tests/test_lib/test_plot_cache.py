@@ -0,0 +1,54 @@
+import os
+
+from CleanEmonBackend.lib.plot_cache import PlotCache
+from CleanEmonBackend.lib.plot_cache import plot_key
+
+
+def test_plot_key():
+    key = plot_key("2022-05-15", ["Power", "kwh"], 12, 6, 100)
+
+    assert key.startswith("2022-05-15-")
+    assert key == plot_key("2022-05-15", ["kwh", "power"], 12.0, 6, 100)
+    assert key != plot_key("2022-05-15", ["kwh", "power"], 12, 6, 200)
+    assert key != plot_key("2022-05-16", ["kwh", "power"], 12, 6, 100)
+    assert plot_key("2022-05-15", None, 12, 6, 100) == plot_key("2022-05-15", [], 12, 6, 100)
+
+
+def test_put_get(tmp_path):
+    cache = PlotCache(str(tmp_path / "plots"))
+    key = plot_key("2022-05-15", None, 12, 6, 100)
+
+    assert cache.get(key) is None
+
+    path = cache.put(key, lambda f_out: f_out.write(b"png"))
+    assert cache.get(key) == path
+    with open(path, "rb") as f_in:
+        assert f_in.read() == b"png"
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert [name for name in os.listdir(tmp_path / "plots")] == [os.path.basename(path)]
+
+
+def test_eviction(tmp_path):
+    cache = PlotCache(str(tmp_path), max_bytes=25)
+
+    paths = []
+    for day in range(1, 5):
+        key = plot_key(f"2022-05-0{day}", None, 12, 6, 100)
+        paths.append(cache.put(key, lambda f_out: f_out.write(b"x" * 10)))
+        os.utime(paths[-1], (day, day))
+
+    # Only the two most recently used plots fit in the budget
+    assert cache.size <= 25
+    assert [os.path.exists(path) for path in paths] == [False, False, True, True]
+
+
+def test_invalidate(tmp_path):
+    cache = PlotCache(str(tmp_path))
+
+    for date in ("2022-05-14", "2022-05-15", "2022-05-10..2022-05-16", "2022-05-16..2022-05-20"):
+        cache.put(plot_key(date, None, 12, 6, 100), lambda f_out: f_out.write(b"png"))
+        cache.put(plot_key(date, ["power"], 12, 6, 100), lambda f_out: f_out.write(b"png"))
+
+    assert cache.invalidate("2022-05-15") == 4
+    assert len(cache) == 4
@@ -5,6 +5,7 @@ import os
 
 from CleanEmonCore.models import EnergyData
 from CleanEmonBackend.lib.plots import plot_data
+from CleanEmonBackend.lib.plots import render_plot
 
 
 @pytest.fixture
@@ -20,3 +21,22 @@ def clean_data_df():
 
 def test_plot_data(clean_data_df):
     plot_data(clean_data_df, columns=["timestamp", "power", "pred_fridge"])
+
+
+def test_render_plot_concurrently(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    energy_data = EnergyData("2022-05-15", [{"timestamp": 1652572800 + 5 * i, "power": float(i % 7), "kwh": i / 100}
+                                            for i in range(100)])
+
+    def render(i):
+        f_out = str(tmp_path / f"{i}.png")
+        render_plot(energy_data, f_out, columns=["power"] if i % 2 else None, width=4, height=3, dpi=50)
+        return f_out
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        paths = list(executor.map(render, range(8)))
+
+    for path in paths:
+        with open(path, "rb") as f_in:
+            assert f_in.read(8) == b"\x89PNG\r\n\x1a\n"
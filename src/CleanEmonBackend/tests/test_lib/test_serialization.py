@@ -0,0 +1,24 @@
+import json
+
+import numpy as np
+import pytest
+
+from CleanEmonBackend.lib import serialization
+from CleanEmonBackend.lib.serialization import dumps
+
+DATA = {"date": "2000-01-01", "energy_data": [{"timestamp": 1, "power": 1.5, "temp": None}], "count": np.int64(3)}
+
+
+@pytest.mark.skipif(serialization.orjson is None, reason="orjson is not installed")
+def test_orjson_matches_json(monkeypatch):
+    fast = dumps(DATA)
+    monkeypatch.setattr(serialization, "orjson", None)
+
+    assert dumps(DATA) == fast
+
+
+def test_dumps(monkeypatch):
+    monkeypatch.setattr(serialization, "orjson", None)
+
+    assert json.loads(dumps(DATA)) == {**DATA, "count": 3}
+    assert dumps({"values": np.arange(3)}) == b'{"values":[0,1,2]}'
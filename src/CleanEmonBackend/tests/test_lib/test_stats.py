@@ -0,0 +1,23 @@
+import numpy as np
+
+from CleanEmonBackend.lib.stats import describe
+
+
+def test_describe():
+    values = np.array([np.nan, 1, 2, 3, 4, 5], dtype=float)
+
+    stats = describe(values, percentiles=[0, 50, 100])
+
+    assert stats["count"] == 5
+    assert stats["min"] == 1
+    assert stats["max"] == 5
+    assert stats["mean"] == 3
+    assert stats["percentiles"] == {"0": 1, "50": 3, "100": 5}
+
+
+def test_describe_empty():
+    stats = describe(np.array([np.nan]), percentiles=[50])
+
+    assert stats["count"] == 0
+    assert stats["mean"] is None
+    assert stats["percentiles"] == {"50": None}
@@ -0,0 +1,44 @@
+import numpy as np
+
+from CleanEmonCore.models import EnergyData
+from CleanEmonBackend.lib.summaries import DaySummary
+from CleanEmonBackend.lib.summaries import summarize_energy_data
+from CleanEmonBackend.lib.summaries import load_summary
+from CleanEmonBackend.lib.summaries import store_summary
+from CleanEmonBackend.lib.summaries import drop_summary
+
+DUMMY_DATE = "2000-01-01"
+
+
+def test_summarize():
+    energy_data = EnergyData(DUMMY_DATE, [
+        {"timestamp": 0, "kwh": None},
+        {"timestamp": 5, "kwh": 0},
+        {"timestamp": 10, "kwh": 10.5},
+        {"timestamp": 30, "kwh": 11},
+        {"timestamp": 35, "kwh": 12.5},
+        {"timestamp": 40, "kwh": np.nan},
+    ])
+
+    summary = summarize_energy_data(DUMMY_DATE, energy_data)
+
+    assert summary == DaySummary(DUMMY_DATE, first_kwh=10.5, last_kwh=12.5, records=6, gaps=1)
+    assert summary.consumption == 2
+
+
+def test_summarize_empty():
+    summary = summarize_energy_data(DUMMY_DATE, EnergyData())
+
+    assert summary.consumption == 0
+    assert summary.records == 0
+
+
+def test_store_load(tmp_path):
+    summary = DaySummary(DUMMY_DATE, 1, 2, 3, 4)
+
+    assert load_summary(str(tmp_path), DUMMY_DATE) is None
+    store_summary(str(tmp_path), summary)
+    assert load_summary(str(tmp_path), DUMMY_DATE) == summary
+
+    drop_summary(str(tmp_path), DUMMY_DATE)
+    assert load_summary(str(tmp_path), DUMMY_DATE) is None
@@ -0,0 +1,68 @@
+import pytest
+
+from CleanEmonBackend.lib.exceptions import BadDateError
+from CleanEmonBackend.lib.exceptions import BadDateRangeError
+from CleanEmonBackend.scripts import disaggregate as script
+from CleanEmonBackend.scripts.disaggregate import expand_dates
+from CleanEmonBackend.scripts.disaggregate import load_checkpoint
+
+
+def test_expand_dates():
+    assert expand_dates("2022-05-01") == ["2022-05-01"]
+    assert expand_dates("2022-05-30..2022-06-02", "2022-05-31", "2022-04-01") == [
+        "2022-05-30", "2022-05-31", "2022-06-01", "2022-06-02", "2022-04-01"
+    ]
+
+    with pytest.raises(BadDateError):
+        expand_dates("2022-05")
+    with pytest.raises(BadDateRangeError):
+        expand_dates("2022-05-02..2022-05-01")
+
+
+def test_checkpoint_resume(monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    processed = []
+
+    def failing_update(date):
+        if date == "2022-05-03":
+            raise KeyboardInterrupt
+        processed.append(date)
+
+    monkeypatch.setattr(script, "update", failing_update)
+    with pytest.raises(KeyboardInterrupt):
+        script.disaggregate("2022-05-01..2022-05-04", no_prompt=True, checkpoint=checkpoint)
+    assert load_checkpoint(checkpoint) == {"2022-05-01", "2022-05-02"}
+
+    monkeypatch.setattr(script, "update", processed.append)
+    script.disaggregate("2022-05-01..2022-05-04", no_prompt=True, checkpoint=checkpoint)
+    assert processed == ["2022-05-01", "2022-05-02", "2022-05-03", "2022-05-04"]
+    assert load_checkpoint(checkpoint) == set()
+
+
+def test_serial_failures(monkeypatch, tmp_path, capsys):
+    checkpoint = str(tmp_path / "checkpoint")
+
+    def failing_update(date):
+        if date == "2022-05-02":
+            raise ValueError("no data")
+
+    monkeypatch.setattr(script, "update", failing_update)
+    script.disaggregate("2022-05-01..2022-05-03", no_prompt=True, checkpoint=checkpoint)
+
+    # A failed date does not stop the run, but it keeps the checkpoint, so that a re-run retries it
+    assert load_checkpoint(checkpoint) == {"2022-05-01", "2022-05-03"}
+    output = capsys.readouterr().out
+    assert "Disaggregated 2/3 dates" in output
+    assert "2022-05-02: ValueError: no data" in output
+
+
+def test_jobs_are_capped(monkeypatch, tmp_path, capsys):
+    used = []
+    monkeypatch.setattr(script, "_disaggregate_in_parallel",
+                        lambda dates, jobs, checkpoint, house: used.append(jobs) or {})
+
+    script.disaggregate("2022-05-01..2022-05-08", no_prompt=True, jobs=8, checkpoint=str(tmp_path / "checkpoint"))
+
+    # The inference is serialized, so more jobs would only wait for it
+    assert used == [script.MAX_JOBS]
+    assert f"Using {script.MAX_JOBS} jobs instead of 8" in capsys.readouterr().out